@@ -1,11 +1,15 @@
 import os
-from operator import or_
-from sqlalchemy import or_  # Operadores or_  do SQLAlchemy para construção de queries complexas
+import time
+from sqlalchemy.orm import joinedload, load_only
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-from models import Clientes, db, Admin, Veiculos, VehicleType, Categoria, Reservation
-from utils import allowed_file
+from models import Clientes, db, Admin, Veiculos, VehicleType, Categoria, Reservation, ImageFile, lock_for_write
+from db_engine import use_read_engine
+from search import vehicle_text_filter
+from user_cache import invalidate_user
+from images import process_image, publish_upload, remove_image_files, remove_variants, store_upload
+from utils import allowed_file, keyset_paginate, normalize_text, prefix_filter, integer_prefix_filter
 from functools import wraps  # Adicionado este import para os decorators personalizados
 from datetime import datetime
 
@@ -28,129 +32,125 @@ def admin_required(f):  # É utilizado a funão 'f' para adicionar verificação
     return decorated_function  # Retorna a função decorada.
 
 
+# Número de dias à frente em que uma manutenção ou legalização prevista conta como "a fazer" no dashboard e na pesquisa
+# de veículos (?due=maintenance ou ?due=legalization)
+DUE_SOON_DAYS = 30
+
+# Cache do dashboard do admin (snapshot dos contadores e momento em que expira)
+_dashboard_cache = {'expires_at': 0.0, 'data': None}
+
+
+def get_dashboard_counts():
+    """
+    Obtém os contadores do dashboard do admin.
+
+    Os veículos são contados numa única query agrupada por tipo (Veiculos.count_by_type_and_state).
+    Se DASHBOARD_CACHE_TTL for maior que zero, o resultado é guardado durante esse número de
+    segundos, para que vários refreshes seguidos não voltem a consultar a base de dados.
+
+    Returns:
+        dict: Variáveis usadas pelo template admin/admin_home.html
+    """
+    ttl = current_app.config.get('DASHBOARD_CACHE_TTL', 0)
+    now = time.monotonic()
+
+    if ttl and _dashboard_cache['data'] is not None and now < _dashboard_cache['expires_at']:
+        return _dashboard_cache['data']
+
+    counts = Veiculos.count_by_type_and_state()
+    cars = counts[VehicleType.CARRO]
+    motorcycles = counts[VehicleType.MOTA]
+
+    data = {
+        'car_count': cars['total'],
+        'motorcycle_count': motorcycles['total'],
+        'total_vehicles': cars['total'] + motorcycles['total'],
+        'cars_available': cars['disponivel'],
+        'cars_reserved': cars['reservado'],
+        'cars_unavailable': cars['manutencao'],
+        'motorcycle_available': motorcycles['disponivel'],
+        'motorcycle_reserved': motorcycles['reservado'],
+        'motorcycle_unavailable': motorcycles['manutencao'],
+        'total_clients': Clientes.query.count(),  # Contagem dos clientes
+        # Veículos com manutenção/legalização prevista nos próximos DUE_SOON_DAYS dias ou em atraso (pesquisas por
+        # intervalo sobre os índices de next_maintenance e next_legalization_date)
+        'maintenance_due': Veiculos.query.filter(Veiculos.maintenance_due_filter(DUE_SOON_DAYS)).count(),
+        'legalization_due': Veiculos.query.filter(Veiculos.legalization_due_filter(DUE_SOON_DAYS)).count(),
+        'due_soon_days': DUE_SOON_DAYS,
+    }
+
+    if ttl:
+        _dashboard_cache['data'] = data
+        _dashboard_cache['expires_at'] = now + ttl
+
+    return data
+
+
+def invalidate_dashboard_counts():
+    """Descarta os contadores do dashboard em cache. Chamada depois de cada alteração que muda os contadores (veículos,
+    estados, reservas, clientes e manutenções/legalizações), para o dashboard não os mostrar desatualizados."""
+    _dashboard_cache['data'] = None
+
+
 @bp.route('/admin/admin_home', methods=['GET'])
+@use_read_engine  # Só consulta, os SELECTs usam o engine só de leitura
 @admin_required
 def admin_home():
-    # Obtém a data e hora atual
-    current_datetime = datetime.now()
-
-    # Contagem dos veículos que existem no sistema consoante o VehicleType
-    car_count = Veiculos.query.filter_by(type=VehicleType.CARRO).count()
-    motorcycle_count = Veiculos.query.filter_by(type=VehicleType.MOTA).count()
-
-    # Calcula o total de veículos somando carros e motas
-    total_vehicles = car_count + motorcycle_count
-
-    # Contagem de carros por status
-
-    # Conta carros que estão:
-    # - Disponíveis (status=True)
-    # - Não estão em manutenção (in_maintenance=False)
-    # - Não têm data de disponibilidade futura OU a data já passou
-    cars_available = Veiculos.query.filter(Veiculos.type == VehicleType.CARRO,  # Filtra apenas veículos pelo tipo
-                                           Veiculos.status == True,
-                                           Veiculos.in_maintenance == False,
-                                           or_(
-                                               Veiculos.available_from.is_(None),
-                                               Veiculos.available_from <= current_datetime)).count()
-
-    # Conta carros que estão:
-    # - Reservados (is_reserved=True)
-    # - Com data de disponibilidade futura (Veiculos.available_from > current_datetime)
-    cars_reserved = Veiculos.query.filter(Veiculos.type == VehicleType.CARRO,
-                                          Veiculos.is_reserved == True,
-                                          Veiculos.available_from > current_datetime).count()
-
-    # Conta carros em manutenção que:
-    # - Têm data de início de manutenção definida
-    # - Têm data de fim de manutenção definida
-    # - A manutenção já começou (data atual >= data início)
-    # - A manutenção ainda não terminou (data atual <= data fim)
-    cars_unavailable = Veiculos.query.filter(Veiculos.type == VehicleType.CARRO,
-                                             Veiculos.maintenance_start.isnot(None),  # Tem data de início de
-                                             # manutenção definida
-                                             Veiculos.maintenance_end.isnot(None),  # Tem data de fim de manutenção
-                                             # definida
-                                             Veiculos.maintenance_start <= current_datetime,  # A data de início já
-                                             # passou ou é agora
-                                             Veiculos.maintenance_end >= current_datetime).count()  # A data de fim
-    # ainda não chegou
-
-    # Contagem de motos disponíveis e indisponíveis
-
-    # Conta motos que estão:
-    # - Disponíveis (status=True)
-    # - Não estão em manutenção (in_maintenance=False)
-    # - Não têm data de disponibilidade futura OU a data já passou
-    motorcycle_available = Veiculos.query.filter(Veiculos.type == VehicleType.MOTA,
-                                                 Veiculos.status == True,
-                                                 Veiculos.in_maintenance == False,
-                                                 or_(
-                                                     Veiculos.available_from.is_(None),
-                                                     Veiculos.available_from <= current_datetime)).count()
-
-    # Conta motos que estão:
-    # - Reservados (is_reserved=True)
-    # - Com data de disponibilidade futura (Veiculos.available_from > current_datetime)
-    motorcycle_reserved = Veiculos.query.filter(Veiculos.type == VehicleType.MOTA,
-                                                Veiculos.is_reserved == True,
-                                                Veiculos.available_from > current_datetime).count()
-
-    # Conta motos em manutenção que:
-    # - Têm data de início de manutenção definida
-    # - Têm data de fim de manutenção definida
-    # - A manutenção já começou (data atual >= data início)
-    # - A manutenção ainda não terminou (data atual <= data fim)
-    motorcycle_unavailable = Veiculos.query.filter(Veiculos.type == VehicleType.MOTA,
-                                                   Veiculos.maintenance_start.isnot(None),
-                                                   Veiculos.maintenance_end.isnot(None),
-                                                   Veiculos.maintenance_start <= current_datetime,
-                                                   Veiculos.maintenance_end >= current_datetime).count()
-
-    # Contagem dos clientes
-    total_clients = Clientes.query.count()
+    # Contagem dos veículos por tipo (carros/motas) e por estado (disponível, reservado, em manutenção), mais o total
+    # de clientes
+    dashboard_counts = get_dashboard_counts()
 
     # Renderiza o template HTML passando todas as variáveis calculadas
-    return render_template('admin/admin_home.html', VehicleType=VehicleType, car_count=car_count,
-                           motorcycle_count=motorcycle_count, total_clients=total_clients,
-                           total_vehicles=total_vehicles, cars_available=cars_available, cars_reserved=cars_reserved,
-                           cars_unavailable=cars_unavailable, motorcycle_available=motorcycle_available,
-                           motorcycle_reserved=motorcycle_reserved, motorcycle_unavailable=motorcycle_unavailable)
+    return render_template('admin/admin_home.html', VehicleType=VehicleType, **dashboard_counts)
 
 
 # ------------------------------- Admin_Pag Clients --------------------------------------
 # Pesquisar clientes e obter todos os clientes
 @bp.route('/admin/clients', methods=['GET'])
+@use_read_engine  # Só consulta, os SELECTs usam o engine só de leitura
 @admin_required
 def clients():
     # Obtém os parâmetros de busca, se não existirem, retorna string vazia
     nome = request.args.get('nome', '')
     apelido = request.args.get('apelido', '')
     data_nascimento = request.args.get('data_nascimento', '')
-    nif = request.args.get('nif', '')
+    nif = request.args.get('nif', '').strip()
+    telefone = request.args.get('telefone', '').strip()
 
     # Inicia a query base para buscar clientes
     query = Clientes.query
 
-    # Se houver nome na busca, filtra clientes que contenham esse nome
-    if nome:
-        query = query.filter(Clientes.nome.ilike(f'%{nome}%'))
-    # Se houver apelido, filtra clientes que contenham esse apelido
-    if apelido:
-        query = query.filter(Clientes.apelido.ilike(f'%{apelido}%'))
+    # Nome e apelido são pesquisados por prefixo nas colunas normalizadas (sem acentos e em minúsculas), que têm
+    # índice, em vez de um ILIKE '%...%' que obriga a percorrer a tabela toda
+    if normalize_text(nome):
+        query = query.filter(prefix_filter(Clientes.nome_pesquisa, normalize_text(nome)))
+    if normalize_text(apelido):
+        query = query.filter(prefix_filter(Clientes.apelido_pesquisa, normalize_text(apelido)))
     # Se houver data de nascimento, filtra clientes com essa data exata
     if data_nascimento:
         query = query.filter(Clientes.data_nascimento == datetime.strptime(data_nascimento, '%Y-%m-%d').date())
-    # Se houver NIF, filtra clientes que contenham esse NIF
+    # NIF completo (pesquisa exata) ou início do NIF, como intervalos numéricos sobre o índice da coluna
     if nif:
-        query = query.filter(Clientes.nif.ilike(f'%{nif}%'))
-
-    # Executa a query e obtém todos os resultados
-    clientes = query.all()
+        if nif.isdigit():
+            query = query.filter(integer_prefix_filter(Clientes.nif, nif))
+        else:
+            flash('O NIF só pode conter números!', 'error')
+            query = query.filter(db.false())
+    # Telefone pesquisado pelo início do número
+    if telefone:
+        query = query.filter(prefix_filter(Clientes.telefone, telefone))
+
+    # Paginação por cursor sobre o id (a página seguinte começa a seguir ao último cliente mostrado)
+    per_page = min(request.args.get('per_page', current_app.config['ADMIN_PAGE_SIZE'], type=int) or 1,
+                   current_app.config['ADMIN_MAX_PAGE_SIZE'])
+    pagination = keyset_paginate(query, [Clientes.id], per_page,
+                                 after=request.args.get('after'), before=request.args.get('before'),
+                                 with_total=request.args.get('count') == '1')
+    clientes = pagination.items
 
     # Verifica se algum filtro foi aplicado (retorna True se qualquer filtro foi usado), por esse motivo que
     # utilizado o bool para que converte um valor para booleano (True ou False)
-    filtros_aplicados = bool(nome or apelido or data_nascimento or nif)
+    filtros_aplicados = bool(nome or apelido or data_nascimento or nif or telefone)
 
     # Caso não for encontrado clientes e há filtros, mostra mensagem de não encontrado
     if not clientes and filtros_aplicados:
@@ -159,11 +159,16 @@ def clients():
     elif not clientes:
         flash('No data to show!', 'warning')
 
+    # Parâmetros de pesquisa a manter nos links de paginação
+    search_args = {key: value for key, value in request.args.items()
+                   if value and key not in ('after', 'before', 'count')}
+
     # Renderiza o template com os resultados e parâmetros de busca
     return render_template('admin/clients.html', clientes=clientes,
                            nome=nome, apelido=apelido,
-                           data_nascimento=data_nascimento, nif=nif,
-                           filtros_aplicados=filtros_aplicados)
+                           data_nascimento=data_nascimento, nif=nif, telefone=telefone,
+                           filtros_aplicados=filtros_aplicados,
+                           pagination=pagination, search_args=search_args)
 
 
 # Rota para limpar os filtros de pesquisa e voltar à listagem inicial
@@ -194,6 +199,7 @@ def edit_clients(id):  # A função edit_clients(id) utiliza o id como parâmetr
         try:
             # Tenta salvar as alterações no banco de dados
             db.session.commit()
+            invalidate_user(cliente)  # O cliente pode estar com sessão iniciada, retira os dados antigos da cache
             flash('Cliente atualizado com sucesso', 'success')
             return redirect(url_for('admin.clients'))
         except Exception as e:
@@ -214,16 +220,20 @@ def delete_client(id):
 
     db.session.delete(cliente)  # Remove o cliente do banco de dados
     db.session.commit()  # Salva a alteração
+    invalidate_user(cliente)  # Um cliente apagado deixa de poder ser carregado a partir da cache
+    invalidate_dashboard_counts()
     flash(f"O cliente {cliente.nome} foi apagado dos registros!", "success")
     return redirect(url_for('admin.clients'))  # Redireciona para a lista de clientes
 
 
 # Rota para pesquisa de veículos no painel admin que aceita o método GET
 @bp.route('/admin/search_vehicles', methods=['GET'])
+@use_read_engine  # Só consulta, os SELECTs usam o engine só de leitura
 @admin_required
 def search_vehicles():
     # Obtém os parâmetros, se não existirem retorna string vazia
     tipo = request.args.get('type', '')
+    pesquisa = request.args.get('q', '')
     marca = request.args.get('brand', '')
     modelo = request.args.get('model', '')
     ano = request.args.get('year', '')
@@ -232,9 +242,17 @@ def search_vehicles():
     bagagem = request.args.get('bags', '')
     preco_dia = request.args.get('price_per_day', '')
     categoria_nome = request.args.get('categoria', '')
-
-    # Inicia a query base para veículos
-    query_vehicle = Veiculos.query
+    a_fazer = request.args.get('due', '')  # 'maintenance' ou 'legalization'
+
+    # Inicia a query base para veículos. A categoria é carregada no mesmo SELECT (joinedload) em vez de uma query por
+    # linha da tabela, e só são lidas as colunas mostradas
+    query_vehicle = Veiculos.query.options(
+        load_only(Veiculos.type, Veiculos.brand, Veiculos.model, Veiculos.year, Veiculos.seats, Veiculos.bags,
+                  Veiculos.transmission, Veiculos.fuel_consumption, Veiculos.price_per_day, Veiculos.status,
+                  Veiculos.is_reserved, Veiculos.available_from, Veiculos.maintenance_start,
+                  Veiculos.maintenance_end, Veiculos.next_maintenance, Veiculos.next_legalization_date,
+                  Veiculos.categoria_id),
+        joinedload(Veiculos.categoria).load_only(Categoria.nome))
 
     if tipo:  # Se foi fornecido um tipo de veículo
         try:
@@ -244,19 +262,19 @@ def search_vehicles():
             # Se tipo for inválido, mostra mensagem de erro
             flash(f'Invalid vehicle type: {tipo}', 'error')
 
-    # Filtra por marca se fornecida, usando LIKE case-insensitive, pois, busca textos sem diferenciar maiúsculas de
-    # minúsculas no SQL.
-    if marca:
-        query_vehicle = query_vehicle.filter(Veiculos.brand.ilike(f'%{marca}%'))
-    # Filtra por modelo se fornecido, usando LIKE case-insensitive
-    if modelo:
-        query_vehicle = query_vehicle.filter(Veiculos.model.ilike(f'%{modelo}%'))
+    # Pesquisa de texto livre, por marca e por modelo através do índice FTS dos veículos (ver search.py), por prefixo
+    # de palavra e sem distinção entre maiúsculas/minúsculas nem acentos
+    for text_filter in (vehicle_text_filter(pesquisa),
+                        vehicle_text_filter(marca, columns=('brand',)),
+                        vehicle_text_filter(modelo, columns=('model',))):
+        if text_filter is not None:
+            query_vehicle = query_vehicle.filter(text_filter)
     # Filtra por ano se fornecido, convertendo-o para inteiro
     if ano:
         query_vehicle = query_vehicle.filter(Veiculos.year == int(ano))
-    # Filtra por transmissão se fornecido, usando LIKE case-insensitive
+    # Filtra por transmissão se fornecido ('A' ou 'M', comparação exata sobre o índice da coluna)
     if transmissao:
-        query_vehicle = query_vehicle.filter(Veiculos.transmission.ilike(f'%{transmissao}%'))
+        query_vehicle = query_vehicle.filter(Veiculos.transmission == transmissao.strip().title())
     # Filtra por número de assentos se fornecido
     if assentos:
         query_vehicle = query_vehicle.filter(Veiculos.seats == int(assentos))
@@ -270,16 +288,28 @@ def search_vehicles():
     if categoria_nome:  # Usa a função join() para conectar duas tabelas em uma consulta db, para este caso conecta
         # a tabela Veiculos com a tabela Categoria
         query_vehicle = query_vehicle.join(Veiculos.categoria).filter(Categoria.nome == categoria_nome)
-
-    # Executa a query e obtém todos os resultados
-    veiculos = query_vehicle.all()
+    # Veículos com manutenção ou legalização prevista nos próximos DUE_SOON_DAYS dias (ou em atraso)
+    if a_fazer == 'maintenance':
+        query_vehicle = query_vehicle.filter(Veiculos.maintenance_due_filter(DUE_SOON_DAYS))
+    elif a_fazer == 'legalization':
+        query_vehicle = query_vehicle.filter(Veiculos.legalization_due_filter(DUE_SOON_DAYS))
+
+    # Paginação por cursor sobre (marca, modelo, id): só é carregada uma página de cada vez e as páginas mais
+    # avançadas custam o mesmo que a primeira. O total só é contado quando pedido (?count=1)
+    per_page = min(request.args.get('per_page', current_app.config['ADMIN_PAGE_SIZE'], type=int) or 1,
+                   current_app.config['ADMIN_MAX_PAGE_SIZE'])
+    pagination = keyset_paginate(query_vehicle, [Veiculos.brand, Veiculos.model, Veiculos.id], per_page,
+                                 after=request.args.get('after'), before=request.args.get('before'),
+                                 with_total=request.args.get('count') == '1')
+    veiculos = pagination.items
 
     # Obtém lista de todas as categorias para o formulário
     categorias = Categoria.query.all()
 
     # Verifica se algum filtro foi aplicado
     filtros_veiculos = bool(
-        tipo or marca or modelo or ano or transmissao or assentos or bagagem or preco_dia or categoria_nome)
+        pesquisa or tipo or marca or modelo or ano or transmissao or assentos or bagagem or preco_dia or categoria_nome
+        or a_fazer)
 
     # Se não encontrou veículos e há filtros, mostra aviso
     if not veiculos and filtros_veiculos:
@@ -288,12 +318,17 @@ def search_vehicles():
     elif not veiculos:
         flash('No data to show!', 'warning')
 
+    # Parâmetros de pesquisa a manter nos links de paginação
+    search_args = {key: value for key, value in request.args.items()
+                   if value and key not in ('after', 'before', 'count')}
+
     # Renderiza template com todos os dados necessários
     return render_template('admin/search_vehicles.html', veiculos=veiculos,
-                           tipo=tipo, marca=marca,
+                           pesquisa=pesquisa, tipo=tipo, marca=marca,
                            modelo=modelo, ano=ano, transmissao=transmissao, assentos=assentos, bagagem=bagagem,
-                           preco_dia=preco_dia, categorias=categorias,
-                           filtros_veiculos=filtros_veiculos, VehicleType=VehicleType)
+                           preco_dia=preco_dia, categorias=categorias, a_fazer=a_fazer,
+                           filtros_veiculos=filtros_veiculos, VehicleType=VehicleType,
+                           pagination=pagination, search_args=search_args)
 
 
 # Rota para limpar os filtros de pesquisa
@@ -398,6 +433,10 @@ def add_vehicles():
                 # O valor do campo categoria_id é obtido do formulário enviado pelo usuário que por sua vez vai
                 # busca-lo a categoria específica no banco de dados
                 categoria = Categoria.query.get(request.form['categoria_id'])
+
+                # Guarda as imagens enviadas, antes de criar o veículo (ver store_vehicle_images)
+                image_paths, _ = store_vehicle_images(request.files.getlist('image'))
+
                 # new_vehicle cria uma nova instância de Veículos com os dados do formulário
                 new_vehicle = Veiculos(
                     type=VehicleType[request.form['type']],
@@ -421,37 +460,11 @@ def add_vehicles():
                     # Data e hora de fim da manutenção
                 )
 
-                # Cria uma lista vazia para armazenar os caminhos das imagens
-                image_paths = []
-
-                # Verifica se existe algum arquivo de imagem no request
-                if 'image' in request.files:
-                    files = request.files.getlist('image')  # Obtém todos os arquivos enviados com o nome 'image'
-
-                    # Itera sobre cada arquivo enviado
-                    for file in files:
-                        if file and allowed_file(file.filename):  # Verifica se o arquivo existe e se tem uma extensão
-                            # permitida
-                            filename = secure_filename(file.filename)   # Valida o nome do ficheiro para evitar
-                            # problemas de segurança
-                            upload_folder = current_app.config['UPLOAD_FOLDER']  # Obtém o caminho da pasta de upload
-                            # configurada na aplicação
-
-                            # Verifica se a pasta de upload existe, se não, cria
-                            if not os.path.exists(upload_folder):
-                                os.makedirs(upload_folder)
-                            file_path = os.path.join(upload_folder, filename)   # Cria o caminho completo onde o
-                            # arquivo será salvo
-                            file.save(file_path)   # Salva o arquivo no caminho especificado
-                            if os.path.exists(file_path):
-                                image_paths.append(f'uploads/{filename}')   # Adiciona o caminho relativo da imagem à
-                                # list
-
-                # Associa as imagens ao novo veículo usando o método set_imagens
-                new_vehicle.set_imagens(image_paths)
-
+                new_vehicle.set_imagens(image_paths)  # Associa as imagens ao novo veículo
                 db.session.add(new_vehicle)  # adiciona um novo veículo ao banco de dados
                 db.session.commit()  # Esta linha confirma as alterações feitas no banco de dados
+                invalidate_dashboard_counts()
+                queue_image_processing(new_vehicle.id, image_paths)  # Variantes geradas em segundo plano
                 flash('Veículo adicionado com sucesso!', 'success')
 
             except Exception as e:
@@ -510,6 +523,7 @@ def edit_vehicle(
 
             # Commit das alterações no banco de dados
             db.session.commit()
+            invalidate_dashboard_counts()  # O tipo do veículo pode ter mudado
             flash('Veículo atualizado com sucesso!', 'success')
             return redirect(url_for('admin.edit_type', id=veiculo.id))
 
@@ -521,6 +535,46 @@ def edit_vehicle(
                            categorias=categorias)
 
 
+# Registo de uma manutenção ou legalização feita ao veículo (formulário da página de edição do veículo)
+@bp.route('/admin/vehicle_event/<int:id>', methods=['POST'])
+@admin_required
+def add_vehicle_event(id):
+    """
+    Regista uma manutenção ou uma legalização no histórico do veículo. As datas da última e da próxima
+    manutenção/legalização do veículo (usadas no dashboard e na pesquisa ?due=) são atualizadas a partir do histórico.
+
+    Args:
+        id (int): ID do veículo
+
+    Returns:
+        Response: Redireciona para a página de edição do veículo
+    """
+    veiculo = Veiculos.query.get_or_404(id)
+
+    try:
+        event_date = datetime.strptime(request.form['event_date'], '%Y-%m-%d').date()
+        next_date = request.form.get('next_date')
+        next_date = datetime.strptime(next_date, '%Y-%m-%d').date() if next_date else None
+        if next_date and next_date <= event_date:
+            raise ValueError('a próxima data tem de ser posterior à data do registo')
+        description = request.form.get('description', '').strip()
+
+        if request.form.get('event_type') == 'legalization':
+            veiculo.add_legalization_event(event_date, description, next_date)
+            flash('Legalização registada com sucesso!', 'success')
+        else:
+            veiculo.add_maintenance_event(event_date, description, next_date)
+            flash('Manutenção registada com sucesso!', 'success')
+        db.session.commit()
+        invalidate_dashboard_counts()  # Os contadores de manutenções/legalizações a fazer mudaram
+
+    except (KeyError, ValueError) as e:
+        db.session.rollback()
+        flash(f'Erro ao registar o evento: {str(e)}', 'error')
+
+    return redirect(url_for('admin.edit_vehicle', id=veiculo.id))
+
+
 # Status e manutenção dos veículos
 @bp.route('/admin/toggle_vehicle_status/<int:id>', methods=['GET', 'POST'])
 @admin_required
@@ -581,6 +635,7 @@ def toggle_vehicle_status(id):
                 vehicle.maintenance_end = None
                 vehicle.available_from = None
                 db.session.commit()
+                invalidate_dashboard_counts()
 
                 # Limpa os dados temporários da sessão
                 _clear_session_data()
@@ -668,6 +723,7 @@ def toggle_vehicle_status(id):
                     vehicle.available_from = None
 
                 db.session.commit()
+                invalidate_dashboard_counts()
 
                 # Limpa os dados temporários da sessão
                 _clear_session_data()
@@ -698,6 +754,7 @@ def toggle_vehicle_status(id):
                     db.session.delete(existing_reservation)
 
                 db.session.commit()
+                invalidate_dashboard_counts()
 
                 _clear_session_data()
                 flash('Status do veículo revertido para "Ativo"!', 'warning')
@@ -740,41 +797,21 @@ def replace_img(id):
 
     # Rota para apagar imagens dos veículos, se necessário
     if request.args.get('delete_image'):
-        return delete_vehicle_image(id, request.args.get('delete_image'))
+        return delete_vehicle_image(id, request.args.get('delete_image', type=int))
 
     if request.method == 'POST':
         try:
-            image_paths = []   # Inicia uma lista vazia para guardar os caminhos das novas imagens
-
             # Verifica se foram enviadas imagens no formulário
             if 'image' in request.files:
-                files = request.files.getlist('image')   # Obtém todas as imagens enviadas
-
-                # Para cada ficheiro enviado
-                for file in files:
-                    if file and allowed_file(file.filename):  # Verifica se o ficheiro existe e tem uma extensão
-                        # permitida
-                        filename = secure_filename(file.filename)  # Limpa o nome do ficheiro para garantir segurança
-                        upload_folder = current_app.config['UPLOAD_FOLDER']  # Obtém o caminho da pasta onde as
-                        # imagens serão guardadas
-
-                        # Cria a pasta de upload se não existir
-                        if not os.path.exists(upload_folder):
-                            os.makedirs(upload_folder)
-
-                        # Cria o caminho completo do ficheiro
-                        file_path = os.path.join(upload_folder, filename)
-                        file.save(file_path)  # Guarda o ficheiro no sistema
-
-                        # Verifica se o ficheiro foi guardado com sucesso
-                        if os.path.exists(file_path):
-                            image_paths.append(f'uploads/{filename}')  # Adiciona o caminho relativo à lista
-
-                # Atualiza as imagens do veículo no banco de dados
+                # Guarda as novas imagens, que substituem as imagens atuais do veículo
+                image_paths, unreferenced = store_vehicle_images(request.files.getlist('image'),
+                                                                 released=veiculo.get_imagens())
                 veiculo.set_imagens(image_paths)
 
-                # Commit das alterações no banco de dados
+                # Commit das alterações no banco de dados, e só depois apaga os ficheiros das imagens substituídas
                 db.session.commit()
+                remove_unreferenced_images(unreferenced)
+                queue_image_processing(veiculo.id, image_paths)  # Variantes geradas em segundo plano
                 flash('Veículo atualizado com sucesso!', 'success')
                 return redirect(url_for('admin.replace_img', id=veiculo.id))  # Redireciona de volta para a página de
                 # substituição de imagens
@@ -784,37 +821,107 @@ def replace_img(id):
             db.session.rollback()  # Desfaz todas as alterações no banco de dados
             flash(f'Erro ao atualizar veículo: {str(e)}', 'error')
 
-    # Obtém a lista de imagens atual do veículo
-    # Se existirem imagens, divide a string pelos separadores (,)
-    # Se não existirem imagens, retorna uma lista vazia
-    imagens_veiculos = veiculo.imagens.split(',') if veiculo.imagens else []
+    # Renderiza a página com o veículo e suas imagens atuais (veiculo.imagens, pela ordem da galeria)
+    return render_template('/admin/replace_img.html', veiculo=veiculo)
 
-    # Renderiza a página com o veículo e suas imagens atuais
-    return render_template('/admin/replace_img.html', veiculo=veiculo, imagens_veiculos=imagens_veiculos)
+
+# Guarda as imagens enviadas na pasta de uploads e devolve os seus caminhos, que substituem as imagens released, e os
+# caminhos das imagens substituídas que nenhum outro veículo usa (a apagar com remove_unreferenced_images depois do
+# commit). Cada ficheiro é guardado com o hash do conteúdo no nome (ver images.store_upload): um ficheiro igual a
+# outro já guardado não ocupa mais espaço. O processamento das imagens (metadados e variantes) é feito depois, em
+# segundo plano (queue_image_processing).
+# As referências são atualizadas com o lock de escrita (ver lock_for_write), por isso tem de ser chamada antes de
+# qualquer alteração na sessão; o veículo é criado/alterado depois, na mesma transação
+def store_vehicle_images(files, released=()):
+    upload_folder = current_app.config['UPLOAD_FOLDER']  # Pasta de upload, criada no arranque da aplicação
+
+    # Copia os ficheiros para o disco (por blocos, calculando o hash) antes de pedir o lock de escrita
+    uploads = []
+    try:
+        for file in files:
+            if file and allowed_file(file.filename):  # Verifica se o ficheiro existe e tem uma extensão permitida
+                extension = os.path.splitext(secure_filename(file.filename))[1].lower()
+                uploads.append(store_upload(upload_folder, file, extension))
+        image_paths = [f'uploads/{filename}' for filename, _ in uploads]  # Caminhos relativos à pasta static
+
+        unreferenced = ImageFile.update_refs(acquired=image_paths, released=released)
+        for filename, temp_path in uploads:
+            publish_upload(upload_folder, filename, temp_path)
+        uploads = []
+    finally:
+        for _, temp_path in uploads:  # Ficheiros temporários de um upload que falhou
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return image_paths, unreferenced
+
+
+# Apaga da pasta de uploads os ficheiros (e as variantes) que ficaram sem referências (ver ImageFile.update_refs). É
+# chamada depois do commit, para que uma transação desfeita não deixe imagens sem ficheiro. Como o lock de escrita já
+# foi libertado, um upload do mesmo conteúdo pode ter voltado a usar o ficheiro: os caminhos são verificados de novo
+# com o lock, e só os que continuam sem referências são apagados
+def remove_unreferenced_images(image_paths):
+    if not image_paths:
+        return
+    try:
+        referenced = {path for path, in lock_for_write(
+            db.session.query(ImageFile.path).filter(ImageFile.path.in_(image_paths))).all()}
+        for image_path in set(image_paths) - referenced:
+            remove_image_files(current_app.config['UPLOAD_FOLDER'], os.path.basename(image_path))
+    finally:
+        db.session.rollback()  # Só fez leituras, termina a transação e liberta o lock
+
+
+# Envia as imagens de um veículo para o pool de processamento de imagens. Até cada imagem estar processada, o veículo
+# mostra a imagem original e a página de imagens do admin indica que está em processamento
+def queue_image_processing(vehicle_id, image_paths):
+    app = current_app._get_current_object()
+    image_workers = current_app.extensions['image_workers']
+    for image_path in image_paths:
+        image_workers.submit(process_vehicle_image, app, vehicle_id, image_path)
+
+
+# Tarefa do pool de processamento de imagens. Corre fora do pedido HTTP, por isso precisa do seu próprio contexto da
+# aplicação para guardar o resultado
+def process_vehicle_image(app, vehicle_id, image_path):
+    start = time.perf_counter()
+
+    # Uma imagem igual já enviada para outro veículo já foi processada
+    with app.app_context():
+        image_file = db.session.get(ImageFile, image_path)
+        info = image_file.get_info() if image_file is not None else None
+
+    if info is None:
+        info = process_image(app.config['UPLOAD_FOLDER'], os.path.basename(image_path))
+
+    with app.app_context():
+        if not Veiculos.store_imagem_info(vehicle_id, image_path, info):
+            # O ficheiro deixou de ser usado entretanto, apaga as variantes que acabaram de ser geradas
+            remove_variants(app.static_folder, info['variantes'])
+            return
+    app.logger.info('Imagem %s processada: %d variantes (%.1f ms)', image_path, len(info['variantes']),
+                    (time.perf_counter() - start) * 1000)
 
 
 # Função de apagar as imagens
-def delete_vehicle_image(vehicle_id, filename):
+def delete_vehicle_image(vehicle_id, image_id):
     vehicle = Veiculos.query.get_or_404(vehicle_id)
 
     if not vehicle.imagens:
         flash('Nenhuma imagem para apagar!', 'error')
         return redirect(url_for('admin.replace_img', id=vehicle_id))
 
-    # Converter string de imagens em lista
-    imagens = vehicle.imagens.split(',')
+    image = next((image for image in vehicle.imagens if image.id == image_id), None)
 
-    if filename in imagens:
-        # Remover arquivo físico
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if image is not None:
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Retira a referência ao ficheiro, que (com as variantes) só é apagado se nenhum outro veículo o usar
+            unreferenced = ImageFile.update_refs(released=[image.path])
 
-            # Remover referência do banco de dados
-            imagens.remove(filename)
-            vehicle.imagens = ','.join(imagens) if imagens else None
+            # Remover a imagem do veículo (a linha é apagada pelo delete-orphan)
+            vehicle.imagens.remove(image)
             db.session.commit()
+            remove_unreferenced_images(unreferenced)
             flash('Imagem removida com sucesso!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -833,6 +940,10 @@ def delete_vehicle(id):
     # ou, caso naõ encontrar o registro automaticamente retorna o erro 404(Not Found)
 
     try:
+        # Retira as referências às imagens do veículo (os ficheiros que deixam de ser usados são apagados depois do
+        # commit)
+        unreferenced = ImageFile.update_refs(released=veiculo.get_imagens())
+
         # Primeiro apaga todos as reservas relacionadas, caso contrário não deixa apagar o veículo
         reservations = Reservation.query.filter_by(veiculo_id=id).all()
         for reservation in reservations:
@@ -841,6 +952,8 @@ def delete_vehicle(id):
         # Depois apaga o veículo
         db.session.delete(veiculo)
         db.session.commit()
+        invalidate_dashboard_counts()
+        remove_unreferenced_images(unreferenced)
         flash(f"Veículo {veiculo.brand} e suas reservas foram apagados com sucesso!", "success")
     except Exception as e:
         db.session.rollback()
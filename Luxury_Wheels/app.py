@@ -1,90 +1,178 @@
 import os
-from datetime import timedelta, datetime
-from operator import or_
+from datetime import timedelta
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, render_template, url_for, redirect, request, flash, current_app, session
-from flask_login import LoginManager, login_required, current_user
+from flask import Flask, render_template, url_for, redirect, request, flash, current_app, g, has_request_context
+from flask_login import LoginManager
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from werkzeug.exceptions import BadRequest
-from werkzeug.security import generate_password_hash
 
 import admin
 import user
 import auth
 import urls
-from models import Clientes, db, Admin, Veiculos, Categoria, VehicleType
+from models import db, Veiculos, Categoria, VehicleType
+from cart import init_cart_store
+from commands import init_commands
+from db_engine import configure_db_profile, init_read_engine, init_sqlite_pragmas, use_read_engine
+from images import init_image_workers
+from scheduler import start_scheduler
+from user_cache import load_cached_user
+from static_assets import init_static_assets
+from search import vehicle_text_filter, exclude_search_tables
+from utils import parse_datetime_window
 from views import bp as views_bp
 
-app = Flask(__name__)  # Criação da aplicação Flask
+# A aplicação é criada pelo create_app (app factory): importar este módulo não cria a aplicação, não abre ligações
+# à base de dados e não inicia o scheduler. As tabelas, o índice de pesquisa e os dados iniciais são preparados com
+# "flask bootstrap" (ver commands.py)
 
-app.config['SECRET_KEY'] = "my_secret_key"
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../database/database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Configurações para upload de arquivos
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static/uploads/')  # Assume que a pasta static está no mesmo diretório que
-# seu arquivo app.py
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
-
-db.init_app(app)  # Inicialização da aplicação usando a instância `db` importada
-migrate = Migrate(app, db)  # Inicialização do Migrate
-
-# Configuração do tempo máximo que uma sessão pode estar ativa
-app.permanent_session_lifetime = timedelta(minutes=30)
-
-# Cursor para a base de dados SQLite
-# db = SQLAlchemy(app)
+migrate = Migrate()
 
 # Configuração do gestor de início de sessão do flask
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Please log in to access this page!'  # Mensagem personalizada quando o utilizador não
 # faz login
 login_manager.login_message_category = 'warning'  # Categoria da mensagem ('warning')
 
-# Criar um scheduler
-scheduler = BackgroundScheduler()
-
-# Adicionar a tarefa de atualização ao scheduler (Biblioteca de agendamento em Python, para agendar a execução de uma
-# determinada função ou tarefa) Verifica a cada minuto
-scheduler.add_job(func=Veiculos.update_all_vehicles_availability, trigger="interval", minutes=1)
 
-# Iniciar o scheduler
-scheduler.start()
+def create_app(test_config=None):
+    """
+    Cria e configura a aplicação Flask.
+
+    Args:
+        test_config (dict): Configurações que substituem as por defeito (ex: testes)
+
+    Returns:
+        Flask: Aplicação configurada
+    """
+    app = Flask(__name__)  # Criação da aplicação Flask
+
+    app.config['SECRET_KEY'] = "my_secret_key"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Base de dados (DATABASE_URL) e perfil da ligação (DB_PROFILE=development ou production: WAL, busy_timeout,
+    # cache e pool de ligações, ver db_engine.py)
+    configure_db_profile(app)
+
+    # Configurações para upload de arquivos
+    app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'static/uploads/')  # Assume que a pasta static está no
+    # mesmo diretório que seu arquivo app.py
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
+
+    # Pool que processa as imagens enviadas (hash, metadados e variantes) em segundo plano: número de threads e
+    # número máximo de imagens à espera. Com IMAGE_WORKERS=0 as imagens são processadas dentro do próprio pedido
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+    app.config['IMAGE_QUEUE_SIZE'] = int(os.environ.get('IMAGE_QUEUE_SIZE', 32))
+
+    # Número de veículos por página no catálogo
+    app.config['CATALOGUE_PAGE_SIZE'] = 10
+
+    # Número de linhas por página nas listagens do admin (pode ser alterado com ?per_page=, até ao máximo)
+    app.config['ADMIN_PAGE_SIZE'] = 25
+    app.config['ADMIN_MAX_PAGE_SIZE'] = 100
+
+    # Tempo (em segundos) que os contadores do dashboard do admin ficam em cache, 0 desativa a cache
+    app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('DASHBOARD_CACHE_TTL', 10))
+
+    # Tempo (em segundos) que os dados do utilizador autenticado ficam em cache no load_user, 0 desativa a cache
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+
+    # Contador de queries SQL por pedido. Quando SQL_QUERY_COUNTER está ativo, cada resposta leva o cabeçalho
+    # X-Query-Count com o número de queries executadas, o que permite confirmar que uma página com N veículos custa
+    # sempre o mesmo número de queries
+    app.config['SQL_QUERY_COUNTER'] = os.environ.get('SQL_QUERY_COUNTER') == '1'
+
+    # Configuração do tempo máximo que uma sessão pode estar ativa
+    app.permanent_session_lifetime = timedelta(minutes=30)
+
+    # Armazenamento dos carrinhos de reserva do lado do servidor (ver cart.py): 'database' (tabela carts, partilhada
+    # por todos os processos) ou 'memory' (LRU em memória, só para um processo). Os carrinhos expiram ao fim de
+    # CART_TTL segundos sem alterações, por defeito o mesmo tempo da sessão
+    app.config['CART_STORE'] = os.environ.get('CART_STORE', 'database')
+    app.config['CART_TTL'] = int(os.environ.get('CART_TTL', app.permanent_session_lifetime.total_seconds()))
+    app.config['CART_MAX_ENTRIES'] = int(os.environ.get('CART_MAX_ENTRIES', 10000))
+
+    # Tarefas periódicas (ver scheduler.py): duração do lease do processo líder, atraso aleatório máximo de cada
+    # execução e atraso máximo com que uma execução perdida ainda corre (todos em segundos)
+    app.config['SCHEDULER_LEASE_TTL'] = int(os.environ.get('SCHEDULER_LEASE_TTL', 60))
+    app.config['SCHEDULER_JITTER'] = int(os.environ.get('SCHEDULER_JITTER', 5))
+    app.config['SCHEDULER_MISFIRE_GRACE_TIME'] = int(os.environ.get('SCHEDULER_MISFIRE_GRACE_TIME', 30))
+
+    if test_config is not None:
+        app.config.update(test_config)
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)  # Cria a pasta de upload se não existir
+    init_image_workers(app)
+    # Ficheiros da pasta static: URLs com o hash do conteúdo (?v=), Cache-Control immutable de um ano para esses URLs
+    # e versões .br/.gz geradas com "flask compress-static"
+    init_static_assets(app)
+    init_cart_store(app)
+
+    db.init_app(app)  # Inicialização da aplicação usando a instância `db` importada
+    with app.app_context():  # Cria os engines, sem abrir nenhuma ligação
+        init_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])  # Antes de ser aberta a primeira ligação
+        init_read_engine(app, db.engine)  # Engine só de leitura das rotas de consulta (READ_DATABASE_URL)
+    migrate.init_app(app, db, include_object=exclude_search_tables)  # Inicialização do Migrate
+    login_manager.init_app(app)
+
+    # O contador de queries só é registado quando está ativo, nos engines desta aplicação, para as restantes queries
+    # não pagarem o listener
+    if app.config['SQL_QUERY_COUNTER']:
+        with app.app_context():
+            for engine in (db.engine, app.extensions['read_engine']):
+                if engine is not None and not event.contains(engine, 'before_cursor_execute', count_query):
+                    event.listen(engine, 'before_cursor_execute', count_query)
+        app.after_request(add_query_count_header)
+
+    # Registro de Blueprint de Autenticação no Flask
+    app.register_blueprint(auth.bp)
+    app.register_blueprint(urls.bp)
+    app.register_blueprint(views_bp)
+    app.register_blueprint(admin.bp)
+    app.register_blueprint(user.bp)
+
+    app.add_url_rule('/', 'home', home)
+    app.add_url_rule('/home', 'home', home)
+    app.add_url_rule('/sobre_nos', 'sobre_nos', sobre_nos)
+    app.add_url_rule('/list_vehicle', 'list_vehicle', list_vehicle)
+    app.add_url_rule('/list_vehicle/clear', 'clear_listVehicle', clear_listVehicle, methods=['GET'])
+
+    # Comandos "flask seed", "flask bootstrap", "flask scheduler", "flask generate-image-variants" e
+    # "flask compress-static"
+    init_commands(app)
+
+    # Scheduler dentro do processo do servidor. Com vários workers só o líder corre as tarefas, mas o recomendado é
+    # um processo separado com "flask scheduler"
+    if os.environ.get('SCHEDULER_ENABLED') == '1':
+        start_scheduler(app)
+
+    return app
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def add_query_count_header(response):
+    response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    return response
+
+
+# Tem como propósito carregar um usuário a partir do ID armazenado na sessão ('admin_<id>' ou 'client_<id>'). O
+# registo do utilizador fica em cache durante USER_CACHE_TTL segundos (ver user_cache.py), por isso a maioria dos
+# pedidos autenticados não precisa de nenhuma query para saber quem é o utilizador
+@login_manager.user_loader
+def load_user(user_id):
+    return load_cached_user(user_id, current_app.config['USER_CACHE_TTL'])
 
 
-# Tem como propósito carregar um usuário a partir do ID armazenado na sessão
-@login_manager.user_loader
-def load_user(user_id):  # A função load_user, recebe um parâmetro user_id. Este ID é o identificador único do usuário
-    # Caso o usuário não foi encontrado na tabela Clientes, a função tenta carregar um usuário da tabela Admin usando o
-    # mesmo método query.get()
-    if user_id.startswith('admin_'):  # Verifica se o user_id começa com o 'admin', indicando que é um administrador
-        admin_id = int(user_id.split('_')[1])  # Extrai o ID do admin e busca-o no banco de dados
-        return Admin.query.get(admin_id)
-    elif user_id.startswith('client_'):  # Verifica se o user_id começa com o 'client', indicando que é um cliente
-        client_id = int(user_id.split('_')[1])  # Extrai o ID do client e busca-o no banco de dados
-        return Clientes.query.get(client_id)
-    return None  # Retorna None se não encontrar o padrão conhecido
-
-
-# Registro de Blueprint de Autenticação no Flask
-app.register_blueprint(auth.bp)
-app.register_blueprint(urls.bp)
-app.register_blueprint(views_bp)
-app.register_blueprint(admin.bp)
-app.register_blueprint(user.bp)
-
-
-@app.route('/')
-@app.route('/home')
 def home():
     return render_template("home.html")
 
 
-@app.route('/sobre_nos')
 def sobre_nos():
     return render_template("sobre_nos.html")
 
@@ -93,84 +181,117 @@ def sobre_nos():
 
 
 # Pág. da lista de veículos para reservar
-@app.route('/list_vehicle')
+@use_read_engine  # Só consulta, os SELECTs usam o engine só de leitura
 def list_vehicle():
     try:
-        # Primeiro, atualizar o status de todos os veículos que precisam ser atualizados
-        current_datetime = datetime.now()
-
-        vehicles_to_update = Veiculos.query.filter(
-            or_(Veiculos.available_from.isnot(None), Veiculos.maintenance_end.isnot(None))).all()
-
-        for vehicle in vehicles_to_update:
-            # Se a manutenção acabou
-            if vehicle.maintenance_end and current_datetime > vehicle.maintenance_end:
-                vehicle.in_maintenance = False
-                vehicle.status = True
+        # O estado de disponibilidade é derivado das datas no momento da leitura (Veiculos.availability_state),
+        # por isso esta página só lê da base de dados. A limpeza das colunas de estado fica a cargo do scheduler
 
-            # Se o período de indisponibilidade acabou
-            if vehicle.available_from and current_datetime >= vehicle.available_from:
-                vehicle.status = True
-                vehicle.available_from = None
-
-        # Commit das alterações de status
-        db.session.commit()
-
-        # Obter parâmetros de filtro
+        # Obter parâmetros de filtro. Os filtros numéricos são intervalos (mínimo/máximo) e as categorias podem ser
+        # várias. Valores inválidos são ignorados (o type=float/int devolve None)
         tipo = request.args.get('type', '')
+        pesquisa = request.args.get('q', '')
         marca = request.args.get('brand', '')
         modelo = request.args.get('model', '')
-        categoria_id = request.args.get('category')
-        assentos = request.args.get('seats')
+        categorias_ids = request.args.getlist('category', type=int)
+        assentos_min = request.args.get('min_seats', type=int)
         transmissao = request.args.get('transmission', '')
-        preco_dia = request.args.get('price_per_day', '')
+        preco_min = request.args.get('min_price', type=float)
+        preco_max = request.args.get('max_price', type=float)
+        ano_min = request.args.get('min_year', type=int)
+        ano_max = request.args.get('max_year', type=int)
+        apenas_disponiveis = request.args.get('available') == '1'
+
+        # Pesquisa por período: só mostra os veículos sem reservas nem manutenções que se sobreponham ao período
+        try:
+            janela = parse_datetime_window(request.args)
+        except ValueError:
+            flash('Período inválido: a data de início deve ser anterior à data do fim.', 'error')
+            return redirect(url_for('list_vehicle'))
 
-        # Iniciar a query
-        query = Veiculos.query
+        # Iniciar a query. A categoria é carregada no mesmo SELECT (joinedload) em vez de uma query por cartão, e só
+        # são lidas as colunas que os cartões usam
+        query = Veiculos.query.options(
+            load_only(Veiculos.type, Veiculos.brand, Veiculos.model, Veiculos.seats, Veiculos.bags,
+                      Veiculos.transmission, Veiculos.price_per_day, Veiculos.status, Veiculos.is_reserved,
+                      Veiculos.available_from, Veiculos.maintenance_start, Veiculos.maintenance_end,
+                      Veiculos.categoria_id),
+            joinedload(Veiculos.categoria).load_only(Categoria.nome),
+            selectinload(Veiculos.imagens))  # Imagens de todos os veículos da página numa única query IN
 
         # Aplicar filtros
         if tipo:
             query = query.filter(Veiculos.type == tipo)
-        if marca:
-            query = query.filter(Veiculos.brand.ilike(f'%{marca}%'))  # Utilizou-se o operador ilike porque ele não
-            # faz distinção entre letras maiúsculas e minúsculas.
-        if modelo:
-            query = query.filter(Veiculos.model.ilike(f'%{modelo}%'))  # Utilizou-se o operador ilike porque ele não
-            # faz distinção entre letras maiúsculas e minúsculas.
-        if categoria_id:
-            query = query.filter(Veiculos.categoria_id == int(categoria_id))
-        if assentos:
-            query = query.filter(Veiculos.seats == int(assentos))
+        # A pesquisa de texto (livre, marca e modelo) usa o índice FTS dos veículos (ver search.py), por prefixo de
+        # palavra e sem distinção entre maiúsculas/minúsculas nem acentos
+        for text_filter in (vehicle_text_filter(pesquisa),
+                            vehicle_text_filter(marca, columns=('brand',)),
+                            vehicle_text_filter(modelo, columns=('model',))):
+            if text_filter is not None:
+                query = query.filter(text_filter)
+        # Tipo, categorias e preço são servidos pelo índice (type, categoria_id, price_per_day)
+        if categorias_ids:
+            query = query.filter(Veiculos.categoria_id.in_(categorias_ids))
+        if preco_min is not None:
+            query = query.filter(Veiculos.price_per_day >= preco_min)
+        if preco_max is not None:
+            query = query.filter(Veiculos.price_per_day <= preco_max)
+        if assentos_min is not None:
+            query = query.filter(Veiculos.seats >= assentos_min)
+        if ano_min is not None:
+            query = query.filter(Veiculos.year >= ano_min)
+        if ano_max is not None:
+            query = query.filter(Veiculos.year <= ano_max)
         if transmissao:
-            query = query.filter(Veiculos.transmission.ilike(f'%{transmissao}%'))  # Utilizou-se o operador ilike
-            # para fazer a distinção entre letras maiúsculas e minúsculas.
-        if preco_dia:
-            query = query.filter(Veiculos.price_per_day == float(preco_dia))
-
-        # Paginação dos cards
+            query = query.filter(Veiculos.transmission == transmissao.strip().title())  # A transmissão é guardada
+            # como 'A' ou 'M', por isso a comparação exata pode usar o índice da coluna
+        # Apenas veículos disponíveis agora: só o estado calculado a partir das datas, o mesmo que decide se o cartão
+        # pode ser reservado. As colunas status/in_maintenance não entram no filtro, porque só são limpas pelo
+        # scheduler depois de uma reserva ou manutenção terminar
+        if apenas_disponiveis:
+            query = query.filter(Veiculos.availability_state == "disponivel")
+        if janela:
+            query = query.filter(Veiculos.free_between_filter(*janela))
+
+        # Paginação dos cards, por uma ordem fixa (sem ORDER BY as páginas seguiriam a ordem do índice escolhido
+        # pelo planeador, que muda com os filtros)
+        query = query.order_by(Veiculos.id)
         page = request.args.get('page', 1, type=int)
-        per_page = 10  # Número de veículos por página
+        per_page = current_app.config['CATALOGUE_PAGE_SIZE']  # Número de veículos por página
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
         vehicles = pagination.items
 
         # Enviar uma mensagem caso não foram encontrados veículos pesquisados
-        if not vehicles and (tipo or marca or modelo or categoria_id or assentos or transmissao or preco_dia):
+        filtros_aplicados = any([pesquisa, tipo, marca, modelo, categorias_ids, transmissao, apenas_disponiveis,
+                                 janela]) or \
+            any(value is not None for value in (assentos_min, preco_min, preco_max, ano_min, ano_max))
+        if not vehicles and filtros_aplicados:
             flash('Nenhum veículo encontrado com os critérios de busca especificados.', 'error')
             return redirect(url_for('list_vehicle'))
 
-        # Carregar imagens para cada veículo
         for vehicle in vehicles:
-            vehicle.images = vehicle.get_imagens()
-
-            # Adicionar um atributo para indicar se o veículo está disponível para reserva
-            vehicle.can_reserve = vehicle.is_available()
+            # Adicionar um atributo para indicar se o veículo está disponível para reserva (na pesquisa por período,
+            # todos os resultados estão livres nesse período)
+            vehicle.can_reserve = bool(janela) or vehicle.is_available()
 
         # Obter todas as categorias para o filtro
         categories = Categoria.query.all()
 
+        # Parâmetros de pesquisa a manter nos links de paginação (as categorias podem ter vários valores)
+        search_args = {key: [value for value in values if value]
+                       for key, values in request.args.lists() if key != 'page'}
+
+        # Período pesquisado, para pré-preencher o formulário de reserva
+        janela_args = {key: request.args.get(key) for key in ('start_date', 'start_time', 'end_date', 'end_time')
+                       if janela and request.args.get(key)}
+
         return render_template('list_vehicle.html', vehicles=vehicles, categories=categories, pagination=pagination,
-                               marca=marca, modelo=modelo, assentos=assentos, tipo=tipo,
-                               transmissao=transmissao, preco_dia=preco_dia, VehicleType=VehicleType)
+                               pesquisa=pesquisa, marca=marca, modelo=modelo, tipo=tipo, transmissao=transmissao,
+                               categorias_ids=categorias_ids, assentos_min=assentos_min, preco_min=preco_min,
+                               preco_max=preco_max, ano_min=ano_min, ano_max=ano_max,
+                               apenas_disponiveis=apenas_disponiveis, search_args=search_args,
+                               janela_args=janela_args,
+                               VehicleType=VehicleType)
 
     except BadRequest:
         flash('Erro nos parâmetros de busca. Por favor, tente novamente.', 'error')
@@ -182,67 +303,13 @@ def list_vehicle():
 
 
 # Apagar pesquisa
-@app.route('/list_vehicle/clear', methods=['GET'])
 def clear_listVehicle():
     return redirect(url_for('list_vehicle'))
 
 
-with app.app_context():  # Nesta linha o contexto da aplicação Flask é ativado, como as interações com o banco de dados
-    db.create_all()  # Esta linha é MUITO IMPORTANTE, pois é RESPONSÁVEL por criar todas as tabelas no banco de dados
-    # que ainda não existem
-
-    Admin.query.update({Admin.user_type: 'admin'})
-    Clientes.query.update({Clientes.user_type: 'client'})
-    db.session.commit()  # Esta linha cria todas as tabelas no banco de dados que ainda não existem
-
-    # with app.app_context():  # Nesta linha o contexto da aplicação Flask é ativado, como as interações com o banco de
-    #     # dados
-    #     db.create_all()  # Esta linha cria todas as tabelas no banco de dados que ainda não existem
-
-    # ------------------------------- Criar e adicionar Admin --------------------------------------
-    # Verifica se o administrador já existe, para não haver repetições
-    admin_exists = Admin.query.filter_by(username="admin1").first()
-    if not admin_exists:
-        # Cria um administrador
-        new_admin = Admin(username="admin1", password=generate_password_hash("admin", method='pbkdf2:sha256'))
-        # Adiciona o administrador ao banco de dados
-        db.session.add(new_admin)
-        db.session.commit()
-    else:
-        # Atualizar a senha do administrador existente
-        admin_exists.password = generate_password_hash("admin", method='pbkdf2:sha256')
-        db.session.commit()
-
-    # ------------------------------- Criar e adicionar categorias --------------------------------------
-    # Criar categorias de carros
-    categorias_carro = [
-        Categoria("Mini", VehicleType.CARRO),
-        Categoria("Económico", VehicleType.CARRO),
-        Categoria("Compacto", VehicleType.CARRO),
-        Categoria("Intermédio", VehicleType.CARRO),
-        Categoria("Familiar", VehicleType.CARRO),
-        Categoria("Luxo", VehicleType.CARRO),
-        Categoria("Descapotável", VehicleType.CARRO),
-        Categoria("SUV", VehicleType.CARRO),
-        Categoria("Comercial", VehicleType.CARRO),
-    ]
-
-    # Criar categorias de motos
-    categorias_moto = [
-        Categoria("Motos Scooters", VehicleType.MOTA),
-        Categoria("Motos de Turismo", VehicleType.MOTA),
-        Categoria("Motos Desportivas", VehicleType.MOTA),
-        Categoria("Motos de Aventura", VehicleType.MOTA),
-        Categoria("Motos Off-Road", VehicleType.MOTA)
-    ]
-
-    # Adicionar todas as categorias no banco de dados
-    for categoria in categorias_carro + categorias_moto:
-        existing_categoria = Categoria.query.filter_by(nome=categoria.nome, tipo_veiculo=categoria.tipo_veiculo).first()
-        if not existing_categoria:
-            db.session.add(categoria)
-    db.session.commit()  # Confirma as alterações no banco de dados
-
 if __name__ == '__main__':
+    app = create_app()
+    if 'scheduler' not in app.extensions:
+        start_scheduler(app)  # Em desenvolvimento o scheduler corre no próprio servidor
     app.run(debug=True)  # Função responsável por executar o servidor Web, o debug=True quer dizer que estamos no
     # modo desenvolvedor, de forma recarrecar automaticamente sozinho em cada modificação feita no código
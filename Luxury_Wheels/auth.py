@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash,
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import login_user, logout_user, login_required, current_user
 from models import Clientes, db, Admin
+from admin import invalidate_dashboard_counts
 from datetime import datetime
 
 bp = Blueprint('auth', __name__)
@@ -50,6 +51,7 @@ def registro():
                               data_nascimento=data_nascimento, morada=morada, nif=nif, password=password)
         db.session.add(new_client)  # adicionar ao banco de dados
         db.session.commit()  # Confirma todas as alterações que foram adicionadas à sessão do banco de dados
+        invalidate_dashboard_counts()  # Total de clientes do dashboard
         flash("Registration Successful", "success")
         return redirect(url_for("auth.login"))
     return render_template("registro.html")
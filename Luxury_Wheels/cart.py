@@ -0,0 +1,188 @@
+import json
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app, session
+
+from models import db, CartEntry
+
+# ------------------------------- Carrinho de reservas do lado do servidor ---------------------------------------
+
+# O carrinho fica guardado no servidor e o cookie da sessão guarda apenas o ID do carrinho, por isso o tamanho do
+# cookie não cresce com o número de veículos reservados. Cada item guarda só o ID do veículo, as datas e os preços
+# calculados no momento da reserva; a marca, o modelo e as imagens são lidos da base de dados ao mostrar o carrinho
+CART_SESSION_KEY = 'cart_id'
+
+
+class CartStore(ABC):
+    """Interface comum aos armazenamentos de carrinhos. Os valores são guardados como JSON."""
+
+    @abstractmethod
+    def get(self, key):
+        """Devolve o valor guardado, ou None se não existir ou tiver expirado."""
+
+    @abstractmethod
+    def set(self, key, value):
+        """Guarda o valor e renova o tempo de expiração."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Apaga o valor, se existir."""
+
+    @abstractmethod
+    def purge_expired(self):
+        """Apaga os valores expirados e devolve quantos foram apagados."""
+
+
+class MemoryCartStore(CartStore):
+    """
+    Armazenamento em memória com expiração (TTL) e limite de entradas (LRU).
+
+    Só é partilhado entre os pedidos do mesmo processo, por isso serve para desenvolvimento ou para um único
+    processo do servidor. Com vários processos deve ser usado o DatabaseCartStore.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl  # Segundos
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expira_em, json)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)  # Passa a ser a entrada usada mais recentemente
+            return json.loads(entry[1])  # Cópia nova, para que alterações do chamador não mudem o que está guardado
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, json.dumps(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # Remove a entrada usada há mais tempo
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class DatabaseCartStore(CartStore):
+    """Armazenamento na tabela carts da base de dados, partilhado por todos os processos do servidor."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl  # Segundos
+
+    def get(self, key):
+        entry = db.session.get(CartEntry, key)
+        if entry is None or entry.expires_at <= datetime.now():
+            return None
+        return json.loads(entry.data)
+
+    def set(self, key, value):
+        try:
+            db.session.merge(CartEntry(id=key, data=json.dumps(value),
+                                       expires_at=datetime.now() + timedelta(seconds=self.ttl)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def delete(self, key):
+        try:
+            CartEntry.query.filter_by(id=key).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def purge_expired(self):
+        try:
+            deleted = CartEntry.query.filter(CartEntry.expires_at <= datetime.now()).delete(synchronize_session=False)
+            db.session.commit()
+            return deleted
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+CART_STORES = {
+    'memory': lambda config: MemoryCartStore(config['CART_TTL'], config['CART_MAX_ENTRIES']),
+    'database': lambda config: DatabaseCartStore(config['CART_TTL']),
+}
+
+
+def init_cart_store(app):
+    """Cria o armazenamento de carrinhos escolhido em CART_STORE ('memory' ou 'database') e associa-o à app."""
+    backend = app.config['CART_STORE']
+    if backend not in CART_STORES:
+        raise ValueError(f"CART_STORE inválido: {backend!r} (opções: {', '.join(CART_STORES)})")
+
+    store = CART_STORES[backend](app.config)
+    app.extensions['cart_store'] = store
+    return store
+
+
+def get_cart_store():
+    return current_app.extensions['cart_store']
+
+
+def _cart_id(create=False):
+    cart_id = session.get(CART_SESSION_KEY)
+    if cart_id is None and create:
+        cart_id = session[CART_SESSION_KEY] = secrets.token_urlsafe(24)
+    return cart_id
+
+
+def get_cart():
+    """Devolve a lista de itens do carrinho do cliente atual (vazia se ainda não tiver carrinho)."""
+    cart_id = _cart_id()
+    if cart_id is None:
+        return []
+    return get_cart_store().get(cart_id) or []
+
+
+def save_cart(items):
+    """Guarda a lista de itens do carrinho do cliente atual, criando o carrinho se necessário."""
+    get_cart_store().set(_cart_id(create=True), items)
+
+
+def clear_cart():
+    """Apaga o carrinho do cliente atual (incluindo o item guardado durante uma edição)."""
+    cart_id = session.pop(CART_SESSION_KEY, None)
+    if cart_id is not None:
+        get_cart_store().delete(cart_id)
+        get_cart_store().delete(f'{cart_id}:edit')
+
+
+# O item original de uma reserva em edição também fica no servidor, para poder ser reposto se a edição for cancelada
+
+def get_edit_original():
+    cart_id = _cart_id()
+    return get_cart_store().get(f'{cart_id}:edit') if cart_id else None
+
+
+def save_edit_original(item):
+    get_cart_store().set(f'{_cart_id(create=True)}:edit', item)
+
+
+def clear_edit_original():
+    cart_id = _cart_id()
+    if cart_id is not None:
+        get_cart_store().delete(f'{cart_id}:edit')
@@ -0,0 +1,165 @@
+import json
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect, or_, tuple_
+
+from images import available_formats, process_image
+from models import db, Admin, Clientes, Categoria, VehicleType, VehicleImage, ImageFile
+from scheduler import run_scheduler
+from search import init_vehicle_search
+from static_assets import compress_static_files
+
+# ------------------------------- Comandos "flask ..." -------------------------------------------------------------
+
+# Preparar a base de dados (tabelas, índice de pesquisa e dados iniciais) é feito com "flask bootstrap" no deploy, e
+# não no arranque da aplicação, para que cada processo do servidor arranque sem nenhuma query
+
+# Categorias criadas pelo "flask seed"
+CATEGORIAS = [
+    # Categorias de carros
+    ("Mini", VehicleType.CARRO),
+    ("Económico", VehicleType.CARRO),
+    ("Compacto", VehicleType.CARRO),
+    ("Intermédio", VehicleType.CARRO),
+    ("Familiar", VehicleType.CARRO),
+    ("Luxo", VehicleType.CARRO),
+    ("Descapotável", VehicleType.CARRO),
+    ("SUV", VehicleType.CARRO),
+    ("Comercial", VehicleType.CARRO),
+    # Categorias de motos
+    ("Motos Scooters", VehicleType.MOTA),
+    ("Motos de Turismo", VehicleType.MOTA),
+    ("Motos Desportivas", VehicleType.MOTA),
+    ("Motos de Aventura", VehicleType.MOTA),
+    ("Motos Off-Road", VehicleType.MOTA),
+]
+
+# Administrador criado pelo "flask seed" se ainda não existir
+DEFAULT_ADMIN_USERNAME = "admin1"
+DEFAULT_ADMIN_PASSWORD = "admin"
+
+
+def seed_database(reset_admin_password=False):
+    """
+    Cria os dados iniciais que ainda não existem: o administrador por defeito e as categorias. Pode ser executado
+    várias vezes (só cria o que falta).
+
+    Args:
+        reset_admin_password (bool): Volta a definir a password por defeito do administrador, se já existir
+
+    Returns:
+        dict: Número de registos criados/atualizados ('admin', 'categorias', 'user_type')
+    """
+    counts = {'admin': 0, 'categorias': 0, 'user_type': 0}
+
+    # Tipo de utilizador das contas criadas antes de existir a coluna user_type (só as linhas erradas são alteradas)
+    counts['user_type'] += Admin.query.filter(or_(Admin.user_type.is_(None), Admin.user_type != 'admin')) \
+        .update({Admin.user_type: 'admin'}, synchronize_session=False)
+    counts['user_type'] += Clientes.query.filter(or_(Clientes.user_type.is_(None), Clientes.user_type != 'client')) \
+        .update({Clientes.user_type: 'client'}, synchronize_session=False)
+
+    # ------------------------------- Criar e adicionar Admin --------------------------------------
+    admin = Admin.query.filter_by(username=DEFAULT_ADMIN_USERNAME).first()
+    if admin is None:
+        db.session.add(Admin(username=DEFAULT_ADMIN_USERNAME, password=DEFAULT_ADMIN_PASSWORD))  # O construtor
+        # encripta a password
+        counts['admin'] = 1
+    elif reset_admin_password:
+        admin.password = Admin(username=admin.username, password=DEFAULT_ADMIN_PASSWORD).password
+        counts['admin'] = 1
+
+    # ------------------------------- Criar e adicionar categorias --------------------------------------
+    # As categorias que já existem são lidas numa única query
+    existing = set(db.session.query(Categoria.nome, Categoria.tipo_veiculo)
+                   .filter(tuple_(Categoria.nome, Categoria.tipo_veiculo).in_(CATEGORIAS)).all())
+    for nome, tipo_veiculo in CATEGORIAS:
+        if (nome, tipo_veiculo) not in existing:
+            db.session.add(Categoria(nome, tipo_veiculo))
+            counts['categorias'] += 1
+
+    db.session.commit()
+    return counts
+
+
+def _echo_seed_counts(counts):
+    click.echo(f"Admin: {counts['admin']}, categorias criadas: {counts['categorias']}, "
+               f"tipos de utilizador corrigidos: {counts['user_type']}.")
+
+
+@click.command('seed')
+@click.option('--reset-admin-password', is_flag=True, help='Volta a definir a password por defeito do admin.')
+@with_appcontext
+def seed_command(reset_admin_password):
+    """Cria o administrador por defeito e as categorias que ainda não existem."""
+    _echo_seed_counts(seed_database(reset_admin_password))
+
+
+@click.command('bootstrap')
+@click.option('--reset-admin-password', is_flag=True, help='Volta a definir a password por defeito do admin.')
+@with_appcontext
+def bootstrap_command(reset_admin_password):
+    """Prepara a base de dados: migrações (ou tabelas numa nova base de dados), índice de pesquisa e dados iniciais."""
+    if inspect(db.engine).get_table_names():
+        upgrade()  # Aplica as migrações que faltam (flask db upgrade)
+    else:
+        # Base de dados nova: cria as tabelas a partir dos modelos e marca-a como estando na última migração
+        db.create_all()
+        stamp()
+
+    if init_vehicle_search(db.engine):  # Cria (se necessário) o índice de pesquisa de texto dos veículos
+        click.echo('Índice de pesquisa dos veículos pronto.')
+    _echo_seed_counts(seed_database(reset_admin_password))
+
+
+# Comando "flask scheduler": processo dedicado às tarefas periódicas. Podem correr vários (ex: um por servidor) porque
+# só o que tem o lease corre as tarefas e os outros ficam em espera para o substituir
+@click.command('scheduler')
+@with_appcontext
+def scheduler_command():
+    click.echo('Scheduler iniciado (Ctrl+C para terminar).')
+    run_scheduler(current_app._get_current_object())
+
+
+# Comando "flask generate-image-variants": processa (hash, metadados e variantes reduzidas) as imagens enviadas antes
+# de existir o pipeline de imagens, sem o Pillow instalado, ou cujo processamento em segundo plano não terminou
+@click.command('generate-image-variants')
+@with_appcontext
+def generate_image_variants_command():
+    if not available_formats():
+        click.echo('O Pillow não está instalado (pip install pillow), as imagens ficam sem variantes.')
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    processed = 0
+    infos = {}  # Cada ficheiro é processado uma única vez, mesmo que seja usado por vários veículos
+    sem_variantes = or_(VehicleImage.variantes.is_(None), VehicleImage.variantes == '[]')
+    for image in VehicleImage.query.filter(sem_variantes).all():
+        if image.path not in infos:
+            if not os.path.exists(os.path.join(upload_folder, os.path.basename(image.path))):
+                continue
+            infos[image.path] = process_image(upload_folder, os.path.basename(image.path))
+            image_file = db.session.get(ImageFile, image.path)
+            if image_file is not None:
+                image_file.info = json.dumps(infos[image.path])
+        image.set_info(infos[image.path])
+        processed += 1
+    db.session.commit()
+    click.echo(f'{processed} imagem(ns) processada(s).')
+
+
+# Comando "flask compress-static": gera as versões comprimidas (.gz e, com o brotli instalado, .br) dos ficheiros CSS
+# e JS, que são enviadas aos browsers que as aceitam. Deve voltar a correr sempre que estes ficheiros mudam
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    generated = compress_static_files(current_app.static_folder)
+    click.echo(f'{generated} ficheiro(s) comprimido(s) gerado(s).')
+
+
+def init_commands(app):
+    for command in (seed_command, bootstrap_command, scheduler_command, generate_image_variants_command,
+                    compress_static_command):
+        app.cli.add_command(command)
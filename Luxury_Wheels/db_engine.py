@@ -0,0 +1,143 @@
+import os
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, Select
+
+# ------------------------------- Perfis da ligação à base de dados ----------------------------------------------
+
+# Base de dados por defeito (relativa à pasta instance da aplicação), pode ser alterada com DATABASE_URL
+DEFAULT_DATABASE_URI = 'sqlite:///../database/database.db'
+
+# Perfis escolhidos com a variável de ambiente DB_PROFILE. Cada perfil define as opções do engine do SQLAlchemy (pool
+# de ligações) e os PRAGMAs executados em cada nova ligação SQLite (as ligações são reutilizadas pelo pool, por isso
+# os PRAGMAs só correm uma vez por ligação e não em cada pedido)
+DB_PROFILES = {
+    # Desenvolvimento: o comportamento por defeito do SQLite, só com espera pelo lock em vez de erro imediato
+    'development': {
+        'engine_options': {},
+        'pragmas': {
+            'busy_timeout': 5000,
+        },
+    },
+
+    # Produção: com WAL as leituras (pedidos web) não ficam bloqueadas pelas escritas (scheduler, reservas) e vice-
+    # versa, e synchronous=NORMAL só sincroniza o disco nos checkpoints do WAL. O busy_timeout faz as escritas
+    # concorrentes esperarem pelo lock em vez de falharem com "database is locked"
+    'production': {
+        'engine_options': {
+            'pool_size': 10,  # Ligações mantidas abertas (threads do servidor + scheduler + pool de imagens)
+            'max_overflow': 20,  # Ligações extra em picos, fechadas quando são devolvidas
+            'pool_timeout': 30,  # Segundos à espera de uma ligação livre
+            'connect_args': {'timeout': 30, 'check_same_thread': False},
+        },
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 30000,  # Milissegundos
+            'mmap_size': 256 * 1024 * 1024,  # Leituras por memory-mapping até 256MB do ficheiro
+            'cache_size': -64000,  # Valor negativo = KB, ~64MB de cache de páginas por ligação
+            'temp_store': 'MEMORY',
+        },
+    },
+}
+
+
+def configure_db_profile(app):
+    """
+    Aplica o perfil DB_PROFILE ('development' ou 'production') à configuração da base de dados da app.
+
+    Deve ser chamado antes de db.init_app. As opções do engine já definidas em SQLALCHEMY_ENGINE_OPTIONS têm
+    prioridade sobre as do perfil.
+    """
+    profile_name = os.environ.get('DB_PROFILE', 'development')
+    if profile_name not in DB_PROFILES:
+        raise ValueError(f"DB_PROFILE inválido: {profile_name!r} (opções: {', '.join(DB_PROFILES)})")
+    profile = DB_PROFILES[profile_name]
+
+    app.config['DB_PROFILE'] = profile_name
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**profile['engine_options'],
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    app.config.setdefault('SQLITE_PRAGMAS', dict(profile['pragmas']))
+
+
+def init_sqlite_pragmas(engine, pragmas):
+    """Executa os PRAGMAs em cada nova ligação do engine, se for SQLite (nas outras bases de dados não faz nada)."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+# ------------------------------- Engine só de leitura ------------------------------------------------------------
+
+# As rotas de consulta (catálogo, listagens e dashboard do admin) leem através de um engine separado, só de leitura:
+# uma réplica indicada em READ_DATABASE_URL ou, em SQLite, uma segunda ligação ao mesmo ficheiro aberta com mode=ro.
+# Assim o tráfego de navegação não ocupa as ligações nem os locks usados pelas reservas, pela edição do admin e pelo
+# scheduler, que continuam sempre no engine principal
+
+# PRAGMAs que alteram a base de dados e não podem ser executados numa ligação só de leitura
+WRITE_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def init_read_engine(app, engine):
+    """
+    Cria o engine só de leitura a partir de READ_DATABASE_URL ou, se não estiver definido e a base de dados principal
+    for um ficheiro SQLite, com o mesmo ficheiro em mode=ro. Sem nenhum dos dois, as leituras ficam no engine
+    principal.
+
+    Args:
+        app (Flask): Aplicação
+        engine (Engine): Engine principal (db.engine)
+
+    Returns:
+        Engine ou None
+    """
+    read_url = os.environ.get('READ_DATABASE_URL')
+    if read_url is None and engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        read_url = f'sqlite:///file:{engine.url.database}?mode=ro&uri=true'
+    if read_url is None:
+        app.extensions['read_engine'] = None
+        return None
+
+    read_engine = create_engine(read_url, **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    init_sqlite_pragmas(read_engine, {name: value for name, value in app.config['SQLITE_PRAGMAS'].items()
+                                      if name not in WRITE_PRAGMAS})
+    app.extensions['read_engine'] = read_engine
+    return read_engine
+
+
+def use_read_engine(f):
+    """Decorator das rotas só de consulta: os SELECTs do pedido passam a usar o engine só de leitura."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_read_engine = True
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+class RoutingSession(Session):
+    """
+    Sessão do Flask-SQLAlchemy que envia os SELECTs das rotas marcadas com use_read_engine para o engine só de
+    leitura. As escritas (flush), os SELECT ... FOR UPDATE e as leituras feitas depois de alterar objetos da sessão
+    ficam no engine principal, para que o pedido veja sempre as suas próprias alterações.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and isinstance(clause, Select) and clause._for_update_arg is None \
+                and has_request_context() and g.get('use_read_engine') \
+                and not (self._flushing or self.new or self.dirty or self.deleted):
+            read_engine = current_app.extensions.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
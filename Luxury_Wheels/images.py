@@ -0,0 +1,237 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:  # O Pillow é opcional: sem ele as imagens são guardadas e mostradas apenas no tamanho original
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------- Armazenamento endereçado pelo conteúdo ------------------------------------------
+
+# Os uploads são guardados com o nome <sha256 do conteúdo>.<extensão>. Ficheiros iguais ficam guardados uma única vez
+# (a tabela image_files conta as referências) e um nome nunca muda de conteúdo, por isso pode ficar em cache para
+# sempre nos browsers
+CONTENT_NAME = re.compile(r'[0-9a-f]{64}')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def store_upload(upload_folder, file, extension):
+    """
+    Copia um ficheiro enviado para um ficheiro temporário da pasta de uploads, por blocos, calculando o hash.
+
+    O ficheiro temporário só passa a ter o nome final com publish_upload, que deve ser chamado depois de registar
+    a referência ao ficheiro (ver ImageFile.update_refs).
+
+    Args:
+        upload_folder (str): Pasta de uploads (UPLOAD_FOLDER)
+        file (FileStorage): Ficheiro enviado no pedido
+        extension (str): Extensão do ficheiro final, com o ponto (ex: '.png')
+
+    Returns:
+        tuple: (nome final do ficheiro, caminho do ficheiro temporário)
+    """
+    sha256 = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=upload_folder)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                temp_file.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return f'{sha256.hexdigest()}{extension}', temp_path
+
+
+def publish_upload(upload_folder, filename, temp_path):
+    """Dá o nome final ao ficheiro temporário (se já existir um ficheiro igual, este é substituído pelo mesmo conteúdo)."""
+    os.replace(temp_path, os.path.join(upload_folder, filename))
+
+
+def remove_image_files(upload_folder, filename):
+    """Apaga o ficheiro original e todas as variantes de uma imagem da pasta de uploads."""
+    file_path = os.path.join(upload_folder, filename)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    stem = os.path.splitext(filename)[0]
+    variants_folder = os.path.join(upload_folder, VARIANTS_FOLDER)
+    if os.path.isdir(variants_folder):
+        for variant_name in os.listdir(variants_folder):
+            if re.fullmatch(re.escape(stem) + r'-\d+w\.\w+', variant_name):
+                os.remove(os.path.join(variants_folder, variant_name))
+
+
+# ------------------------------- Variantes das imagens dos veículos ----------------------------------------------
+
+# Tamanhos máximos (largura, altura) das variantes geradas a partir de cada imagem enviada. A imagem é reduzida
+# mantendo as proporções e nunca é ampliada
+IMAGE_SIZES = {
+    'thumb': (480, 360),  # Cartões do catálogo e miniaturas do admin
+    'medium': (1024, 768),  # Página de reserva e carrinho
+}
+
+# Formatos das variantes e opções de compressão. O AVIF só é gerado se o Pillow tiver suporte. As velocidades foram
+# escolhidas para cada variante demorar centésimas de segundo (o method=6 do WebP é ~100x mais lento para ficheiros
+# apenas ~2% mais pequenos)
+IMAGE_FORMATS = {
+    'avif': {'quality': 55, 'speed': 8},
+    'webp': {'quality': 80, 'method': 4},
+}
+
+# Pasta (dentro da pasta de uploads) onde ficam as variantes
+VARIANTS_FOLDER = 'variants'
+
+
+def available_formats():
+    """Formatos de variantes que o Pillow instalado consegue gerar."""
+    if Image is None:
+        return []
+    return [image_format for image_format in IMAGE_FORMATS if features.check(image_format)]
+
+
+def generate_variants(upload_folder, filename):
+    """
+    Gera as variantes reduzidas e comprimidas de uma imagem guardada na pasta de uploads.
+
+    Args:
+        upload_folder (str): Pasta de uploads (UPLOAD_FOLDER)
+        filename (str): Nome do ficheiro original dentro da pasta de uploads
+
+    Returns:
+        list: Uma entrada por variante com size, format, path (relativo à pasta static), width e height. Lista
+        vazia se o Pillow não estiver instalado ou se o ficheiro não for uma imagem válida
+    """
+    formats = available_formats()
+    if not formats:
+        return []
+
+    variants_folder = os.path.join(upload_folder, VARIANTS_FOLDER)
+    os.makedirs(variants_folder, exist_ok=True)
+    stem = os.path.splitext(filename)[0]
+
+    try:
+        with Image.open(os.path.join(upload_folder, filename)) as original:
+            original = ImageOps.exif_transpose(original)  # Respeita a orientação das fotografias
+            if original.mode not in ('RGB', 'RGBA'):
+                has_alpha = original.mode in ('LA', 'PA') or 'transparency' in original.info
+                original = original.convert('RGBA' if has_alpha else 'RGB')
+
+            variants = []
+            generated_widths = set()
+            for size, max_size in IMAGE_SIZES.items():
+                image = original.copy()
+                image.thumbnail(max_size, Image.LANCZOS)
+                if image.width in generated_widths:  # Imagem original mais pequena do que este tamanho
+                    continue
+                generated_widths.add(image.width)
+
+                for image_format in formats:
+                    variant_name = f'{stem}-{image.width}w.{image_format}'
+                    image.save(os.path.join(variants_folder, variant_name), image_format.upper(),
+                               **IMAGE_FORMATS[image_format])
+                    variants.append({
+                        'size': size,
+                        'format': image_format,
+                        'path': f'uploads/{VARIANTS_FOLDER}/{variant_name}',
+                        'width': image.width,
+                        'height': image.height,
+                    })
+            return variants
+
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning('Não foi possível gerar as variantes de %s: %s', filename, e)
+        return []
+
+
+def process_image(upload_folder, filename):
+    """
+    Calcula o hash e os metadados de uma imagem guardada na pasta de uploads e gera as variantes.
+
+    É o trabalho pesado de cada upload, por isso corre no pool de processamento de imagens (ImageWorkerPool) e não
+    dentro do pedido HTTP.
+
+    Returns:
+        dict: sha256, bytes, width, height, format e variantes (ver generate_variants). As dimensões e o formato
+        ficam a None se o Pillow não estiver instalado ou se o ficheiro não for uma imagem válida
+    """
+    file_path = os.path.join(upload_folder, filename)
+
+    # As imagens guardadas com store_upload já têm o hash no nome, só as imagens antigas precisam de ser lidas
+    stem = os.path.splitext(filename)[0]
+    if CONTENT_NAME.fullmatch(stem):
+        file_hash = stem
+    else:
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        file_hash = sha256.hexdigest()
+
+    info = {'sha256': file_hash, 'bytes': os.path.getsize(file_path),
+            'width': None, 'height': None, 'format': None}
+    if Image is not None:
+        try:
+            with Image.open(file_path) as image:  # Só lê o cabeçalho do ficheiro
+                info['width'], info['height'] = image.size
+                info['format'] = image.format
+        except (UnidentifiedImageError, OSError):
+            pass
+
+    info['variantes'] = generate_variants(upload_folder, filename)
+    return info
+
+
+class ImageWorkerPool:
+    """
+    Pool limitado de threads para processar as imagens enviadas fora do pedido HTTP.
+
+    Com max_workers=0 as tarefas correm logo, no próprio pedido. A fila de tarefas à espera também é limitada
+    (max_pending): quando está cheia, submit espera que uma tarefa termine, para que um pico de uploads não acumule
+    trabalho sem fim em memória.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='images') \
+            if max_workers else None
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending) if max_workers else None
+
+    def submit(self, fn, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._task_done)
+
+    def _task_done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            logger.error('Erro no processamento de uma imagem', exc_info=future.exception())
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+def init_image_workers(app):
+    """Cria o pool de processamento de imagens (IMAGE_WORKERS threads, IMAGE_QUEUE_SIZE tarefas em espera)."""
+    pool = ImageWorkerPool(app.config['IMAGE_WORKERS'], app.config['IMAGE_QUEUE_SIZE'])
+    app.extensions['image_workers'] = pool
+    return pool
+
+
+def remove_variants(static_folder, variants):
+    """Apaga os ficheiros das variantes (os caminhos são relativos à pasta static)."""
+    for variant in variants:
+        file_path = os.path.join(static_folder, variant['path'])
+        if os.path.exists(file_path):
+            os.remove(file_path)
@@ -0,0 +1,50 @@
+"""Add reservation interval
+
+Revision ID: 0b9e4f7a2c63
+Revises: f2d8b35c6e41
+Create Date: 2026-10-17 12:37:51.402988
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b9e4f7a2c63'
+down_revision = 'f2d8b35c6e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('start_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('end_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_reservation_vehicle_interval', ['fk_reservation_vehicle', 'start_at', 'end_at'],
+                              unique=False)
+
+    # Preenche start_at/end_at das reservas existentes a partir das colunas de data e hora
+    reservation = sa.table('reservation',
+                           sa.column('id', sa.Integer),
+                           sa.column('start_date', sa.Date),
+                           sa.column('start_time', sa.Time),
+                           sa.column('end_date', sa.Date),
+                           sa.column('end_time', sa.Time),
+                           sa.column('start_at', sa.DateTime),
+                           sa.column('end_at', sa.DateTime))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(reservation.c.id, reservation.c.start_date, reservation.c.start_time,
+                                        reservation.c.end_date, reservation.c.end_time)).fetchall()
+    for row in rows:
+        connection.execute(reservation.update().where(reservation.c.id == row.id).values(
+            start_at=datetime.combine(row.start_date, row.start_time),
+            end_at=datetime.combine(row.end_date, row.end_time)))
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_reservation_vehicle_interval')
+        batch_op.drop_column('end_at')
+        batch_op.drop_column('start_at')
@@ -0,0 +1,50 @@
+"""Add reservation checkout id
+
+Revision ID: 2d7f4b8e1a39
+Revises: 1c5a7e9d3f20
+Create Date: 2026-10-17 13:31:44.207915
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d7f4b8e1a39'
+down_revision = '1c5a7e9d3f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('checkout_id', sa.String(length=32), nullable=True))
+        batch_op.create_index(batch_op.f('ix_reservation_checkout_id'), ['checkout_id'], unique=False)
+
+    # Agrupa as reservas existentes em checkouts como a página de confirmação fazia até agora: reservas do mesmo
+    # cliente criadas com menos de um segundo de diferença pertencem ao mesmo checkout
+    reservation = sa.table('reservation',
+                           sa.column('id', sa.Integer),
+                           sa.column('fk_reservation_customer', sa.Integer),
+                           sa.column('created_at', sa.DateTime),
+                           sa.column('checkout_id', sa.String))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(reservation.c.id, reservation.c.fk_reservation_customer,
+                                        reservation.c.created_at)
+                              .order_by(reservation.c.fk_reservation_customer, reservation.c.created_at,
+                                        reservation.c.id)).fetchall()
+    checkout_id, checkout_customer, checkout_start = None, None, None
+    for row in rows:
+        if row.fk_reservation_customer != checkout_customer or row.created_at is None or checkout_start is None \
+                or (row.created_at - checkout_start).total_seconds() >= 1:
+            checkout_id = uuid.uuid4().hex
+            checkout_customer, checkout_start = row.fk_reservation_customer, row.created_at
+        connection.execute(reservation.update().where(reservation.c.id == row.id).values(checkout_id=checkout_id))
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_reservation_checkout_id'))
+        batch_op.drop_column('checkout_id')
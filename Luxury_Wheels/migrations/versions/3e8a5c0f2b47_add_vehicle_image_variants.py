@@ -0,0 +1,45 @@
+"""Add vehicle image variants
+
+Revision ID: 3e8a5c0f2b47
+Revises: 2d7f4b8e1a39
+Create Date: 2026-10-17 13:58:20.664183
+
+"""
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e8a5c0f2b47'
+down_revision = '2d7f4b8e1a39'
+branch_labels = None
+depends_on = None
+
+
+# O batch_alter_table do SQLite recria a tabela veiculos (cópia, DROP e RENAME), o que falha com os triggers do índice
+# de pesquisa (veiculos_fts_*) que usam a tabela. Os triggers são apagados antes e recriados depois com o mesmo SQL,
+# por isso a migração não depende do DROP COLUMN nativo (SQLite 3.35+)
+@contextmanager
+def _without_vehicle_triggers():
+    connection = op.get_bind()
+    triggers = []
+    if connection.dialect.name == 'sqlite':
+        triggers = connection.execute(sa.text(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%veiculos%'")).all()
+    for name, _ in triggers:
+        op.execute(f'DROP TRIGGER "{name}"')
+    yield
+    for _, sql in triggers:
+        op.execute(sql)
+
+
+def upgrade():
+    with op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('imagens_variantes', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with _without_vehicle_triggers(), op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.drop_column('imagens_variantes')
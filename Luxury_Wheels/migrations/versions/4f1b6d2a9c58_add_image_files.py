@@ -0,0 +1,47 @@
+"""Add image files
+
+Revision ID: 4f1b6d2a9c58
+Revises: 3e8a5c0f2b47
+Create Date: 2026-10-17 14:41:09.315862
+
+"""
+from collections import Counter
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1b6d2a9c58'
+down_revision = '3e8a5c0f2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_files',
+    sa.Column('path', sa.String(length=200), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('info', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('path')
+    )
+
+    # Conta as referências às imagens que os veículos já têm
+    connection = op.get_bind()
+    image_files = sa.table('image_files',
+                           sa.column('path', sa.String),
+                           sa.column('ref_count', sa.Integer),
+                           sa.column('created_at', sa.DateTime))
+
+    ref_counts = Counter()
+    for (imagens,) in connection.execute(sa.text("SELECT imagens FROM veiculos WHERE imagens IS NOT NULL")):
+        ref_counts.update(path.strip() for path in imagens.split(',') if path.strip())
+    if ref_counts:
+        op.bulk_insert(image_files, [{'path': path, 'ref_count': count, 'created_at': datetime.utcnow()}
+                                     for path, count in ref_counts.items()])
+
+
+def downgrade():
+    op.drop_table('image_files')
@@ -0,0 +1,127 @@
+"""Add vehicle images
+
+Revision ID: 5a2c8e1f4d73
+Revises: 4f1b6d2a9c58
+Create Date: 2026-10-17 15:22:37.408119
+
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a2c8e1f4d73'
+down_revision = '4f1b6d2a9c58'
+branch_labels = None
+depends_on = None
+
+
+# O batch_alter_table do SQLite recria a tabela veiculos (cópia, DROP e RENAME), o que falha com os triggers do índice
+# de pesquisa (veiculos_fts_*) que usam a tabela. Os triggers são apagados antes e recriados depois com o mesmo SQL,
+# por isso a migração não depende do DROP COLUMN nativo (SQLite 3.35+)
+@contextmanager
+def _without_vehicle_triggers():
+    connection = op.get_bind()
+    triggers = []
+    if connection.dialect.name == 'sqlite':
+        triggers = connection.execute(sa.text(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%veiculos%'")).all()
+    for name, _ in triggers:
+        op.execute(f'DROP TRIGGER "{name}"')
+    yield
+    for _, sql in triggers:
+        op.execute(sql)
+
+
+vehicle_images = sa.table('vehicle_images',
+                          sa.column('id', sa.Integer),
+                          sa.column('vehicle_id', sa.Integer),
+                          sa.column('position', sa.Integer),
+                          sa.column('path', sa.String),
+                          sa.column('bytes', sa.Integer),
+                          sa.column('width', sa.Integer),
+                          sa.column('height', sa.Integer),
+                          sa.column('format', sa.String),
+                          sa.column('variantes', sa.Text),
+                          sa.column('processed_at', sa.DateTime))
+
+
+def upgrade():
+    op.create_table('vehicle_images',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('vehicle_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=200), nullable=False),
+    sa.Column('bytes', sa.Integer(), nullable=True),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('format', sa.String(length=10), nullable=True),
+    sa.Column('variantes', sa.Text(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['vehicle_id'], ['veiculos.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('vehicle_images', schema=None) as batch_op:
+        batch_op.create_index('ix_vehicle_images_vehicle_position', ['vehicle_id', 'position'], unique=False)
+        batch_op.create_index(batch_op.f('ix_vehicle_images_path'), ['path'], unique=False)
+
+    # Converte a lista de caminhos separados por vírgula (e os metadados em JSON) de cada veículo numa linha por
+    # imagem. As imagens sem metadados no veículo usam os do ficheiro (image_files), se este já tiver sido processado
+    connection = op.get_bind()
+    file_infos = {row.path: json.loads(row.info) for row in
+                  connection.execute(sa.text("SELECT path, info FROM image_files WHERE info IS NOT NULL"))}
+    rows = []
+    for vehicle in connection.execute(sa.text("SELECT id, imagens, imagens_variantes FROM veiculos "
+                                              "WHERE imagens IS NOT NULL AND imagens != '' ORDER BY id")):
+        vehicle_infos = json.loads(vehicle.imagens_variantes) if vehicle.imagens_variantes else {}
+        paths = [path.strip() for path in vehicle.imagens.split(',') if path.strip()]
+        for position, path in enumerate(paths):
+            info = vehicle_infos.get(path) or file_infos.get(path)
+            rows.append({
+                'vehicle_id': vehicle.id,
+                'position': position,
+                'path': path,
+                'bytes': info.get('bytes') if info else None,
+                'width': info.get('width') if info else None,
+                'height': info.get('height') if info else None,
+                'format': info.get('format') if info else None,
+                'variantes': json.dumps(info.get('variantes', [])) if info else None,
+                'processed_at': datetime.now() if info else None,
+            })
+    if rows:
+        op.bulk_insert(vehicle_images, rows)
+
+    with _without_vehicle_triggers(), op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.drop_column('imagens_variantes')
+        batch_op.drop_column('imagens')
+
+
+def downgrade():
+    op.add_column('veiculos', sa.Column('imagens', sa.Text(), nullable=True))
+    op.add_column('veiculos', sa.Column('imagens_variantes', sa.Text(), nullable=True))
+
+    # Volta a juntar os caminhos de cada veículo numa string separada por vírgulas, com os metadados em JSON
+    connection = op.get_bind()
+    imagens = {}
+    for image in connection.execute(sa.select(vehicle_images).order_by(vehicle_images.c.vehicle_id,
+                                                                       vehicle_images.c.position)):
+        paths, infos = imagens.setdefault(image.vehicle_id, ([], {}))
+        paths.append(image.path)
+        if image.processed_at is not None:
+            infos[image.path] = {'bytes': image.bytes, 'width': image.width, 'height': image.height,
+                                 'format': image.format,
+                                 'variantes': json.loads(image.variantes) if image.variantes else []}
+    for vehicle_id, (paths, infos) in imagens.items():
+        connection.execute(sa.text("UPDATE veiculos SET imagens = :imagens, imagens_variantes = :variantes "
+                                   "WHERE id = :id"),
+                           {'imagens': ','.join(paths), 'variantes': json.dumps(infos), 'id': vehicle_id})
+
+    with op.batch_alter_table('vehicle_images', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_vehicle_images_path'))
+        batch_op.drop_index('ix_vehicle_images_vehicle_position')
+
+    op.drop_table('vehicle_images')
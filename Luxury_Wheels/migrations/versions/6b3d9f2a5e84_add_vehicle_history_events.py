@@ -0,0 +1,122 @@
+"""Add vehicle maintenance and legalization events
+
+Revision ID: 6b3d9f2a5e84
+Revises: 5a2c8e1f4d73
+Create Date: 2026-10-17 16:05:12.731940
+
+"""
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b3d9f2a5e84'
+down_revision = '5a2c8e1f4d73'
+branch_labels = None
+depends_on = None
+
+
+# O batch_alter_table do SQLite recria a tabela veiculos (cópia, DROP e RENAME), o que falha com os triggers do índice
+# de pesquisa (veiculos_fts_*) que usam a tabela. Os triggers são apagados antes e recriados depois com o mesmo SQL,
+# por isso a migração não depende do DROP COLUMN nativo (SQLite 3.35+)
+@contextmanager
+def _without_vehicle_triggers():
+    connection = op.get_bind()
+    triggers = []
+    if connection.dialect.name == 'sqlite':
+        triggers = connection.execute(sa.text(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%veiculos%'")).all()
+    for name, _ in triggers:
+        op.execute(f'DROP TRIGGER "{name}"')
+    yield
+    for _, sql in triggers:
+        op.execute(sql)
+
+
+# Tabela de eventos -> (coluna do histórico em texto, última data, próxima data) em veiculos
+EVENT_TABLES = {
+    'maintenance_events': ('maintenance_history', 'last_maintenance', 'next_maintenance'),
+    'legalization_events': ('legalization_history', 'last_legalization_date', 'next_legalization_date'),
+}
+
+
+def _events_table(name):
+    return sa.table(name,
+                    sa.column('veiculo_id', sa.Integer),
+                    sa.column('date', sa.Date),
+                    sa.column('next_date', sa.Date),
+                    sa.column('description', sa.Text),
+                    sa.column('created_at', sa.DateTime))
+
+
+def upgrade():
+    for name in EVENT_TABLES:
+        op.create_table(name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('veiculo_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('next_date', sa.Date(), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['veiculo_id'], ['veiculos.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{name}_veiculo_date', ['veiculo_id', 'date'], unique=False)
+
+    with op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_veiculos_next_maintenance'), ['next_maintenance'], unique=False)
+        batch_op.create_index(batch_op.f('ix_veiculos_next_legalization_date'), ['next_legalization_date'],
+                              unique=False)
+
+    # Cada histórico em texto passa a ser um evento, com a data da última manutenção/legalização do veículo (ou a de
+    # hoje, se não estiver preenchida) e a próxima data do veículo. Os veículos só com as datas preenchidas também
+    # ficam com um evento, para que as datas derivadas do histórico sejam as mesmas
+    connection = op.get_bind()
+    for name, (history_column, last_column, next_column) in EVENT_TABLES.items():
+        rows = []
+        for vehicle in connection.execute(sa.text(
+                f"SELECT id, {history_column} AS history, {last_column} AS last, {next_column} AS next "
+                f"FROM veiculos WHERE COALESCE({history_column}, '') != '' OR {last_column} IS NOT NULL "
+                f"OR {next_column} IS NOT NULL")):
+            rows.append({
+                'veiculo_id': vehicle.id,
+                'date': date.fromisoformat(str(vehicle.last)) if vehicle.last else date.today(),
+                'next_date': date.fromisoformat(str(vehicle.next)) if vehicle.next else None,
+                'description': vehicle.history or '',
+                'created_at': datetime.utcnow(),
+            })
+        if rows:
+            op.bulk_insert(_events_table(name), rows)
+
+    with _without_vehicle_triggers(), op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.drop_column('legalization_history')
+        batch_op.drop_column('maintenance_history')
+
+
+def downgrade():
+    op.add_column('veiculos', sa.Column('maintenance_history', sa.String(length=1000), nullable=True))
+    op.add_column('veiculos', sa.Column('legalization_history', sa.String(length=1000), nullable=True))
+
+    # Junta as descrições dos eventos de cada veículo num texto, uma linha por evento (limitado a 1000 caracteres)
+    connection = op.get_bind()
+    for name, (history_column, _, _) in EVENT_TABLES.items():
+        histories = {}
+        for event in connection.execute(sa.text(f"SELECT veiculo_id, date, description FROM {name} "
+                                                f"ORDER BY veiculo_id, date, id")):
+            histories.setdefault(event.veiculo_id, []).append(f"{event.date}: {event.description or ''}".strip())
+        for vehicle_id, lines in histories.items():
+            connection.execute(sa.text(f"UPDATE veiculos SET {history_column} = :history WHERE id = :id"),
+                               {'history': '\n'.join(lines)[:1000], 'id': vehicle_id})
+
+    with op.batch_alter_table('veiculos', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_veiculos_next_legalization_date'))
+        batch_op.drop_index(batch_op.f('ix_veiculos_next_maintenance'))
+
+    for name in EVENT_TABLES:
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{name}_veiculo_date')
+        op.drop_table(name)
@@ -0,0 +1,29 @@
+"""Add scheduler leases
+
+Revision ID: 7c4e1a8b3d26
+Revises: 6b3d9f2a5e84
+Create Date: 2026-10-17 20:02:41.183905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e1a8b3d26'
+down_revision = '6b3d9f2a5e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduler_leases',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('owner', sa.String(length=128), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('scheduler_leases')
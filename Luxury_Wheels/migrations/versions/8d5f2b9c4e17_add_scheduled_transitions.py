@@ -0,0 +1,50 @@
+"""Add scheduled transitions
+
+Revision ID: 8d5f2b9c4e17
+Revises: 7c4e1a8b3d26
+Create Date: 2026-10-17 20:41:09.527318
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d5f2b9c4e17'
+down_revision = '7c4e1a8b3d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('scheduled_transitions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('due_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'target_id', name='uq_scheduled_transitions_target')
+    )
+    with op.batch_alter_table('scheduled_transitions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_scheduled_transitions_due_at'), ['due_at'], unique=False)
+
+    # Transições das datas futuras que já estão gravadas (veículos reservados, em manutenção ou indisponíveis, e
+    # reservas por concluir)
+    connection = op.get_bind()
+    now = sa.bindparam('now', datetime.now(), type_=sa.DateTime())
+    for column, kind in (('available_from', 'veiculo'), ('maintenance_end', 'manutencao')):
+        connection.execute(sa.text(
+            f"INSERT INTO scheduled_transitions (kind, target_id, due_at) "
+            f"SELECT '{kind}', id, {column} FROM veiculos WHERE {column} > :now").bindparams(now))
+    connection.execute(sa.text(
+        "INSERT INTO scheduled_transitions (kind, target_id, due_at) "
+        "SELECT 'reserva', id, end_at FROM reservation WHERE end_at > :now AND status != 'Concluída'").bindparams(now))
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_transitions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_scheduled_transitions_due_at'))
+
+    op.drop_table('scheduled_transitions')
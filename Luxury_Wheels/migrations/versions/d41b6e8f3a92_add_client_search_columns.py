@@ -0,0 +1,56 @@
+"""Add client search columns
+
+Revision ID: d41b6e8f3a92
+Revises: c7e2a94b1f05
+Create Date: 2026-10-17 10:41:12.556730
+
+"""
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41b6e8f3a92'
+down_revision = 'c7e2a94b1f05'
+branch_labels = None
+depends_on = None
+
+
+def _normalize(value):
+    # Igual a utils.normalize_text, copiado para a migração não depender do código da aplicação
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def upgrade():
+    with op.batch_alter_table('clientes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('nome_pesquisa', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('apelido_pesquisa', sa.String(length=100), nullable=True))
+        batch_op.create_index(batch_op.f('ix_clientes_nome_pesquisa'), ['nome_pesquisa'], unique=False)
+        batch_op.create_index(batch_op.f('ix_clientes_apelido_pesquisa'), ['apelido_pesquisa'], unique=False)
+
+    # Preenche as colunas de pesquisa dos clientes existentes
+    clientes = sa.table('clientes',
+                        sa.column('id', sa.Integer),
+                        sa.column('nome', sa.String),
+                        sa.column('apelido', sa.String),
+                        sa.column('nome_pesquisa', sa.String),
+                        sa.column('apelido_pesquisa', sa.String))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(clientes.c.id, clientes.c.nome, clientes.c.apelido)).fetchall()
+    for row in rows:
+        connection.execute(clientes.update().where(clientes.c.id == row.id).values(
+            nome_pesquisa=_normalize(row.nome), apelido_pesquisa=_normalize(row.apelido)))
+
+
+def downgrade():
+    with op.batch_alter_table('clientes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_clientes_apelido_pesquisa'))
+        batch_op.drop_index(batch_op.f('ix_clientes_nome_pesquisa'))
+        batch_op.drop_column('apelido_pesquisa')
+        batch_op.drop_column('nome_pesquisa')
@@ -0,0 +1,73 @@
+"""Add vehicle search index
+
+Revision ID: e58c0a7d2b16
+Revises: d41b6e8f3a92
+Create Date: 2026-10-17 11:20:36.184407
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e58c0a7d2b16'
+down_revision = 'd41b6e8f3a92'
+branch_labels = None
+depends_on = None
+
+
+# Tabela FTS5 e triggers que a mantêm sincronizada com veiculos/categoria (igual a search.SEARCH_INDEX_DDL)
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS veiculos_fts
+        USING fts5(brand, model, categoria, tipo, tokenize="unicode61 remove_diacritics 2")""",
+
+    """CREATE TRIGGER IF NOT EXISTS veiculos_fts_insert AFTER INSERT ON veiculos BEGIN
+        INSERT INTO veiculos_fts(rowid, brand, model, categoria, tipo)
+        VALUES (NEW.id, NEW.brand, NEW.model,
+                (SELECT nome FROM categoria WHERE id = NEW.categoria_id), NEW.type);
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS veiculos_fts_update AFTER UPDATE OF brand, model, type, categoria_id
+        ON veiculos BEGIN
+        DELETE FROM veiculos_fts WHERE rowid = OLD.id;
+        INSERT INTO veiculos_fts(rowid, brand, model, categoria, tipo)
+        VALUES (NEW.id, NEW.brand, NEW.model,
+                (SELECT nome FROM categoria WHERE id = NEW.categoria_id), NEW.type);
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS veiculos_fts_delete AFTER DELETE ON veiculos BEGIN
+        DELETE FROM veiculos_fts WHERE rowid = OLD.id;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS veiculos_fts_categoria_update AFTER UPDATE OF nome ON categoria BEGIN
+        UPDATE veiculos_fts SET categoria = NEW.nome
+        WHERE rowid IN (SELECT id FROM veiculos WHERE categoria_id = NEW.id);
+    END""",
+]
+
+
+def upgrade():
+    # O índice FTS5 só existe em SQLite, nas outras bases de dados a pesquisa usa ILIKE
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for statement in SEARCH_INDEX_DDL:
+        op.execute(statement)
+
+    # Preenche o índice com os veículos existentes
+    op.execute("""
+        INSERT INTO veiculos_fts(rowid, brand, model, categoria, tipo)
+        SELECT v.id, v.brand, v.model, (SELECT c.nome FROM categoria c WHERE c.id = v.categoria_id), v.type
+        FROM veiculos v
+        WHERE v.id NOT IN (SELECT rowid FROM veiculos_fts)
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS veiculos_fts_categoria_update")
+    op.execute("DROP TRIGGER IF EXISTS veiculos_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS veiculos_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS veiculos_fts_insert")
+    op.execute("DROP TABLE IF EXISTS veiculos_fts")
@@ -1,12 +1,64 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime, date
-
-from sqlalchemy import or_
+from datetime import date, datetime, timedelta
+import json
+import uuid
+from collections import Counter
+
+from sqlalchemy import or_, and_, case, text, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import object_session, validates
 from werkzeug.security import generate_password_hash, check_password_hash
 from enum import Enum
 
-db = SQLAlchemy()
+from db_engine import RoutingSession
+from utils import normalize_text
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})  # Ver db_engine.use_read_engine
+
+
+def lock_for_write(query):
+    """
+    Prepara uma query para um "ler, verificar e escrever" atómico.
+
+    Em SQLite termina a transação de leitura atual e abre uma nova com BEGIN IMMEDIATE, que fica logo com o lock de
+    escrita da base de dados. Nas outras bases de dados bloqueia as linhas lidas com SELECT ... FOR UPDATE. Deve ser
+    chamada antes de qualquer alteração na sessão, para que tudo o que se segue fique na mesma transação.
+
+    Returns:
+        Query para executar dentro da transação (o commit fica a cargo de quem chama)
+
+    Raises:
+        RuntimeError: Se a sessão já tiver alterações (em SQLite não é possível pedir o lock a meio da transação sem
+            as gravar ou perder)
+    """
+    session = db.session
+    if session.get_bind().dialect.name == 'sqlite':
+        if session.new or session.dirty or session.deleted or session.info.get('has_writes'):
+            raise RuntimeError('lock_for_write tem de ser chamado antes de alterar objetos da sessão')
+        session.rollback()  # A transação atual só fez leituras, não há nada a perder
+        session.execute(text("BEGIN IMMEDIATE"))
+        return query
+    return query.with_for_update()
+
+
+# Marca as sessões com escritas na transação atual (flush ou UPDATE/DELETE em bloco), para o lock_for_write
+@db.event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush_writes(session, flush_context):
+    session.info['has_writes'] = True
+
+
+@db.event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info['has_writes'] = True
+
+
+@db.event.listens_for(RoutingSession, 'after_commit')
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def _clear_writes(session):
+    session.info.pop('has_writes', None)
 
 
 class Clientes(db.Model, UserMixin):
@@ -24,6 +76,11 @@ class Clientes(db.Model, UserMixin):
     password = db.Column(db.String(100), nullable=False)
     user_type = db.Column(db.String(10), default='client')  # Tipo de utilizador, por defeito é 'client'
 
+    # Nome e apelido normalizados (sem acentos e em minúsculas) para a pesquisa do admin por prefixo com índice.
+    # São preenchidos automaticamente sempre que o nome ou o apelido são alterados (ver _sync_search_columns)
+    nome_pesquisa = db.Column(db.String(100), index=True)
+    apelido_pesquisa = db.Column(db.String(100), index=True)
+
     # Método construtor que inicializa um novo cliente
     def __init__(self, nome, apelido, email, telefone, data_nascimento, morada, nif, password):  # Inicializa um
         # cliente com os parâmetros especificados
@@ -37,6 +94,12 @@ class Clientes(db.Model, UserMixin):
         self.password = generate_password_hash(password)  # Encripta a password antes de guardar
         self.user_type = 'client'
 
+    # Mantém as colunas de pesquisa sincronizadas com o nome e o apelido
+    @validates('nome', 'apelido')
+    def _sync_search_columns(self, key, value):
+        setattr(self, f'{key}_pesquisa', normalize_text(value))
+        return value
+
     # Método requerido pelo Flask-Login para identificar utilizadores
     def get_id(self):
         return f"client_{self.id}"  # Retorna ID prefixado com 'client_'
@@ -90,6 +153,12 @@ class Categoria(db.Model):
 
 class Veiculos(db.Model):
     __tablename__ = "veiculos"  # Nome da tabela no banco de dados
+    __table_args__ = (
+        db.Index("ix_veiculos_brand_model_id", "brand", "model", "id"),  # Ordenação/paginação por cursor do admin
+        # Filtros do catálogo: tipo + categorias + intervalo de preço, e veículos disponíveis
+        db.Index("ix_veiculos_type_categoria_price", "type", "categoria_id", "price_per_day"),
+        db.Index("ix_veiculos_status_maintenance_available", "status", "in_maintenance", "available_from"),
+    )
 
     # Definição das colunas da tabela
     id = db.Column(db.Integer, primary_key=True)
@@ -108,23 +177,21 @@ class Veiculos(db.Model):
     status = db.Column(db.Boolean, default=True)
     in_maintenance = db.Column(db.Boolean, default=False)
     maintenance_start = db.Column(db.DateTime, nullable=True)
-    maintenance_end = db.Column(db.DateTime, nullable=True)
-    available_from = db.Column(db.DateTime, nullable=True)
+    maintenance_end = db.Column(db.DateTime, nullable=True, index=True)  # Indexado para o scheduler expirar as
+    # manutenções com uma pesquisa por intervalo
+    available_from = db.Column(db.DateTime, nullable=True, index=True)
 
-    # Datas de manutenção
+    # Datas de manutenção, derivadas do histórico (MaintenanceEvent) por add_maintenance_event. A próxima manutenção
+    # é indexada para as pesquisas dos veículos com manutenção a fazer (maintenance_due_filter)
     last_maintenance = db.Column(db.Date)
-    next_maintenance = db.Column(db.Date)
-    maintenance_history = db.Column(db.String(1000), default="")
+    next_maintenance = db.Column(db.Date, index=True)
 
     # Estado de reserva
     is_reserved = db.Column(db.Boolean, default=False)
 
+    # Datas de legalização, derivadas do histórico (LegalizationEvent) por add_legalization_event
     last_legalization_date = db.Column(db.Date)
-    next_legalization_date = db.Column(db.Date)
-    legalization_history = db.Column(db.String(1000), default="")
-
-    # Imagens e categoria
-    imagens = db.Column(db.Text)  # Armazena caminhos de imagens separados por vírgula
+    next_legalization_date = db.Column(db.Date, index=True)
 
     # Relações com outras tabelas
     categoria_id = db.Column(db.Integer, db.ForeignKey("categoria.id"), nullable=False)  # Utiliza uma chave
@@ -134,6 +201,19 @@ class Veiculos(db.Model):
     # tabelas relacionadas de maneira mais intuitiva e eficiente
     reservations = db.relationship("Reservation", backref="veiculos", lazy=True)  # O lazy=True (lazy loading) evita
 
+    # Imagens do veículo pela ordem em que são mostradas (a primeira é a imagem principal), ver VehicleImage. As
+    # listagens carregam as imagens de todos os veículos da página numa única query (selectinload)
+    imagens = db.relationship("VehicleImage", order_by="VehicleImage.position", cascade="all, delete-orphan",
+                              lazy=True)
+
+    # Histórico de manutenções e de legalizações, por data
+    maintenance_events = db.relationship(
+        "MaintenanceEvent", order_by="[MaintenanceEvent.date, MaintenanceEvent.id]", cascade="all, delete-orphan",
+        lazy=True)
+    legalization_events = db.relationship(
+        "LegalizationEvent", order_by="[LegalizationEvent.date, LegalizationEvent.id]", cascade="all, delete-orphan",
+        lazy=True)
+
     # Método construtor
     def __init__(self, type, brand, model, year, price_per_day, seats, bags, transmission, fuel_consumption, categoria,
                  status=True, maintenance_start=None, maintenance_end=None):
@@ -146,11 +226,8 @@ class Veiculos(db.Model):
         self.bags = bags
         self.transmission = transmission.title()  # Converte as primeiras letras em maiúsculas
         self.fuel_consumption = fuel_consumption
-        self.maintenance_history = ""
         self.last_legalization_date = None
         self.next_legalization_date = None
-        self.legalization_history = ""
-        self.imagens = ""
         self.categoria = categoria
         self.status = status
         self.in_maintenance = False
@@ -174,76 +251,167 @@ class Veiculos(db.Model):
         current_datetime = datetime.now()
         return self.maintenance_start <= current_datetime <= self.maintenance_end
 
+    # Estado de disponibilidade derivado no momento da leitura ('reservado', 'manutencao', 'indisponivel' ou
+    # 'disponivel'). Como é calculado a partir das datas, não depende de nenhuma tarefa ter atualizado as colunas
+    # status/available_from, por isso as páginas de leitura nunca precisam de escrever na base de dados
+    @hybrid_property
+    def availability_state(self):
+        current_datetime = datetime.now()
+
+        if self.is_currently_reserved():
+            return "reservado"
+
+        if self.is_in_maintenance():
+            return "manutencao"
+
+        # Indisponível até uma data futura, ou inativo sem data prevista de disponibilidade (uma manutenção que já
+        # terminou conta como disponível, mesmo que o scheduler ainda não tenha limpo as colunas)
+        if self.available_from:
+            if current_datetime < self.available_from:
+                return "indisponivel"
+        elif not self.status and not (self.maintenance_end and self.maintenance_end < current_datetime):
+            return "indisponivel"
+
+        return "disponivel"
+
+    # Versão SQL do mesmo estado, para poder ser usada em filtros, ordenações e contagens
+    @availability_state.expression
+    def availability_state(cls):
+        current_datetime = datetime.now()
+        return case(
+            (and_(cls.is_reserved == True,
+                  cls.available_from.isnot(None),
+                  cls.available_from > current_datetime), "reservado"),
+            (and_(cls.maintenance_start.isnot(None),
+                  cls.maintenance_end.isnot(None),
+                  cls.maintenance_start <= current_datetime,
+                  cls.maintenance_end >= current_datetime), "manutencao"),
+            (or_(cls.available_from > current_datetime,
+                 and_(cls.available_from.is_(None),
+                      cls.status.isnot(True),
+                      or_(cls.maintenance_end.is_(None), cls.maintenance_end >= current_datetime))), "indisponivel"),
+            else_="disponivel")
+
     # Verifica em tempo real se uma reserva ainda está ativa, similar ao que já acontecia
     # com a manutenção. Isso garante que o status seja atualizado automaticamente quando
     # uma reserva expira
     def get_availability_status(self):
-        # Verifica se está reservado usando o novo método
-        if self.is_currently_reserved():
+        state = self.availability_state
+
+        if state == "reservado":
             return "Reservado", "reservado"
 
-        # Verifica se o veículo está em manutenção
-        if self.is_in_maintenance():
+        if state == "manutencao":
             return "Em Manutenção", "manutencao"
 
-        # Se não está em manutenção nem reservado, verifica status e available_from
-        if not self.status and self.available_from:
-            current_datetime = datetime.now()
-            if current_datetime < self.available_from:
+        if state == "indisponivel":
+            if self.available_from:
                 return "Indisponível até " + self.available_from.strftime('%d/%m/%Y'), "indisponivel"
-            else:
-                return "Disponível", "disponivel"
-
-        # Verifica se está indisponível por algum outro motivo
-        elif not self.status:
             return "Indisponível", "indisponivel"
 
         # Se passou por todas as verificações, está disponível
-        else:
-            return "Disponível", "disponivel"
+        return "Disponível", "disponivel"
 
-    # Método para definir as imagens do veículo
+    # Método para definir as imagens do veículo, pela ordem da lista. As imagens que continuam no veículo mantêm os
+    # metadados e as variantes já processados
     def set_imagens(self, imagens_list):
-        # Se a lista de imagens existir, junta todos os caminhos com vírgulas
-        # Se não existir, guarda uma string vazia
-        self.imagens = ','.join(imagens_list) if imagens_list else ''
-
-    # Método para obter as imagens do veículo
+        existing = {}
+        for image in self.imagens:
+            existing.setdefault(image.path, []).append(image)
+
+        imagens = []
+        for position, path in enumerate(imagens_list or []):
+            image = existing[path].pop(0) if existing.get(path) else VehicleImage(path=path)
+            image.position = position
+            imagens.append(image)
+        self.imagens = imagens  # As imagens que ficaram de fora são apagadas (delete-orphan)
+
+    # Método para obter os caminhos das imagens do veículo
     def get_imagens(self):
-        # Se não houver imagens, retorna uma lista vazia
-        if not self.imagens:
-            return []
+        return [image.path for image in self.imagens]
 
-        # Divide a string de imagens nas vírgulas para obter uma lista
-        image_paths = self.imagens.split(',')
-
-        # Retorna uma lista com os caminhos das imagens, removendo espaços em branco
-        # e ignorando caminhos vazios
-        return [path.strip() for path in image_paths if path.strip()]
+    # Imagem principal do veículo (a primeira), ou None se o veículo não tiver imagens
+    @property
+    def imagem_principal(self):
+        return self.imagens[0] if self.imagens else None
+
+    # Método para obter as variantes de uma imagem (lista vazia se a imagem não tiver variantes)
+    def get_variantes(self, image_path):
+        for image in self.imagens:
+            if image.path == image_path:
+                return image.get_variantes()
+        return []
+
+    @classmethod
+    def store_imagem_info(cls, vehicle_id, image_path, info):
+        """
+        Guarda os metadados de uma imagem processada em segundo plano, nas imagens do veículo e no ficheiro
+        (ImageFile), para que outros veículos com a mesma imagem não a tenham de processar outra vez.
+
+        O ficheiro é lido com o lock de escrita (ver lock_for_write), para que não possa ser apagado entre a
+        verificação e o commit.
+
+        Returns:
+            bool: False se o ficheiro já não for usado por nenhum veículo (foi apagado entretanto)
+        """
+        try:
+            image_file = lock_for_write(ImageFile.query.filter_by(path=image_path)).first()
+            if image_file is None:
+                db.session.rollback()
+                return False
+
+            image_file.info = json.dumps(info)
+            for image in VehicleImage.query.filter_by(vehicle_id=vehicle_id, path=image_path):
+                image.set_info(info)
+            db.session.commit()
+            return True
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+    # Método para registar uma manutenção feita ao veículo. A última e a próxima manutenção passam a ser as do registo
+    # mais recente do histórico (o commit fica a cargo de quem chama)
+    def add_maintenance_event(self, event_date, description="", next_date=None):
+        event = MaintenanceEvent(date=event_date, next_date=next_date, description=description)
+        self.maintenance_events.append(event)
+        latest = _latest_event(self.maintenance_events)
+        self.last_maintenance, self.next_maintenance = latest.date, latest.next_date
+        return event
+
+    # Método para registar uma legalização do veículo (inspeção, imposto, seguro...), igual ao das manutenções
+    def add_legalization_event(self, event_date, description="", next_date=None):
+        event = LegalizationEvent(date=event_date, next_date=next_date, description=description)
+        self.legalization_events.append(event)
+        latest = _latest_event(self.legalization_events)
+        self.last_legalization_date, self.next_legalization_date = latest.date, latest.next_date
+        return event
+
+    @classmethod
+    def maintenance_due_filter(cls, days=30, today=None):
+        """Filtro SQL dos veículos com a próxima manutenção nos próximos `days` dias ou já em atraso.
+
+        É uma pesquisa por intervalo sobre o índice de next_maintenance, por isso não é preciso ler o histórico de
+        nenhum veículo.
+        """
+        return cls.next_maintenance <= (today or date.today()) + timedelta(days=days)
+
+    @classmethod
+    def legalization_due_filter(cls, days=30, today=None):
+        """Filtro SQL dos veículos com a próxima legalização nos próximos `days` dias ou já em atraso."""
+        return cls.next_legalization_date <= (today or date.today()) + timedelta(days=days)
 
     def is_available(self):
         """Verifica se o veículo está disponível para reserva"""
-        current_datetime = datetime.now()
-
-        # Se estiver em manutenção
-        if self.is_in_maintenance():
-            return False
-
-        # Se estiver marcado como indisponível
-        if not self.status:
-            return False
-
-        # Se tiver data futura de disponibilidade, verifica se já passou
-        if self.available_from and current_datetime < self.available_from:
-            return False
-
-        return self.status
+        return self.availability_state == "disponivel"
 
     def update_availability_after_reservation(self, end_datetime):
-        """Atualiza a disponibilidade do veículo após uma reserva"""
-        self.available_from = end_datetime
+        """Atualiza a disponibilidade do veículo após uma reserva (o commit fica a cargo de quem chama)"""
+        self.is_reserved = True
+        # Com várias reservas, o veículo só fica disponível depois da que termina mais tarde
+        if not self.available_from or end_datetime > self.available_from:
+            self.available_from = end_datetime
         self.status = False
-        db.session.commit()
 
     def check_and_update_availability(self):
         """Verifica e atualiza o status de disponibilidade baseado no tempo"""
@@ -262,59 +430,153 @@ class Veiculos(db.Model):
         # Retorna False se não houve atualização
         return False
 
+    @classmethod
+    def free_between_filter(cls, start_datetime, end_datetime):
+        """Filtro SQL dos veículos livres em todo o período [start_datetime, end_datetime[.
+
+        Exclui os veículos com uma reserva que se sobreponha ao período (anti-join sobre o índice
+        ix_reservation_vehicle_interval), com uma manutenção agendada que se sobreponha, indisponíveis até
+        depois do início do período, ou inativos sem data prevista de disponibilidade. Num veículo reservado, o
+        available_from é o fim da última reserva, por isso aí só o anti-join decide (um período antes dessa
+        reserva continua livre).
+        """
+        overlapping_reservation = db.session.query(Reservation.id).filter(
+            Reservation.veiculo_id == cls.id,
+            Reservation.start_at < end_datetime,
+            Reservation.end_at > start_datetime
+        ).exists()
+
+        return and_(
+            ~overlapping_reservation,
+            # Manutenção agendada que se sobrepõe ao período
+            ~and_(cls.maintenance_start.isnot(None),
+                  cls.maintenance_end.isnot(None),
+                  cls.maintenance_start < end_datetime,
+                  cls.maintenance_end > start_datetime),
+            # Indisponível (sem ser por reserva) até uma data posterior ao início, ou inativo sem data prevista
+            or_(cls.is_reserved == True, cls.available_from.is_(None), cls.available_from <= start_datetime),
+            or_(cls.status == True, cls.available_from.isnot(None), cls.maintenance_end.isnot(None))
+        )
+
+    def is_free_between(self, start_datetime, end_datetime):
+        """Verifica se este veículo está livre em todo o período indicado"""
+        return db.session.query(
+            Veiculos.query.filter(Veiculos.id == self.id,
+                                  Veiculos.free_between_filter(start_datetime, end_datetime)).exists()
+        ).scalar()
+
+    @classmethod
+    def count_by_type_and_state(cls):
+        """Conta os veículos por tipo e por estado de disponibilidade numa única query.
+
+        Usa agregação condicional (``SUM(CASE ...)``) agrupada por ``type`` sobre o estado
+        derivado ``availability_state``, em vez de uma contagem separada por cada combinação.
+
+        Returns:
+            dict: Para cada VehicleType, um dicionário com as chaves 'total', 'disponivel',
+            'reservado' e 'manutencao'
+        """
+        state = cls.availability_state
+        rows = db.session.query(
+            cls.type,
+            db.func.count(cls.id),
+            db.func.sum(case((state == "disponivel", 1), else_=0)),
+            db.func.sum(case((state == "reservado", 1), else_=0)),
+            db.func.sum(case((state == "manutencao", 1), else_=0))
+        ).group_by(cls.type).all()
+
+        # Garante que todos os tipos aparecem no resultado, mesmo que não existam veículos desse tipo
+        counts = {vehicle_type: {'total': 0, 'disponivel': 0, 'reservado': 0, 'manutencao': 0}
+                  for vehicle_type in VehicleType}
+        for vehicle_type, total, disponivel, reservado, manutencao in rows:
+            counts[vehicle_type] = {'total': total, 'disponivel': disponivel or 0, 'reservado': reservado or 0,
+                                    'manutencao': manutencao or 0}
+        return counts
+
     @classmethod  # Decorator que indica que este é um método de classe (pode ser chamado sem instanciar a classe)
-    def update_all_vehicles_availability(cls):
-        """Atualiza a disponibilidade de todos os veículos"""
+    def update_all_vehicles_availability(cls, ids=None, commit=True):
+        """Atualiza a disponibilidade de todos os veículos com UPDATEs em bloco.
+
+        Em vez de carregar os veículos para memória, cada transição é feita com um único
+        ``UPDATE ... WHERE`` sobre as colunas indexadas ``maintenance_end`` e ``available_from``,
+        por isso o custo não depende do tamanho da frota.
+
+        Args:
+            ids (list, opcional): Só verifica estes veículos (ScheduledTransition.apply_due)
+            commit (bool): Se False, o commit fica a cargo de quem chama
+
+        Returns:
+            dict: Número de veículos atualizados por tipo de transição
+            ('maintenance_ended', 'reservation_ended', 'unavailability_ended')
+        """
+
+        # Obtém a data e hora atual
+        current_datetime = datetime.now()
+        vehicles = cls.query if ids is None else cls.query.filter(cls.id.in_(ids))
 
         try:
-            # Busca todos os veículos que se enquadram em pelo menos uma das condições:
-            vehicles = cls.query.filter(  # Utiliza-se o 'cls' (classe) para referir a própria classe,
-                # isso utiliza-se quando têm o @classmethod
-                or_(
-                    cls.status == False,  # Veículo inativo
-                    cls.available_from.isnot(None),  # Tem data de disponibilidade futura
-                    cls.maintenance_end.isnot(None),  # Está em manutenção
-                    cls.is_reserved == True  # Está reservado
-                )
-            ).all()
-
-            # Obtém a data e hora atual
-            current_datetime = datetime.now()
-            updated_count = 0  # Contador de veículos atualizados
-
-            # Para cada veículo encontrado
-            for vehicle in vehicles:
-                # Verifica se a manutenção terminou
-                if vehicle.maintenance_end and current_datetime > vehicle.maintenance_end:
-                    vehicle.in_maintenance = False  # Remove flag de manutenção
-                    vehicle.maintenance_start = None  # Limpa data de início
-                    vehicle.maintenance_end = None  # Limpa data de fim
-                    updated_count += 1  # Incrementa o contador de veículos
-
-                # Verifica se a reserva terminou
-                if vehicle.is_reserved and vehicle.available_from and current_datetime >= vehicle.available_from:
-                    vehicle.is_reserved = False  # Remove flag de reserva
-                    vehicle.status = True  # Ativa o veículo
-                    vehicle.available_from = None  # Limpa data de disponibilidade
-                    updated_count += 1  # Incrementa o contador de veículos
-
-                # Verifica se o período de indisponibilidade terminou (sem ser por reserva)
-                elif not vehicle.is_reserved and vehicle.available_from and current_datetime >= vehicle.available_from:
-                    vehicle.status = True  # Ativa o veículo
-                    vehicle.available_from = None  # Limpa data de disponibilidade
-                    updated_count += 1  # Incrementa o contador de veículos
+            # Manutenções que já terminaram: remove a flag e as datas de manutenção. Os veículos sem data de
+            # disponibilidade pendente voltam a ficar ativos
+            maintenance_ended = vehicles.filter(
+                cls.maintenance_end.isnot(None),
+                cls.maintenance_end < current_datetime
+            ).update({
+                cls.in_maintenance: False,
+                cls.maintenance_start: None,
+                cls.maintenance_end: None,
+                cls.status: case((cls.available_from.is_(None), True), else_=cls.status)
+            }, synchronize_session=False)
+
+            # Reservas que já terminaram: remove a flag de reserva e ativa o veículo
+            reservation_ended = vehicles.filter(
+                cls.is_reserved == True,
+                cls.available_from <= current_datetime
+            ).update({
+                cls.is_reserved: False,
+                cls.status: True,
+                cls.available_from: None
+            }, synchronize_session=False)
+
+            # Períodos de indisponibilidade que já terminaram (sem ser por reserva)
+            unavailability_ended = vehicles.filter(
+                cls.is_reserved.isnot(True),
+                cls.available_from <= current_datetime
+            ).update({
+                cls.status: True,
+                cls.available_from: None
+            }, synchronize_session=False)
+
+            counts = {
+                'maintenance_ended': maintenance_ended,
+                'reservation_ended': reservation_ended,
+                'unavailability_ended': unavailability_ended,
+            }
 
             # Se houve alguma atualização, guarda no banco de dados
-            if updated_count > 0:
+            if commit and any(counts.values()):
                 db.session.commit()
 
-        except Exception as e:
+            return counts
+
+        except Exception:
             db.session.rollback()  # Em caso de erro, desfaz todas as alterações
             raise  # Propaga o erro para ser tratado em outro lugar
 
 
+# Erro lançado quando uma reserva se sobrepõe a outra reserva ou a uma manutenção do mesmo veículo
+class ReservationConflictError(Exception):
+    def __init__(self, vehicles):
+        self.vehicles = vehicles  # Veículos com conflito
+        names = ', '.join(f"{vehicle.brand} {vehicle.model}" for vehicle in vehicles)
+        super().__init__(f"Os seguintes veículos já não estão disponíveis no período escolhido: {names}")
+
+
 # Define a classe Reservation que representa uma reserva de veículo
 class Reservation(db.Model):
+    __table_args__ = (
+        db.Index("ix_reservation_vehicle_interval", "fk_reservation_vehicle", "start_at", "end_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)  # Chave primária autoincremental
 
     # Chave estrangeira para a tabela clientes (indica qual cliente fez a reserva)
@@ -329,6 +591,12 @@ class Reservation(db.Model):
     start_time = db.Column(db.Time, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
+
+    # Início e fim da reserva como data/hora únicas, preenchidos automaticamente a partir das colunas acima (ver
+    # _sync_interval). Com o índice (veiculo, início, fim) a verificação de sobreposição de períodos é uma pesquisa
+    # no índice em vez de combinar data e hora linha a linha
+    start_at = db.Column(db.DateTime, nullable=True)
+    end_at = db.Column(db.DateTime, nullable=True)
     duration = db.Column(db.Float, nullable=False)
     price = db.Column(db.Float, nullable=False)
     payment_method = db.Column(db.String(50), nullable=True)
@@ -336,9 +604,101 @@ class Reservation(db.Model):
     # Data e hora de criação da reserva (automático)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    # Identificador do checkout em que a reserva foi feita. Todas as reservas do mesmo carrinho têm o mesmo valor
+    # (ver create_batch), o que permite obter a última reserva de um cliente com uma query ao índice
+    checkout_id = db.Column(db.String(32), default=lambda: uuid.uuid4().hex, index=True)
+
     # Estado da reserva (começa como "Pendente")
     status = db.Column(db.String(20), nullable=False, default="Pendente")
 
+    @classmethod
+    def create_batch(cls, customer_id, items, payment_method):
+        """
+        Cria todas as reservas de um checkout numa única transação, com verificação de sobreposições.
+
+        A transação é aberta com BEGIN IMMEDIATE em SQLite (ou com bloqueio das linhas dos veículos nas outras
+        bases de dados), por isso dois checkouts simultâneos ao mesmo veículo são feitos um de cada vez e o
+        segundo vê as reservas do primeiro. Os itens do carrinho são verificados entre si e cada um com
+        is_free_between, antes de qualquer alteração.
+
+        Args:
+            customer_id (int): ID do cliente
+            items (list): Lista de dicionários com vehicle_id, start_datetime, end_datetime e price
+            payment_method (str): Método de pagamento escolhido
+
+        Returns:
+            list: Reservas criadas
+
+        Raises:
+            ReservationConflictError: Se algum veículo não estiver livre no período pedido
+            ValueError: Se algum veículo do carrinho já não existir
+        """
+        try:
+            vehicle_ids = {item['vehicle_id'] for item in items}
+            # A verificação e a inserção são feitas com o lock de escrita, para serem atómicas
+            vehicles_query = lock_for_write(Veiculos.query.filter(Veiculos.id.in_(vehicle_ids)))
+            vehicles = {vehicle.id: vehicle for vehicle in vehicles_query.all()}
+            if len(vehicles) != len(vehicle_ids):
+                raise ValueError('Um dos veículos do carrinho já não existe.')
+
+            # Itens do próprio carrinho para o mesmo veículo com períodos sobrepostos
+            conflicting_ids = set()
+            previous = {}  # Último item visto de cada veículo, por ordem de início
+            for item in sorted(items, key=lambda item: (item['vehicle_id'], item['start_datetime'])):
+                earlier = previous.get(item['vehicle_id'])
+                if earlier and earlier['end_datetime'] > item['start_datetime']:
+                    conflicting_ids.add(item['vehicle_id'])
+                previous[item['vehicle_id']] = item
+
+            # Reservas existentes, manutenções e indisponibilidades: a mesma regra da pesquisa do catálogo
+            for item in items:
+                if not vehicles[item['vehicle_id']].is_free_between(item['start_datetime'], item['end_datetime']):
+                    conflicting_ids.add(item['vehicle_id'])
+
+            if conflicting_ids:
+                raise ReservationConflictError([vehicles[vehicle_id] for vehicle_id in sorted(conflicting_ids)])
+
+            checkout_id = uuid.uuid4().hex  # Identificador comum a todas as reservas deste checkout
+            reservations = []
+            for item in items:
+                start_datetime, end_datetime = item['start_datetime'], item['end_datetime']
+                reservations.append(cls(
+                    customer_id=customer_id,
+                    veiculo_id=item['vehicle_id'],
+                    start_date=start_datetime.date(),
+                    start_time=start_datetime.time(),
+                    end_date=end_datetime.date(),
+                    end_time=end_datetime.time(),
+                    duration=(end_datetime - start_datetime).total_seconds() / 3600,  # Duração em horas
+                    price=item['price'],
+                    payment_method=payment_method,
+                    status='Pendente',  # Fica 'Pendente' até confirmação de pagamento da parte do cliente
+                    checkout_id=checkout_id
+                ))
+                vehicles[item['vehicle_id']].update_availability_after_reservation(end_datetime)
+
+            db.session.add_all(reservations)
+            db.session.commit()
+            return reservations
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def latest_checkout(cls, customer_id):
+        """
+        Devolve as reservas do último checkout feito pelo cliente.
+
+        Returns:
+            list: Reservas do último checkout (vazia se o cliente não tiver reservas)
+        """
+        latest_checkout_id = db.session.query(cls.checkout_id).filter(
+            cls.customer_id == customer_id
+        ).order_by(cls.id.desc()).limit(1).scalar_subquery()
+
+        return cls.query.filter(cls.checkout_id == latest_checkout_id).order_by(cls.id.desc()).all()
+
     # Método para adicionar uma nova reserva à base de dados
     def add_reservations(self):
         db.session.add(self)  # Adiciona a reserva à sessão
@@ -346,16 +706,381 @@ class Reservation(db.Model):
 
     # Atualiza as reservas concluídas para o status "Concluída"
     @staticmethod
-    def update_completed_reservations():
-        today = date.today()  # Obtém a data atual
-
-        # Procura todas as reservas que:
-        # 1. Já terminaram (end_date < hoje)
-        # 2. Ainda não estão marcadas como concluídas
-        completed_reservations = Reservation.query.filter(
-            Reservation.end_date < today, Reservation.status != "Concluída").all()
-
-        # Para cada reserva encontrada
-        for reservation in completed_reservations:
-            reservation.status = "Concluída"  # Atualiza o estado para "Concluída"
-            db.session.commit()  # Guarda na base de dados
+    def update_completed_reservations(ids=None, commit=True):
+        """Marca como "Concluída" todas as reservas cuja data/hora de fim já passou.
+
+        A atualização é feita com um único ``UPDATE ... WHERE`` e um único commit. A comparação
+        usa a data e a hora de fim (end_at = end_date + end_time) e não apenas a data.
+
+        Args:
+            ids (list, opcional): Só verifica estas reservas (ScheduledTransition.apply_due)
+            commit (bool): Se False, o commit fica a cargo de quem chama
+
+        Returns:
+            int: Número de reservas atualizadas
+        """
+        current_datetime = datetime.now()  # Obtém a data e hora atual
+
+        try:
+            # Reservas que:
+            # 1. Já terminaram (data e hora de fim, end_at, já passou)
+            # 2. Ainda não estão marcadas como concluídas
+            reservations = Reservation.query if ids is None else Reservation.query.filter(Reservation.id.in_(ids))
+            updated_count = reservations.filter(
+                Reservation.end_at <= current_datetime,
+                Reservation.status != "Concluída"
+            ).update({Reservation.status: "Concluída"}, synchronize_session=False)
+
+            if commit and updated_count > 0:
+                db.session.commit()  # Guarda na base de dados
+
+            return updated_count
+
+        except Exception:
+            db.session.rollback()  # Em caso de erro, desfaz todas as alterações
+            raise
+
+
+# Mantém start_at/end_at sincronizados com as colunas de data e hora sempre que uma reserva é criada ou alterada
+@db.event.listens_for(Reservation, 'before_insert')
+@db.event.listens_for(Reservation, 'before_update')
+def _sync_interval(mapper, connection, reservation):
+    if reservation.start_date and reservation.start_time:
+        reservation.start_at = datetime.combine(reservation.start_date, reservation.start_time)
+    if reservation.end_date and reservation.end_time:
+        reservation.end_at = datetime.combine(reservation.end_date, reservation.end_time)
+
+
+# Registo mais recente de um histórico (com várias na mesma data, o último que foi registado)
+def _latest_event(events):
+    return max(reversed(events), key=lambda event: event.date)
+
+
+# Define a classe MaintenanceEvent que representa uma manutenção feita a um veículo. As datas da última e da próxima
+# manutenção do veículo (Veiculos.last_maintenance/next_maintenance) são as do registo mais recente
+class MaintenanceEvent(db.Model):
+    __tablename__ = "maintenance_events"
+    __table_args__ = (
+        db.Index("ix_maintenance_events_veiculo_date", "veiculo_id", "date"),  # Histórico de cada veículo, por data
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculos.id", ondelete="CASCADE"), nullable=False)
+    date = db.Column(db.Date, nullable=False)  # Data em que a manutenção foi feita
+    next_date = db.Column(db.Date, nullable=True)  # Data prevista para a manutenção seguinte
+    description = db.Column(db.Text, default="")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Define a classe LegalizationEvent que representa uma legalização de um veículo (inspeção, imposto, seguro...). As
+# datas da última e da próxima legalização do veículo são as do registo mais recente
+class LegalizationEvent(db.Model):
+    __tablename__ = "legalization_events"
+    __table_args__ = (
+        db.Index("ix_legalization_events_veiculo_date", "veiculo_id", "date"),  # Histórico de cada veículo, por data
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculos.id", ondelete="CASCADE"), nullable=False)
+    date = db.Column(db.Date, nullable=False)  # Data da legalização
+    next_date = db.Column(db.Date, nullable=True)  # Data prevista para a legalização seguinte
+    description = db.Column(db.Text, default="")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Define a classe VehicleImage que representa uma imagem de um veículo, com a posição na galeria e os metadados e
+# variantes gerados pelo processamento da imagem (ver images.process_image). O ficheiro pode ser partilhado por várias
+# imagens (ver ImageFile)
+class VehicleImage(db.Model):
+    __tablename__ = "vehicle_images"
+    __table_args__ = (
+        db.Index("ix_vehicle_images_vehicle_position", "vehicle_id", "position"),  # Imagens de cada veículo, por ordem
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey("veiculos.id", ondelete="CASCADE"), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Ordem na galeria, a posição 0 é a imagem principal
+    path = db.Column(db.String(200), nullable=False, index=True)  # Caminho relativo à pasta static (ver ImageFile)
+
+    # Metadados da imagem original e variantes reduzidas em JSON, preenchidos quando a imagem é processada
+    bytes = db.Column(db.Integer)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(10))
+    variantes = db.Column(db.Text)
+    processed_at = db.Column(db.DateTime)  # None enquanto a imagem está a ser processada em segundo plano
+
+    @property
+    def em_processamento(self):
+        return self.processed_at is None
+
+    # Método para obter as variantes da imagem (lista vazia se a imagem não tiver variantes)
+    def get_variantes(self):
+        return json.loads(self.variantes) if self.variantes else []
+
+    # Método para guardar o resultado do processamento da imagem (ver images.process_image)
+    def set_info(self, info):
+        self.bytes = info.get('bytes')
+        self.width = info.get('width')
+        self.height = info.get('height')
+        self.format = info.get('format')
+        self.variantes = json.dumps(info.get('variantes', []))
+        self.processed_at = datetime.now()
+
+
+# Define a classe ImageFile que representa um ficheiro guardado na pasta de uploads. Os uploads são guardados com o
+# hash do conteúdo no nome (ver images.store_upload), por isso a mesma imagem usada por vários veículos é guardada uma
+# única vez e só é apagada quando deixa de ter referências
+class ImageFile(db.Model):
+    __tablename__ = "image_files"
+
+    path = db.Column(db.String(200), primary_key=True)  # Caminho relativo à pasta static, ex: uploads/<sha256>.png
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Número de imagens de veículos que usam o ficheiro
+    info = db.Column(db.Text)  # Metadados e variantes em JSON (ver images.process_image), depois de processado
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def get_info(self):
+        return json.loads(self.info) if self.info else None
+
+    @classmethod
+    def update_refs(cls, acquired=(), released=()):
+        """
+        Acrescenta e retira referências aos ficheiros, com o lock de escrita (ver lock_for_write).
+
+        Os ficheiros novos devem ser publicados antes do commit (que fica a cargo de quem chama), ainda com o lock.
+        Os ficheiros sem referências só devem ser apagados depois de um commit bem-sucedido, e depois de confirmar
+        com o lock que continuam sem referências (um upload do mesmo conteúdo pode ter voltado a usá-los), para que
+        um rollback não deixe imagens cujo ficheiro já foi apagado (ver admin.remove_unreferenced_images).
+
+        Args:
+            acquired (list): Caminhos que passam a ser usados (um por cada imagem de veículo)
+            released (list): Caminhos que deixam de ser usados
+
+        Returns:
+            list: Caminhos que ficaram sem referências (já removidos da tabela) e cujos ficheiros devem ser apagados
+        """
+        changes = Counter(acquired)
+        changes.subtract(Counter(released))
+        changes = {path: change for path, change in changes.items() if change}
+        if not changes:
+            return []
+
+        image_files = {image_file.path: image_file for image_file in
+                       lock_for_write(cls.query.filter(cls.path.in_(changes))).all()}
+
+        unreferenced = []
+        for path, change in changes.items():
+            image_file = image_files.get(path)
+            if image_file is None:
+                if change > 0:
+                    db.session.add(cls(path=path, ref_count=change))
+                continue
+
+            image_file.ref_count += change
+            if image_file.ref_count <= 0:
+                db.session.delete(image_file)
+                unreferenced.append(path)
+        return unreferenced
+
+
+# Define a classe CartEntry que guarda os carrinhos de reserva do lado do servidor (ver cart.py). A sessão do cliente
+# guarda apenas o ID do carrinho
+class CartEntry(db.Model):
+    __tablename__ = "carts"
+
+    id = db.Column(db.String(64), primary_key=True)  # ID aleatório do carrinho (ou de um dado associado ao carrinho)
+    data = db.Column(db.Text, nullable=False)  # Conteúdo em JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Carrinhos expirados são apagados
+
+
+# Define a classe SchedulerLease: "lease" (arrendamento com prazo) que elege o único processo que corre as tarefas
+# periódicas (ver scheduler.py). O processo líder renova o prazo regularmente; se morrer, outro processo fica com o
+# lease quando o prazo expirar
+class SchedulerLease(db.Model):
+    __tablename__ = "scheduler_leases"
+
+    name = db.Column(db.String(64), primary_key=True)  # Nome do lease (um por conjunto de tarefas)
+    owner = db.Column(db.String(128), nullable=False)  # Identificação do processo líder (host:pid:aleatório)
+    expires_at = db.Column(db.DateTime, nullable=False)  # Sem renovação até esta data, o lease fica livre
+
+    @classmethod
+    def acquire(cls, name, owner, ttl):
+        """
+        Obtém ou renova o lease para o processo owner, numa única escrita atómica. Só tem sucesso se o lease não
+        existir, já pertencer ao owner ou tiver expirado.
+
+        Args:
+            name (str): Nome do lease
+            owner (str): Identificação do processo
+            ttl (int): Duração do lease em segundos
+
+        Returns:
+            datetime ou None: Data em que o lease expira, ou None se pertencer a outro processo
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl)
+        try:
+            updated = cls.query.filter(cls.name == name, or_(cls.owner == owner, cls.expires_at <= now)) \
+                .update({cls.owner: owner, cls.expires_at: expires_at}, synchronize_session=False)
+            if not updated:
+                if db.session.get(cls, name) is not None:  # Lease válido de outro processo
+                    db.session.rollback()
+                    return None
+                db.session.add(cls(name=name, owner=owner, expires_at=expires_at))
+            db.session.commit()
+            return expires_at
+        except IntegrityError:  # Outro processo criou o lease ao mesmo tempo
+            db.session.rollback()
+            return None
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def release(cls, name, owner):
+        """Liberta o lease, se pertencer ao owner, para que outro processo o possa obter logo."""
+        try:
+            cls.query.filter_by(name=name, owner=owner).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+# Número máximo de transições aplicadas por ScheduledTransition.apply_due (limita o tamanho do WHERE id IN (...))
+TRANSITIONS_BATCH_SIZE = 500
+
+
+# Define a classe ScheduledTransition: data/hora em que o estado de um veículo ou de uma reserva muda sozinho (fim de
+# uma reserva, de uma manutenção ou de um período de indisponibilidade). As linhas são criadas automaticamente
+# sempre que essas datas são gravadas (ver _schedule_vehicle_transitions e _schedule_reservation_transition), e o
+# scheduler acorda só quando a próxima passa, em vez de verificar todos os veículos a cada minuto (ver scheduler.py)
+class ScheduledTransition(db.Model):
+    __tablename__ = "scheduled_transitions"
+    __table_args__ = (
+        # No máximo uma transição pendente por data de cada veículo/reserva (uma data alterada substitui a anterior)
+        db.UniqueConstraint("kind", "target_id", name="uq_scheduled_transitions_target"),
+    )
+
+    VEHICLE = 'veiculo'  # Veiculos.available_from
+    MAINTENANCE = 'manutencao'  # Veiculos.maintenance_end
+    RESERVATION = 'reserva'  # Reservation.end_at
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)  # VEHICLE, MAINTENANCE ou RESERVATION
+    target_id = db.Column(db.Integer, nullable=False)  # ID do veículo ou da reserva
+    due_at = db.Column(db.DateTime, nullable=False, index=True)  # Data/hora em que a transição deve ser aplicada
+
+    # Funções chamadas depois do commit de novas transições, com a data/hora da mais próxima (o scheduler do
+    # processo usa-as para acordar mais cedo)
+    listeners = []
+
+    @classmethod
+    def next_due_at(cls):
+        """Data/hora da próxima transição por aplicar (uma pesquisa no índice de due_at), ou None."""
+        return db.session.query(db.func.min(cls.due_at)).scalar()
+
+    @classmethod
+    def apply_due(cls, limit=TRANSITIONS_BATCH_SIZE):
+        """
+        Aplica as transições cuja data/hora já passou e apaga-as, numa única transação. Os UPDATEs em bloco de
+        Veiculos.update_all_vehicles_availability e de Reservation.update_completed_reservations só são feitos
+        sobre os veículos e as reservas dessas transições (WHERE id IN (...)), e só as linhas aplicadas são apagadas.
+
+        Args:
+            limit (int): Número máximo de transições aplicadas de cada vez (as restantes ficam para a chamada
+                seguinte, que o scheduler faz logo a seguir porque a próxima transição continua em atraso)
+
+        Returns:
+            dict: Número de veículos e reservas atualizados por tipo de transição, ou None se não havia nenhuma
+        """
+        due = db.session.query(cls.id, cls.kind, cls.target_id).filter(
+            cls.due_at <= datetime.now()
+        ).order_by(cls.due_at).limit(limit).all()
+        if not due:
+            db.session.rollback()  # Termina a transação de leitura
+            return None
+
+        vehicle_ids = {target_id for _, kind, target_id in due if kind in (cls.VEHICLE, cls.MAINTENANCE)}
+        reservation_ids = {target_id for _, kind, target_id in due if kind == cls.RESERVATION}
+
+        try:
+            counts = {}
+            if vehicle_ids:
+                counts.update(Veiculos.update_all_vehicles_availability(vehicle_ids, commit=False))
+            if reservation_ids:
+                counts['reservation_completed'] = Reservation.update_completed_reservations(reservation_ids,
+                                                                                            commit=False)
+            cls.query.filter(cls.id.in_([row_id for row_id, _, _ in due])).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return counts
+
+
+def _schedule_transition(connection, target, kind, due_at=None):
+    # Substitui a transição pendente do veículo/reserva pela da data atual. Só as datas futuras precisam de uma
+    # transição (as que já passaram são aplicadas pela verificação periódica)
+    table = ScheduledTransition.__table__
+    connection.execute(table.delete().where(table.c.kind == kind, table.c.target_id == target.id))
+    if due_at is None or due_at <= datetime.now():
+        return
+    connection.execute(table.insert().values(kind=kind, target_id=target.id, due_at=due_at))
+    session = object_session(target)
+    if session is not None:
+        pending = session.info.get('transitions_due')
+        session.info['transitions_due'] = due_at if pending is None else min(pending, due_at)
+
+
+# Datas de um veículo que têm uma transição: coluna e tipo de transição
+VEHICLE_TRANSITIONS = (('available_from', ScheduledTransition.VEHICLE),
+                       ('maintenance_end', ScheduledTransition.MAINTENANCE))
+
+
+# Cria as transições quando as datas de disponibilidade ou de fim de manutenção de um veículo são gravadas. A
+# transição antiga de cada data é substituída, por isso uma data alterada ou removida não deixa linhas na tabela
+@db.event.listens_for(Veiculos, 'after_insert')
+@db.event.listens_for(Veiculos, 'after_update')
+def _schedule_vehicle_transitions(mapper, connection, vehicle):
+    state = inspect(vehicle)
+    for attribute, kind in VEHICLE_TRANSITIONS:
+        if state.attrs[attribute].history.has_changes():
+            _schedule_transition(connection, vehicle, kind, getattr(vehicle, attribute))
+
+
+# Cria a transição do fim de uma reserva (o end_at é preenchido pelo _sync_interval antes da escrita). Uma reserva
+# concluída deixa de ter transição
+@db.event.listens_for(Reservation, 'after_insert')
+@db.event.listens_for(Reservation, 'after_update')
+def _schedule_reservation_transition(mapper, connection, reservation):
+    state = inspect(reservation)
+    if state.attrs.end_at.history.has_changes() or state.attrs.status.history.has_changes():
+        due_at = reservation.end_at if reservation.status != "Concluída" else None
+        _schedule_transition(connection, reservation, ScheduledTransition.RESERVATION, due_at)
+
+
+# Apaga as transições de um veículo ou de uma reserva apagados
+@db.event.listens_for(Veiculos, 'after_delete')
+def _unschedule_vehicle_transitions(mapper, connection, vehicle):
+    for _, kind in VEHICLE_TRANSITIONS:
+        _schedule_transition(connection, vehicle, kind)
+
+
+@db.event.listens_for(Reservation, 'after_delete')
+def _unschedule_reservation_transition(mapper, connection, reservation):
+    _schedule_transition(connection, reservation, ScheduledTransition.RESERVATION)
+
+
+# Avisa os listeners (o scheduler deste processo) das novas transições, só depois de estarem gravadas
+@db.event.listens_for(RoutingSession, 'after_commit')
+def _notify_transition_listeners(session):
+    due_at = session.info.pop('transitions_due', None)
+    if due_at is not None:
+        for listener in ScheduledTransition.listeners:
+            listener(due_at)
+
+
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending_transitions(session):
+    session.info.pop('transitions_due', None)
@@ -0,0 +1,289 @@
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from apscheduler.events import EVENT_JOB_MISSED
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from cart import get_cart_store
+from models import Veiculos, Reservation, SchedulerLease, ScheduledTransition
+
+# ------------------------------- Tarefas periódicas (APScheduler) ------------------------------------------------
+
+# O scheduler pode estar ativo em vários processos (workers do gunicorn com SCHEDULER_ENABLED=1, "python app.py" com
+# o reloader, ou vários "flask scheduler"), mas só o processo que tem o lease da tabela scheduler_leases (o líder)
+# corre as tarefas. Os outros continuam a tentar obter o lease e substituem o líder se ele deixar de o renovar
+
+LEASE_NAME = 'periodic-jobs'
+
+
+# Tarefa que aplica as transições de disponibilidade (fim de reservas, manutenções e períodos de indisponibilidade)
+# cuja data/hora já passou. É corrida pelo TransitionTimer no momento em que a próxima transição passa. Corre fora de
+# um pedido HTTP, por isso precisa do seu próprio contexto da aplicação para aceder à base de dados
+def apply_transitions_job(app):
+    with app.app_context():
+        return ScheduledTransition.apply_due()
+
+
+# Verificação completa da disponibilidade dos veículos e das reservas concluídas. As transições são aplicadas pelo
+# TransitionTimer, por isso esta tarefa é só uma rede de segurança (datas alteradas fora da aplicação, ou gravadas
+# antes de existir a tabela scheduled_transitions) e corre de hora a hora
+def availability_sweep_job(app):
+    with app.app_context():
+        counts = Veiculos.update_all_vehicles_availability()
+        counts['reservation_completed'] = Reservation.update_completed_reservations()
+        return counts if any(counts.values()) else None
+
+
+# Tarefa do scheduler que apaga os carrinhos de reserva expirados
+def purge_expired_carts_job(app):
+    with app.app_context():
+        return get_cart_store().purge_expired()
+
+
+# Tarefas periódicas: (id, função, intervalo em minutos)
+JOBS = [
+    ('availability_sweep', availability_sweep_job, 60),
+    ('purge_expired_carts', purge_expired_carts_job, 10),
+]
+
+TRANSITIONS_JOB_ID = 'availability_transitions'
+
+# Segundos até nova tentativa quando a aplicação das transições falha (ex: base de dados bloqueada)
+TRANSITION_RETRY_SECONDS = 5
+
+
+class SchedulerLeader:
+    """Eleição do processo líder através do lease SchedulerLease (um único líder entre todos os processos)."""
+
+    def __init__(self, app, name=LEASE_NAME):
+        self.app = app
+        self.name = name
+        self.ttl = app.config['SCHEDULER_LEASE_TTL']
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease_until = None  # Data em que o lease deste processo expira (None = não é líder)
+
+    @property
+    def is_leader(self):
+        # Margem de segurança: deixa de correr tarefas um pouco antes do prazo, para nunca haver dois líderes
+        return self.lease_until is not None and datetime.now() < self.lease_until - timedelta(seconds=self.ttl / 6)
+
+    def renew(self):
+        was_leader = self.lease_until is not None
+        with self.app.app_context():
+            try:
+                self.lease_until = SchedulerLease.acquire(self.name, self.owner, self.ttl)
+            except Exception:
+                self.app.logger.exception('Erro ao renovar o lease do scheduler')
+                self.lease_until = None
+
+        if self.lease_until is not None and not was_leader:
+            self.app.logger.info('Scheduler: este processo (%s) passou a correr as tarefas periódicas', self.owner)
+        elif self.lease_until is None and was_leader:
+            self.app.logger.warning('Scheduler: este processo (%s) perdeu o lease das tarefas periódicas', self.owner)
+
+    def release(self):
+        if self.lease_until is None:
+            return
+        self.lease_until = None
+        with self.app.app_context():
+            SchedulerLease.release(self.name, self.owner)
+
+
+class JobMetrics:
+    """Tempos de execução e contadores de cada tarefa (execuções, erros, execuções perdidas) deste processo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _job(self, job_id):
+        return self._jobs.setdefault(job_id, {'runs': 0, 'failures': 0, 'missed': 0, 'last_run': None,
+                                              'last_ms': 0.0, 'avg_ms': 0.0, 'max_ms': 0.0})
+
+    def record(self, job_id, duration_ms, failed=False):
+        with self._lock:
+            job = self._job(job_id)
+            job['runs'] += 1
+            job['failures'] += failed
+            job['last_run'] = datetime.now()
+            job['last_ms'] = duration_ms
+            job['avg_ms'] += (duration_ms - job['avg_ms']) / job['runs']  # Média incremental
+            job['max_ms'] = max(job['max_ms'], duration_ms)
+            return dict(job)
+
+    def record_missed(self, job_id):
+        with self._lock:
+            self._job(job_id)['missed'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {job_id: dict(job) for job_id, job in self._jobs.items()}
+
+
+def run_job(app, job_id, func):
+    """
+    Corre uma tarefa só se este processo for o líder, e regista o tempo de execução.
+
+    Returns:
+        bool: False se a tarefa falhou
+    """
+    if not app.extensions['scheduler_leader'].is_leader:
+        return True
+
+    start = time.perf_counter()
+    failed = False
+    result = None
+    try:
+        result = func(app)
+    except Exception:
+        failed = True
+        app.logger.exception('Erro na tarefa %s', job_id)
+    finally:
+        job = app.extensions['scheduler_metrics'].record(job_id, (time.perf_counter() - start) * 1000, failed)
+
+    if result:
+        app.logger.info('Tarefa %s: %s (%.1f ms, média %.1f ms, máx. %.1f ms)', job_id, result, job['last_ms'],
+                        job['avg_ms'], job['max_ms'])
+    return not failed
+
+
+class TransitionTimer:
+    """
+    Thread que dorme até à data/hora da próxima ScheduledTransition e aplica as transições nesse momento. Sem
+    transições por aplicar (ou sem ser o líder) fica parada até ser acordada: pelo commit de novas transições neste
+    processo (ScheduledTransition.listeners) ou pela renovação do lease, que apanha as criadas noutros processos.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='transition-timer', daemon=True)
+
+    def start(self):
+        ScheduledTransition.listeners.append(self.wake)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self.wake in ScheduledTransition.listeners:
+            ScheduledTransition.listeners.remove(self.wake)
+        self._wake.set()
+
+    def wake(self, due_at=None):
+        self._wake.set()
+
+    def _next_timeout(self):
+        """Segundos até à próxima transição (0 ou menos = já passou), ou None para esperar até ser acordada."""
+        if not self.app.extensions['scheduler_leader'].is_leader:
+            return None
+        try:
+            with self.app.app_context():
+                due_at = ScheduledTransition.next_due_at()
+        except Exception:
+            self.app.logger.exception('Erro ao obter a próxima transição de disponibilidade')
+            return TRANSITION_RETRY_SECONDS
+        return None if due_at is None else (due_at - datetime.now()).total_seconds()
+
+    def _run(self):
+        while not self._stopped:
+            timeout = self._next_timeout()
+            if timeout is not None and timeout <= 0:
+                if run_job(self.app, TRANSITIONS_JOB_ID, apply_transitions_job):
+                    continue
+                timeout = TRANSITION_RETRY_SECONDS
+
+            # Um wake() entre o wait e o clear não se perde: o ciclo volta sempre a ler a próxima transição
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+
+def create_scheduler(app, scheduler_class=BackgroundScheduler):
+    """
+    Cria o scheduler com a renovação do lease, o TransitionTimer e as tarefas periódicas da aplicação (sem os
+    iniciar).
+
+    Args:
+        app (Flask): Aplicação
+        scheduler_class: BackgroundScheduler (dentro do servidor) ou BlockingScheduler ("flask scheduler")
+
+    Returns:
+        Scheduler criado (também guardado em app.extensions['scheduler'])
+    """
+    leader = SchedulerLeader(app)
+    metrics = JobMetrics()
+    app.extensions['scheduler_leader'] = leader
+    app.extensions['scheduler_metrics'] = metrics
+
+    # coalesce: execuções em atraso (ex: processo suspenso) correm uma só vez; max_instances: uma tarefa lenta não
+    # se sobrepõe à execução seguinte; misfire_grace_time: execuções com mais atraso do que isto são descartadas
+    scheduler = scheduler_class(job_defaults={
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': app.config['SCHEDULER_MISFIRE_GRACE_TIME'],
+    })
+
+    def on_job_missed(event):
+        metrics.record_missed(event.job_id)
+        app.logger.warning('Tarefa %s não correu à hora prevista (%s)', event.job_id, event.scheduled_run_time)
+
+    scheduler.add_listener(on_job_missed, EVENT_JOB_MISSED)
+
+    # O lease é renovado três vezes por prazo e a primeira tentativa é feita logo no arranque. A cada renovação o
+    # TransitionTimer volta a ler a próxima transição, para apanhar as que foram criadas noutros processos
+    timer = TransitionTimer(app)
+    app.extensions['transition_timer'] = timer
+
+    def heartbeat():
+        leader.renew()
+        timer.wake()
+
+    scheduler.add_job(func=heartbeat, trigger="interval", seconds=max(leader.ttl // 3, 1), id='scheduler_lease',
+                      next_run_time=datetime.now())
+
+    # Adicionar as tarefas de atualização ao scheduler (Biblioteca de agendamento em Python, para agendar a execução
+    # de uma determinada função ou tarefa). O jitter espalha as execuções alguns segundos para as tarefas do mesmo
+    # intervalo não pedirem o lock de escrita da base de dados ao mesmo tempo
+    for job_id, func, minutes in JOBS:
+        scheduler.add_job(func=run_job, args=[app, job_id, func], trigger="interval", minutes=minutes, id=job_id,
+                          jitter=app.config['SCHEDULER_JITTER'])
+
+    app.extensions['scheduler'] = scheduler
+    return scheduler
+
+
+def start_scheduler(app):
+    """
+    Cria e inicia o scheduler em segundo plano, dentro do processo do servidor.
+
+    Returns:
+        BackgroundScheduler: Scheduler iniciado (também guardado em app.extensions['scheduler'])
+    """
+    scheduler = create_scheduler(app)
+    scheduler.start()
+    app.extensions['transition_timer'].start()
+    return scheduler
+
+
+def run_scheduler(app):
+    """Corre o scheduler em primeiro plano até o processo terminar ("flask scheduler") e liberta o lease no fim."""
+    scheduler = create_scheduler(app, BlockingScheduler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Paragem normal do processo (ex: systemd)
+    app.extensions['transition_timer'].start()
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        app.extensions['transition_timer'].stop()
+        app.extensions['scheduler_leader'].release()
+        for job_id, job in app.extensions['scheduler_metrics'].snapshot().items():
+            app.logger.info('Tarefa %s: %d execuções, %d erros, %d perdidas, média %.1f ms, máx. %.1f ms', job_id,
+                            job['runs'], job['failures'], job['missed'], job['avg_ms'], job['max_ms'])
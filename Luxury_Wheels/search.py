@@ -0,0 +1,154 @@
+import re
+
+from sqlalchemy import text, select, literal_column, and_, or_, inspect
+from sqlalchemy.exc import OperationalError
+
+from models import db, Veiculos
+
+# ------------------------------- Índice de pesquisa de texto (SQLite FTS5) --------------------------------------
+
+# Tabela virtual FTS5 com a marca, o modelo, o nome da categoria e o tipo de cada veículo. O rowid da tabela é o id
+# do veículo. O tokenizer unicode61 ignora maiúsculas/minúsculas e acentos, e as pesquisas são feitas por prefixo de
+# palavra ("merc" encontra "MERCEDES"), usando o índice invertido em vez de um LIKE '%...%' sobre a tabela toda.
+SEARCH_TABLE = 'veiculos_fts'
+
+# Colunas da tabela FTS que podem ser usadas para restringir a pesquisa
+SEARCH_COLUMNS = ('brand', 'model', 'categoria', 'tipo')
+
+_SELECT_VEHICLE_ROW = """
+    SELECT v.id, v.brand, v.model, (SELECT c.nome FROM categoria c WHERE c.id = v.categoria_id), v.type
+    FROM veiculos v
+"""
+
+# O índice é mantido pela própria base de dados com triggers, por isso fica sincronizado com qualquer INSERT, UPDATE
+# ou DELETE de veículos (incluindo os UPDATEs em bloco do scheduler) e com a alteração do nome de uma categoria
+SEARCH_INDEX_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+        USING fts5(brand, model, categoria, tipo, tokenize="unicode61 remove_diacritics 2")""",
+
+    f"""CREATE TRIGGER IF NOT EXISTS veiculos_fts_insert AFTER INSERT ON veiculos BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, brand, model, categoria, tipo)
+        VALUES (NEW.id, NEW.brand, NEW.model,
+                (SELECT nome FROM categoria WHERE id = NEW.categoria_id), NEW.type);
+    END""",
+
+    f"""CREATE TRIGGER IF NOT EXISTS veiculos_fts_update AFTER UPDATE OF brand, model, type, categoria_id
+        ON veiculos BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, brand, model, categoria, tipo)
+        VALUES (NEW.id, NEW.brand, NEW.model,
+                (SELECT nome FROM categoria WHERE id = NEW.categoria_id), NEW.type);
+    END""",
+
+    f"""CREATE TRIGGER IF NOT EXISTS veiculos_fts_delete AFTER DELETE ON veiculos BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+    END""",
+
+    f"""CREATE TRIGGER IF NOT EXISTS veiculos_fts_categoria_update AFTER UPDATE OF nome ON categoria BEGIN
+        UPDATE {SEARCH_TABLE} SET categoria = NEW.nome
+        WHERE rowid IN (SELECT id FROM veiculos WHERE categoria_id = NEW.id);
+    END""",
+]
+
+# Indica se o índice FTS está disponível. É definido por init_vehicle_search ("flask bootstrap") ou, nos processos do
+# servidor, na primeira pesquisa (None = ainda não verificado)
+_search_enabled = None
+
+
+def init_vehicle_search(engine):
+    """
+    Cria o índice de pesquisa (tabela FTS5 e triggers) se ainda não existir e preenche-o se estiver vazio.
+
+    Em bases de dados que não são SQLite, ou num SQLite compilado sem FTS5, o índice fica desativado e as
+    pesquisas usam o ILIKE normal.
+
+    Returns:
+        bool: True se o índice FTS estiver disponível
+    """
+    global _search_enabled
+
+    if engine.dialect.name != 'sqlite':
+        _search_enabled = False
+        return False
+
+    try:
+        with engine.begin() as connection:
+            for statement in SEARCH_INDEX_DDL:
+                connection.execute(text(statement))
+
+            # Preenche o índice com os veículos que já existiam antes de ser criado
+            indexed = connection.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+            if not indexed:
+                connection.execute(text(
+                    f"INSERT INTO {SEARCH_TABLE}(rowid, brand, model, categoria, tipo) {_SELECT_VEHICLE_ROW}"))
+        _search_enabled = True
+    except OperationalError:
+        _search_enabled = False
+
+    return _search_enabled
+
+
+def search_enabled():
+    """Indica se o índice FTS existe na base de dados (verificado uma vez por processo)."""
+    global _search_enabled
+
+    if _search_enabled is None:
+        _search_enabled = db.engine.dialect.name == 'sqlite' and inspect(db.engine).has_table(SEARCH_TABLE)
+    return _search_enabled
+
+
+def build_match_query(search_text, columns=None):
+    """
+    Converte o texto introduzido pelo utilizador numa expressão MATCH do FTS5.
+
+    Cada palavra é pesquisada como prefixo e todas as palavras têm de existir (AND). Se forem indicadas colunas, a
+    pesquisa fica restrita a essas colunas.
+
+    Returns:
+        str: Expressão MATCH, ou string vazia se o texto não tiver palavras
+    """
+    tokens = re.findall(r'\w+', search_text or '')
+    if not tokens:
+        return ''
+
+    column_filter = '{' + ' '.join(columns) + '} : ' if columns else ''
+    return ' AND '.join(f'{column_filter}"{token}"*' for token in tokens)
+
+
+def vehicle_text_filter(search_text, columns=None):
+    """
+    Filtro SQLAlchemy para pesquisar veículos por texto livre (marca, modelo, categoria e tipo).
+
+    Usa o índice FTS5 quando está disponível, caso contrário recorre a ILIKE nas colunas de Veiculos.
+
+    Args:
+        search_text (str): Texto introduzido na pesquisa
+        columns (tuple): Colunas do índice onde pesquisar (ver SEARCH_COLUMNS), por defeito todas
+
+    Returns:
+        Expressão para usar em query.filter(), ou None se o texto não tiver palavras
+    """
+    match_query = build_match_query(search_text, columns)
+    if not match_query:
+        return None
+
+    if search_enabled():
+        return Veiculos.id.in_(
+            select(literal_column('rowid'))
+            .select_from(text(SEARCH_TABLE))
+            .where(text(f"{SEARCH_TABLE} MATCH :match_query").bindparams(match_query=match_query)))
+
+    # Alternativa sem FTS: cada palavra tem de aparecer na marca ou no modelo
+    fallback_columns = [Veiculos.brand, Veiculos.model]
+    if columns:
+        fallback_columns = [getattr(Veiculos, column) for column in columns
+                            if column in ('brand', 'model')] or fallback_columns
+    return and_(*[or_(*[column.ilike(f'%{token}%') for column in fallback_columns])
+                  for token in re.findall(r'\w+', search_text)])
+
+
+def exclude_search_tables(object, name, type_, reflected, compare_to):
+    """Impede o autogenerate do Alembic de tentar apagar as tabelas internas do índice FTS."""
+    if type_ == 'table' and name and name.startswith(SEARCH_TABLE):
+        return False
+    return True
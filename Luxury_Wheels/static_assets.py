@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:  # O brotli é opcional: sem ele só são gerados ficheiros .gz
+    import brotli
+except ImportError:
+    brotli = None
+
+from images import CONTENT_NAME
+
+# ------------------------------- Ficheiros estáticos com cache de longa duração ----------------------------------
+
+# Todos os url_for('static', ...) levam o parâmetro v=<hash do conteúdo> (os uploads guardados com o hash no nome
+# já são únicos por conteúdo e não precisam dele). Como o URL muda sempre que o ficheiro muda, os pedidos com o
+# hash certo podem ficar em cache no browser durante um ano sem revalidação (immutable). Os restantes pedidos
+# continuam a ser revalidados com o ETag (resposta 304 sem corpo quando o ficheiro não mudou)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Ficheiros de texto para os quais são gerados os ficheiros pré-comprimidos (.br e .gz). As imagens já estão
+# comprimidas
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json')
+
+# Codificações pré-comprimidas, pela ordem de preferência
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_fingerprints = {}  # caminho -> (mtime, tamanho, hash)
+_lock = threading.Lock()
+
+
+def _is_content_addressed(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return CONTENT_NAME.fullmatch(stem.rsplit('-', 1)[0]) is not None  # Inclui as variantes (<hash>-480w.webp)
+
+
+def static_fingerprint(static_folder, filename):
+    """
+    Hash curto do conteúdo de um ficheiro estático, recalculado só quando o ficheiro muda.
+
+    Returns:
+        str: 12 caracteres do sha256, ou None se o ficheiro não existir
+    """
+    file_path = safe_join(static_folder, filename)
+    if file_path is None:  # Caminho fora da pasta static
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    with _lock:
+        cached = _fingerprints.get(file_path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    fingerprint = sha256.hexdigest()[:12]
+
+    with _lock:
+        _fingerprints[file_path] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+    return fingerprint
+
+
+def _is_fresh(compressed_path, source_stat):
+    # O ficheiro comprimido é gerado com a data de modificação do original (ver compress_static_files). Se o original
+    # for alterado depois, as datas deixam de coincidir e o ficheiro comprimido fica desatualizado
+    try:
+        return os.stat(compressed_path).st_mtime_ns == source_stat.st_mtime_ns
+    except OSError:
+        return False
+
+
+def compress_static_files(static_folder):
+    """
+    Gera os ficheiros .gz e .br dos ficheiros de texto da pasta static que ainda não os têm ou que mudaram.
+
+    Returns:
+        int: Número de ficheiros comprimidos gerados
+    """
+    suffixes = ['.gz'] + (['.br'] if brotli is not None else [])
+    generated = 0
+    for folder, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            file_path = os.path.join(folder, filename)
+            source_stat = os.stat(file_path)
+            if all(_is_fresh(file_path + suffix, source_stat) for suffix in suffixes):
+                continue  # Já está atualizado
+
+            with open(file_path, 'rb') as file:
+                content = file.read()
+
+            compressed = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['.br'] = brotli.compress(content, quality=11)
+
+            for suffix, data in compressed.items():
+                if len(data) < len(content):  # Só vale a pena se o ficheiro ficar mais pequeno
+                    with open(file_path + suffix, 'wb') as file:
+                        file.write(data)
+                    os.utime(file_path + suffix, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                    generated += 1
+                elif os.path.exists(file_path + suffix):
+                    os.remove(file_path + suffix)  # Versão antiga que deixou de valer a pena
+    return generated
+
+
+def init_static_assets(app):
+    """Ativa os URLs com hash, os cabeçalhos de cache e os ficheiros pré-comprimidos para a pasta static."""
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'v' not in values and not _is_content_addressed(values.get('filename', '')):
+            fingerprint = static_fingerprint(app.static_folder, values.get('filename', ''))
+            if fingerprint:
+                values['v'] = fingerprint
+
+    def send_static_file(filename):
+        # Com o hash certo no URL (ou no nome do ficheiro) o conteúdo nunca muda para este URL
+        immutable = _is_content_addressed(filename) or \
+            (request.args.get('v') is not None and
+             request.args.get('v') == static_fingerprint(app.static_folder, filename))
+
+        # Versão pré-comprimida, se existir, corresponder ao ficheiro atual e o browser a aceitar
+        accepted = request.accept_encodings
+        source_path = safe_join(app.static_folder, filename)
+        try:
+            source_stat = os.stat(source_path) if source_path else None
+        except OSError:
+            source_stat = None
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and source_stat and _is_fresh(source_path + suffix, source_stat):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename)
+
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            response.vary.add('Accept-Encoding')
+        if immutable:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    app.view_functions['static'] = send_static_file
@@ -0,0 +1,78 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# Os módulos da aplicação estão na pasta acima de tests/ (app.py, models.py, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from commands import seed_database  # noqa: E402
+from models import db, Categoria, Clientes, Veiculos, VehicleType  # noqa: E402
+from search import init_vehicle_search  # noqa: E402
+
+
+@pytest.fixture
+def app_config():
+    """Configurações extra da aplicação de teste (os módulos de testes podem redefinir esta fixture)."""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    """Aplicação com uma base de dados SQLite nova em tmp_path, com as tabelas, o índice de pesquisa e os dados
+    iniciais (o mesmo que "flask bootstrap")."""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'IMAGE_WORKERS': 0,
+        'CART_STORE': 'memory',
+        'DASHBOARD_CACHE_TTL': 0,
+        'USER_CACHE_TTL': 0,
+        **app_config,
+    })
+    with app.app_context():
+        db.create_all()
+        init_vehicle_search(db.engine)
+        seed_database()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    client.post('/login_admin', data={'username': 'admin1', 'password': 'admin'})
+    return client
+
+
+@pytest.fixture
+def make_vehicle(app):
+    """Cria um carro ativo e devolve o seu ID."""
+    def make_vehicle(brand='BMW', model='Serie 3', price_per_day=100.0):
+        with app.app_context():
+            categoria = Categoria.query.filter_by(tipo_veiculo=VehicleType.CARRO).first()
+            vehicle = Veiculos(VehicleType.CARRO, brand, model, 2022, price_per_day, 5, 3, 'a', 6.5, categoria)
+            db.session.add(vehicle)
+            db.session.commit()
+            return vehicle.id
+    return make_vehicle
+
+
+@pytest.fixture
+def customer_id(app):
+    with app.app_context():
+        cliente = Clientes('Ana', 'Silva', 'ana@example.com', '912345678', date(1990, 1, 1), 'Rua A', 123456789,
+                           'password')
+        db.session.add(cliente)
+        db.session.commit()
+        return cliente.id
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+import pytest
+
+from admin import get_dashboard_counts, invalidate_dashboard_counts
+
+
+@pytest.fixture
+def dashboard_counts(app):
+    """Lê os contadores do dashboard com a cache ativa, como num pedido ao /admin/admin_home."""
+    app.config['DASHBOARD_CACHE_TTL'] = 3600
+    invalidate_dashboard_counts()
+    yield lambda: _read(app)
+    invalidate_dashboard_counts()
+
+
+def _read(app):
+    with app.test_request_context():
+        return get_dashboard_counts()
+
+
+def test_vehicle_writes_refresh_cached_counts(app, admin_client, make_vehicle, dashboard_counts):
+    vehicle_id = make_vehicle()
+    assert dashboard_counts()['car_count'] == 1
+
+    # Criados diretamente na base de dados, sem passar pelas rotas: o valor em cache continua a ser servido
+    other_id = make_vehicle()
+    make_vehicle()
+    assert dashboard_counts()['car_count'] == 1
+
+    admin_client.post(f'/delete_vehicle/{vehicle_id}')
+    assert dashboard_counts()['car_count'] == 2
+
+    admin_client.post(f'/admin/vehicle_event/{other_id}', data={
+        'event_type': 'maintenance', 'event_date': date.today().isoformat(),
+        'next_date': (date.today() + timedelta(days=5)).isoformat()})
+    assert dashboard_counts()['maintenance_due'] == 1
+
+
+def test_client_registration_refreshes_cached_counts(client, dashboard_counts):
+    assert dashboard_counts()['total_clients'] == 0
+
+    client.post('/registro', data={
+        'nomeUtilizador': 'Rui', 'apelidoUtilizador': 'Costa', 'emailUtilizador': 'rui@example.com',
+        'telefoneUtilizador': '912000000', 'data_nascimentoUtilizador': '1985-05-05', 'moradaUtilizador': 'Rua B',
+        'nifUtilizador': '234567890', 'passwordUtilizador': 'password', 'passwordUtilizadorConf': 'password'})
+    assert dashboard_counts()['total_clients'] == 1
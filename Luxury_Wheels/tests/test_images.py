@@ -0,0 +1,67 @@
+import io
+import os
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from models import db, ImageFile, Veiculos
+
+
+def _image_upload(content=b'\x89PNG\r\n\x1a\n' + b'0' * 64):
+    return io.BytesIO(content), 'foto.png'
+
+
+def _upload_path(app, image_path):
+    return os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(image_path))
+
+
+@pytest.fixture
+def vehicle_with_image(app, admin_client, make_vehicle):
+    vehicle_id = make_vehicle()
+    response = admin_client.post(f'/admin/replace_img/{vehicle_id}', data={'image': [_image_upload()]},
+                                 content_type='multipart/form-data')
+    assert response.status_code == 302
+    with app.app_context():
+        image_path = db.session.get(Veiculos, vehicle_id).get_imagens()[0]
+    assert os.path.exists(_upload_path(app, image_path))
+    return vehicle_id, image_path
+
+
+def test_failed_delete_keeps_image_files(app, admin_client, vehicle_with_image, monkeypatch):
+    vehicle_id, image_path = vehicle_with_image
+
+    def failing_commit():
+        raise OperationalError('COMMIT', {}, Exception('disk I/O error'))
+
+    monkeypatch.setattr(db.session, 'commit', failing_commit)
+    admin_client.post(f'/delete_vehicle/{vehicle_id}')
+    monkeypatch.undo()
+
+    with app.app_context():
+        assert db.session.get(Veiculos, vehicle_id) is not None
+        assert db.session.get(ImageFile, image_path).ref_count == 1
+    assert os.path.exists(_upload_path(app, image_path))
+
+
+def test_delete_vehicle_removes_unreferenced_files(app, admin_client, vehicle_with_image):
+    vehicle_id, image_path = vehicle_with_image
+
+    admin_client.post(f'/delete_vehicle/{vehicle_id}')
+
+    with app.app_context():
+        assert db.session.get(Veiculos, vehicle_id) is None
+        assert db.session.get(ImageFile, image_path) is None
+    assert not os.path.exists(_upload_path(app, image_path))
+
+
+def test_shared_file_is_kept_while_another_vehicle_uses_it(app, admin_client, vehicle_with_image, make_vehicle):
+    vehicle_id, image_path = vehicle_with_image
+    other_id = make_vehicle(brand='Audi', model='A4')
+    admin_client.post(f'/admin/replace_img/{other_id}', data={'image': [_image_upload()]},
+                      content_type='multipart/form-data')
+
+    admin_client.post(f'/delete_vehicle/{vehicle_id}')
+
+    with app.app_context():
+        assert db.session.get(ImageFile, image_path).ref_count == 1
+    assert os.path.exists(_upload_path(app, image_path))
@@ -0,0 +1,57 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from app import count_query, create_app
+from models import db, Clientes, Veiculos
+
+SMALL_PAGE, LARGE_PAGE = 3, 8
+
+
+@pytest.fixture
+def app_config():
+    return {'SQL_QUERY_COUNTER': True}
+
+
+@pytest.fixture
+def populated(app, make_vehicle):
+    """Dez veículos com duas imagens cada e dez clientes (mais do que cabe na página maior)."""
+    for number in range(10):
+        vehicle_id = make_vehicle(brand=f'Marca{number}', model=f'Modelo {number}')
+        with app.app_context():
+            vehicle = db.session.get(Veiculos, vehicle_id)
+            vehicle.set_imagens([f'uploads/{number}a.png', f'uploads/{number}b.png'])
+            db.session.add(Clientes(f'Nome{number}', 'Teste', f'cliente{number}@example.com', f'91000000{number}',
+                                    date(1990, 1, 1), 'Rua', 100000000 + number, 'password'))
+            db.session.commit()
+
+
+def _query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return int(response.headers['X-Query-Count'])
+
+
+def test_catalogue_query_count_does_not_depend_on_page_size(app, client, populated):
+    app.config['CATALOGUE_PAGE_SIZE'] = SMALL_PAGE
+    small = _query_count(client, '/list_vehicle')
+    app.config['CATALOGUE_PAGE_SIZE'] = LARGE_PAGE
+    large = _query_count(client, '/list_vehicle')
+    assert small == large > 0
+
+
+@pytest.mark.parametrize('url', ['/admin/search_vehicles', '/admin/clients'])
+def test_admin_listing_query_count_does_not_depend_on_page_size(admin_client, populated, url):
+    small = _query_count(admin_client, f'{url}?per_page={SMALL_PAGE}')
+    large = _query_count(admin_client, f'{url}?per_page={LARGE_PAGE}')
+    assert small == large > 0
+
+
+def test_query_counter_listener_is_only_registered_when_enabled(app):
+    with app.app_context():
+        assert event.contains(db.engine, 'before_cursor_execute', count_query)
+
+    disabled = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQL_QUERY_COUNTER': False})
+    with disabled.app_context():
+        assert not event.contains(db.engine, 'before_cursor_execute', count_query)
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Reservation, ReservationConflictError, Veiculos
+
+
+def _window(days_from_now, days):
+    start = (datetime.now() + timedelta(days=days_from_now)).replace(hour=10, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=days)
+
+
+def _item(vehicle_id, window, price=100.0):
+    return {'vehicle_id': vehicle_id, 'start_datetime': window[0], 'end_datetime': window[1], 'price': price}
+
+
+def test_future_reservation_leaves_earlier_window_free(app, make_vehicle, customer_id):
+    vehicle_id = make_vehicle()
+    next_month = _window(30, 3)
+    this_week = _window(2, 2)
+
+    with app.app_context():
+        Reservation.create_batch(customer_id, [_item(vehicle_id, next_month)], 'MB Way')
+        vehicle = db.session.get(Veiculos, vehicle_id)
+        assert vehicle.is_reserved and vehicle.available_from == next_month[1]
+
+        assert vehicle.is_free_between(*this_week)
+        assert not vehicle.is_free_between(next_month[0] + timedelta(days=1), next_month[1] + timedelta(days=1))
+        free_ids = [vehicle.id for vehicle in Veiculos.query.filter(Veiculos.free_between_filter(*this_week))]
+        assert free_ids == [vehicle_id]
+
+
+def test_catalogue_window_search_lists_vehicle_reserved_later(app, client, make_vehicle, customer_id):
+    vehicle_id = make_vehicle()
+    with app.app_context():
+        Reservation.create_batch(customer_id, [_item(vehicle_id, _window(30, 3))], 'MB Way')
+
+    start, end = _window(2, 2)
+    response = client.get(f'/list_vehicle?start_date={start:%Y-%m-%d}&end_date={end:%Y-%m-%d}')
+    assert response.status_code == 200
+    assert f'reserve_vehicle/{vehicle_id}'.encode() in response.data
+
+
+def test_unavailable_vehicle_is_not_free_before_available_from(app, make_vehicle):
+    vehicle_id = make_vehicle()
+    with app.app_context():
+        vehicle = db.session.get(Veiculos, vehicle_id)
+        vehicle.status = False
+        vehicle.available_from = datetime.now() + timedelta(days=10)
+        db.session.commit()
+
+        assert not vehicle.is_free_between(*_window(2, 2))
+        assert vehicle.is_free_between(*_window(12, 2))
+
+
+def test_batch_rejects_overlapping_items_for_the_same_vehicle(app, make_vehicle, customer_id):
+    vehicle_id = make_vehicle()
+    start, end = _window(5, 3)
+    items = [_item(vehicle_id, (start, end)), _item(vehicle_id, (start + timedelta(days=1), end + timedelta(days=1)))]
+
+    with app.app_context():
+        with pytest.raises(ReservationConflictError):
+            Reservation.create_batch(customer_id, items, 'MB Way')
+        assert Reservation.query.count() == 0
+
+        # Períodos seguidos do mesmo veículo não se sobrepõem
+        back_to_back = [_item(vehicle_id, (start, end)), _item(vehicle_id, (end, end + timedelta(days=2)))]
+        assert len(Reservation.create_batch(customer_id, back_to_back, 'MB Way')) == 2
+
+
+def test_batch_rejects_vehicle_unavailable_in_the_period(app, make_vehicle, customer_id):
+    vehicle_id = make_vehicle()
+    with app.app_context():
+        vehicle = db.session.get(Veiculos, vehicle_id)
+        vehicle.status = False
+        vehicle.available_from = datetime.now() + timedelta(days=10)
+        db.session.commit()
+
+        with pytest.raises(ReservationConflictError):
+            Reservation.create_batch(customer_id, [_item(vehicle_id, _window(2, 2))], 'MB Way')
+        assert Reservation.query.count() == 0
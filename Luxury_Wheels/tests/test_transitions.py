@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from models import db, Reservation, ScheduledTransition, Veiculos
+
+
+def _pending(kind, target_id):
+    return [transition.due_at for transition in ScheduledTransition.query.filter_by(kind=kind, target_id=target_id)]
+
+
+def test_changed_dates_replace_the_pending_transition(app, make_vehicle):
+    vehicle_id = make_vehicle()
+    now = datetime.now().replace(microsecond=0)
+
+    with app.app_context():
+        vehicle = db.session.get(Veiculos, vehicle_id)
+        for hours in (1, 2, 3):
+            vehicle.status = False
+            vehicle.available_from = now + timedelta(hours=hours)
+            db.session.commit()
+        assert _pending(ScheduledTransition.VEHICLE, vehicle_id) == [now + timedelta(hours=3)]
+
+        vehicle.in_maintenance = True
+        vehicle.maintenance_start = now
+        vehicle.maintenance_end = now + timedelta(hours=5)
+        db.session.commit()
+        assert _pending(ScheduledTransition.MAINTENANCE, vehicle_id) == [now + timedelta(hours=5)]
+
+        vehicle.available_from = None
+        db.session.commit()
+        assert _pending(ScheduledTransition.VEHICLE, vehicle_id) == []
+
+        db.session.delete(vehicle)
+        db.session.commit()
+        assert ScheduledTransition.query.count() == 0
+
+
+def test_apply_due_only_touches_due_targets(app, make_vehicle):
+    due_id, overdue_id, later_id = make_vehicle(), make_vehicle(), make_vehicle()
+    past = datetime.now() - timedelta(minutes=1)
+
+    with app.app_context():
+        # Estado em atraso gravado diretamente (sem transição), que fica para a verificação periódica
+        db.session.execute(db.text("UPDATE veiculos SET is_reserved = 1, status = 0, available_from = :past "
+                                   "WHERE id IN (:due, :overdue)"),
+                           {'past': past, 'due': due_id, 'overdue': overdue_id})
+        db.session.add_all([
+            ScheduledTransition(kind=ScheduledTransition.VEHICLE, target_id=due_id, due_at=past),
+            ScheduledTransition(kind=ScheduledTransition.VEHICLE, target_id=later_id,
+                                due_at=datetime.now() + timedelta(hours=1)),
+        ])
+        db.session.commit()
+
+        assert ScheduledTransition.apply_due()['reservation_ended'] == 1
+        assert not db.session.get(Veiculos, due_id).is_reserved
+        assert db.session.get(Veiculos, overdue_id).is_reserved
+        assert [transition.target_id for transition in ScheduledTransition.query] == [later_id]
+        assert ScheduledTransition.apply_due() is None
+
+
+def test_completed_reservation_loses_its_transition(app, make_vehicle, customer_id):
+    vehicle_id = make_vehicle()
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+
+    with app.app_context():
+        reservation, = Reservation.create_batch(customer_id, [{'vehicle_id': vehicle_id, 'start_datetime': start,
+                                                               'end_datetime': start + timedelta(days=2),
+                                                               'price': 200.0}], 'MB Way')
+        assert _pending(ScheduledTransition.RESERVATION, reservation.id) == [start + timedelta(days=2)]
+
+        reservation.status = "Concluída"
+        db.session.commit()
+        assert _pending(ScheduledTransition.RESERVATION, reservation.id) == []
@@ -1,18 +1,17 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from models import Clientes, db, Admin, Veiculos, VehicleType, Categoria, Reservation
+from models import db, Admin, Veiculos, VehicleType, Categoria, Reservation, ReservationConflictError
 from functools import wraps  # Adicionado este import para os decorators personalizados
 from datetime import datetime
+from sqlalchemy.orm import selectinload
+from utils import parse_datetime_window
+from user_cache import invalidate_user
+from admin import invalidate_dashboard_counts
+from cart import get_cart, save_cart, clear_cart, get_edit_original, save_edit_original, clear_edit_original
 
 bp = Blueprint('user', __name__)
 
 
-# Função helper para inicializar o carrinho de um ou múltiplas reservas
-def init_reservation_cart():
-    if 'reservation_cart' not in session:
-        session['reservation_cart'] = []
-
-
 # Decorator
 def client_required(f):
     @wraps(f)
@@ -28,11 +27,44 @@ def client_required(f):
     return decorated_function  # Retorna a função decorada.
 
 
+# Itens do carrinho prontos a mostrar: junta a cada item a marca, o modelo e as imagens do veículo (todos os veículos
+# numa única query IN, com as imagens numa segunda) e a duração calculada a partir das datas. Devolve também os
+# veículos por ID
+def cart_display_items(cart):
+    vehicle_ids = {item['vehicle_id'] for item in cart}
+    vehicles = {vehicle.id: vehicle for vehicle in
+                Veiculos.query.options(selectinload(Veiculos.imagens))
+                .filter(Veiculos.id.in_(vehicle_ids)).all()} if vehicle_ids else {}
+
+    items = []
+    for item in cart:
+        vehicle = vehicles.get(item['vehicle_id'])
+        try:
+            start_datetime = datetime.strptime(f"{item['start_date']} {item['start_time']}", "%Y-%m-%d %H:%M")
+            end_datetime = datetime.strptime(f"{item['end_date']} {item['end_time']}", "%Y-%m-%d %H:%M")
+            total_hours = (end_datetime - start_datetime).total_seconds() / 3600
+        except (ValueError, TypeError):
+            total_hours = 0
+
+        items.append({
+            **item,
+            'brand': vehicle.brand if vehicle else '',
+            'model': vehicle.model if vehicle else '',
+            'imagens': vehicle.get_imagens() if vehicle else [],
+            # Variantes reduzidas da primeira imagem, a única mostrada no carrinho
+            'imagem_variantes': vehicle.imagem_principal.get_variantes() if vehicle and vehicle.imagem_principal
+            else [],
+            'days': total_hours // 24,  # Número inteiro de dias
+            'remaining_hours': total_hours % 24,  # Horas restantes
+        })
+    return items, vehicles
+
+
 @bp.route('/user/client_perfil', methods=['GET', 'POST'])
 @client_required
 def client_perfil():
-    # Obtém os dados do cliente atual usando o ID do utilizador autenticado
-    cliente = Clientes.query.get(current_user.id)
+    # O cliente atual já foi carregado pelo load_user, não é preciso voltar a ir buscá-lo à base de dados
+    cliente = current_user._get_current_object()
 
     # Se o método for POST (quando o formulário é submetido)
     if request.method == 'POST':
@@ -47,6 +79,7 @@ def client_perfil():
 
         try:
             db.session.commit()  # Tenta guardar as alterações no banco de dados
+            invalidate_user(cliente)  # Os próximos pedidos voltam a carregar os dados atualizados
             flash('O perfil foi atualizado com sucesso!', 'success')
             return redirect(url_for('user.client_perfil'))  # Redireciona de volta para a página do perfil
 
@@ -64,9 +97,7 @@ def client_perfil():
 def reserve_vehicle(id):
     vehicle = Veiculos.query.get_or_404(id)  # A linha busca um veículo pelo seu ID na base de dados. Caso o veículo
     # não for encontrado, um erro 404 é retornado.
-    init_reservation_cart()  # inicialização do carrinho de reservas.
-    cart = session.get('reservation_cart', [])  # Obtém o carrinho de reservas da sessão, ou cria um novo se não
-    # existir.
+    cart = get_cart()  # Obtém o carrinho de reservas guardado no servidor (lista vazia se ainda não existir)
 
     # Verifica se está em modo de edição tanto por args e, foi adicionado o estado is_editing na sessão para
     # persistir durante todo o processo para não cair no else do estdo do (is_duplicate)
@@ -93,7 +124,7 @@ def reserve_vehicle(id):
         # sessão e dá a sessão como modificada.
         if cart_index is not None and 'edit_item_index' not in session:
             session['edit_item_index'] = cart_index
-            session['edit_item_original'] = existing_item
+            save_edit_original(existing_item)
             session.modified = True
 
     # Se for um POST, processa o formulário, obtendo os dados (datas e horários de início e fim).
@@ -128,32 +159,20 @@ def reserve_vehicle(id):
                 total_price_no_iva = total_hours * price_per_hour
                 total_price = total_price_no_iva + (IVA * vehicle.price_per_day)
 
-            # Clálculo do tempo da reserva
-            days = total_hours // 24  # Número inteiro de dias
-            remaining_hours = total_hours % 24  # Horas restantes
-
             # IVA da reserva
             reserve_iva = total_price - total_price_no_iva
 
-            # Criar o item de reserva
+            # Criar o item de reserva. Só são guardados o veículo, as datas e os preços deste momento; os dados do
+            # veículo são lidos ao mostrar o carrinho (ver cart_display_items)
             reservation_item = {
                 'vehicle_id': vehicle.id,
-                'brand': vehicle.brand,
-                'model': vehicle.model,
                 'start_date': start_date,
                 'start_time': start_time,
                 'end_date': end_date,
                 'end_time': end_time,
                 'total_price': total_price,
-                'days': days,
-                'remaining_hours': remaining_hours,
                 'reserve_iva': reserve_iva,
                 'price_per_day': price_per_day,
-                'imagens': vehicle.get_imagens() if hasattr(vehicle, 'get_imagens') else None  # Adiciona as imagens
-                # ao item (Esta linha vai buscar as imagens de cada veículo individualmente). Utilizou-se o "
-                # hasattr" de forma a evitar erros como AttributeError, pois, ela é uma função built-in do Python que
-                # verifica se um objeto tem um determinado atributo ou método. E ela busca o 'get_imagens' que vem da
-                # função def get_imagens(self) contida no models.py
             }
 
             # Verifica se está em modo de edição
@@ -163,7 +182,7 @@ def reserve_vehicle(id):
                 # de edição da sessão e o armazena na variável cart_index
                 cart[cart_index] = reservation_item  # Substitui o item no carrinho pelo novo item de reserva usando
                 # o índice extraído
-                session.pop('edit_item_original', None)  # Remove as variáveis relacionadas à edição da sessão para
+                clear_edit_original()  # Remove as variáveis relacionadas à edição da sessão para
                 # limpar o estado de edição
                 session.pop('is_editing', None)  # Remove as variáveis relacionadas à edição da sessão para limpar o
                 # estado de edição e Limpa o estado de edição após concluir a atualização
@@ -186,10 +205,10 @@ def reserve_vehicle(id):
                 cart.append(reservation_item)  # Se não houver duplicação, adiciona o novo item de reserva ao carrinho
                 flash('Veículo adicionado ao carrinho com sucesso!', 'success')
 
-            session['reservation_cart'] = cart  # Armazena o carrinho de reservas atualizado (cart) na sessão do
-            # usuário com a chave 'reservation_cart'
-            session.modified = True  # Garante que as mudanças na sessão sejam salvas principalmente quando é
-            # adicionado um veículo novo a lista de reserva com as suas especificações como a imagem e não só
+            save_cart(cart)  # Guarda o carrinho de reservas atualizado (cart) no servidor, a sessão do
+            # usuário guarda apenas o ID do carrinho
+            session.modified = True  # Garante que as mudanças na sessão sejam salvas (estado de edição e ID do
+            # carrinho criado no primeiro veículo adicionado)
 
             return redirect(url_for('user.confirm_reserve', id=id))
 
@@ -200,20 +219,19 @@ def reserve_vehicle(id):
     # Handler para "Cancelar" ou "Ver carrinho" durante o modo edição
     if is_editing and request.args.get('action') in ['cancel', 'view_cart']:
         # Se tiver um item original salvo na sessão e se a ação for cancelar
-        if request.args.get('action') == 'cancel' and 'edit_item_original' in session:
+        original_item = get_edit_original() if request.args.get('action') == 'cancel' else None
+        if original_item is not None:
             # Restaura o item original no carrinho
-            cart = session.get('reservation_cart', [])
-            original_item = session.get('edit_item_original')
             edit_index = session.get('edit_item_index')
 
             if edit_index is not None and edit_index < len(cart):
                 cart[edit_index] = original_item
-                session['reservation_cart'] = cart
+                save_cart(cart)
                 flash('Edição cancelada. A reserva foi mantida como estava anteriormente.', 'warning')
 
         # Limpa todas as variáveis de sessão relacionadas à edição
         session.pop('edit_item_index', None)
-        session.pop('edit_item_original', None)
+        clear_edit_original()
         session.pop('is_editing', None)
         session.modified = True
 
@@ -222,11 +240,20 @@ def reserve_vehicle(id):
         else:  # para o view_cart
             return redirect(url_for('user.view_cart'))
 
-    # Para GET request
-    if not vehicle.is_available():
+    # Para GET request. Se vier de uma pesquisa por período, basta o veículo estar livre nesse período
+    try:
+        janela = parse_datetime_window(request.args)
+    except ValueError:
+        janela = None
+
+    if not vehicle.is_available() and not (janela and vehicle.is_free_between(*janela)):
         flash('Este veículo não está disponível para reserva.', 'error')
         return redirect(url_for('list_vehicle'))
 
+    # Pré-preenche o formulário com o período pesquisado (exceto em modo de edição)
+    if janela and not existing_item:
+        existing_item = {key: request.args.get(key, '') for key in ('start_date', 'start_time', 'end_date', 'end_time')}
+
     return render_template('user/reserve_vehicle.html', vehicle=vehicle,
                            edit_data=existing_item,
                            is_editing=is_editing)
@@ -235,16 +262,10 @@ def reserve_vehicle(id):
 @bp.route('/user/confirm_reserve/<int:id>', methods=['GET'])
 @client_required
 def confirm_reserve(id):
-    # Inicializa o carrinho
-    init_reservation_cart()
-    cart = session.get('reservation_cart', [])
+    # Obtém o carrinho
+    cart = get_cart()
     vehicle = Veiculos.query.get_or_404(id)
 
-    # Garantir que todos os itens do carrinho tenham o elemento remaining_hours
-    for item in cart:
-        if 'remaining_hours' not in item:
-            item['remaining_hours'] = 0
-
     # Verificação para carrinho vazio
     if not cart and not (request.args.get('start_date') and request.args.get('end_date')):
         flash('Não existe nenhum veículo na reserva!', 'warning')
@@ -255,7 +276,7 @@ def confirm_reserve(id):
         total_reservation_price = sum(float(item['total_price']) for item in cart)
         total_vehicles = len(cart)
         return render_template('user/confirm_reserve.html',
-                               cart=cart,
+                               cart=cart_display_items(cart)[0],
                                vehicle=vehicle,
                                total_price=total_reservation_price,
                                total_vehicles=total_vehicles)
@@ -272,40 +293,20 @@ def confirm_reserve(id):
     total_price_no_iva = float(total_price) / (1 + IVA)
     reserve_iva = total_price - total_price_no_iva
 
-    # Calcular dias e horas
-    try:
-        start_datetime = datetime.strptime(f"{start_date} {start_time}", "%Y-%m-%d %H:%M")
-        end_datetime = datetime.strptime(f"{end_date} {end_time}", "%Y-%m-%d %H:%M")
-        total_hours = (end_datetime - start_datetime).total_seconds() / 3600
-        days = total_hours // 24  # Número inteiro de dias
-        remaining_hours = total_hours % 24  # Horas restantes
-    except (ValueError, TypeError):
-        days = 0
-        remaining_hours = 0
-
     # Criar um cart com um único item
     single_item = {
         'vehicle_id': vehicle.id,
-        'brand': vehicle.brand,
-        'model': vehicle.model,
         'start_date': start_date,
         'start_time': start_time,
         'end_date': end_date,
         'end_time': end_time,
         'total_price': total_price,
-        'days': days,
-        'remaining_hours': remaining_hours,
         'reserve_iva': reserve_iva,
         'price_per_day': vehicle.price_per_day,
-        'imagens': vehicle.get_imagens() if hasattr(vehicle, 'get_imagens') else None
     }
 
-    # Verificar se 'remaining_hours' foi definido
-    if 'remaining_hours' not in single_item:
-        single_item['remaining_hours'] = 0
-
     return render_template('user/confirm_reserve.html',
-                           cart=[single_item],
+                           cart=cart_display_items([single_item])[0],
                            vehicle=vehicle,
                            total_price=total_price,
                            total_vehicles=1)  # Para caso de item único
@@ -314,8 +315,7 @@ def confirm_reserve(id):
 @bp.route('/user/remove_from_cart/<int:vehicle_id>', methods=['POST'])
 @client_required
 def remove_from_cart(vehicle_id):
-    cart = session.get('reservation_cart', [])  # Caso "reservation_cart" não existir na sessão, retorna uma lista
-    # vazia [] em vez de dar erro.
+    cart = get_cart()  # Caso o carrinho ainda não exista, retorna uma lista vazia [] em vez de dar erro.
 
     # Encontrar o veículo removido
     removed_vehicle = next((item for item in cart if item['vehicle_id'] == vehicle_id), None)  # Esta linha utiliza o
@@ -324,8 +324,7 @@ def remove_from_cart(vehicle_id):
 
     # Atualizar o carrinho removendo o veículo
     cart = [item for item in cart if item['vehicle_id'] != vehicle_id]
-    session['reservation_cart'] = cart  # A linha tem como função atualizar sempre o carrinho e salva na sessão,
-    # isto porque o flask não detecta automaticamente mudanças em estreuturas de dados complexos
+    save_cart(cart)  # A linha tem como função atualizar sempre o carrinho guardado no servidor
 
     # Verificação para carrinho vazio após remoção
     if not cart:
@@ -333,8 +332,9 @@ def remove_from_cart(vehicle_id):
         return redirect(url_for('list_vehicle'))
 
     # Ao remover um veículo, irá aparecer uma mensagem com o veículo que foi removido
-    if removed_vehicle:
-        flash(f"O veículo {removed_vehicle['brand']} {removed_vehicle['model']} foi removido da reserva.", 'success')
+    vehicle = db.session.get(Veiculos, vehicle_id) if removed_vehicle else None
+    if vehicle:
+        flash(f"O veículo {vehicle.brand} {vehicle.model} foi removido da reserva.", 'success')
     else:
         flash('Veículo removido da reserva.', 'success')
 
@@ -344,8 +344,7 @@ def remove_from_cart(vehicle_id):
 @bp.route('/user/view_cart', methods=['GET'])
 @client_required
 def view_cart():
-    init_reservation_cart()
-    cart = session.get('reservation_cart', [])
+    cart = get_cart()
 
     if not cart:
         flash('Não existe nenhum veículo no carrinho!', 'warning')
@@ -354,9 +353,11 @@ def view_cart():
     total_price = sum(float(item['total_price']) for item in cart)
     total_vehicles = len(cart)
 
+    # Todos os veículos do carrinho numa única query IN
+    items, vehicles = cart_display_items(cart)
+
     # Obter o primeiro veículo do carrinho para manter compatibilidade com o template
-    first_vehicle = Veiculos.query.get(cart[0]['vehicle_id']) if cart else None
-    vehicles = {item['vehicle_id']: Veiculos.query.get(item['vehicle_id']) for item in cart}
+    first_vehicle = vehicles.get(cart[0]['vehicle_id']) if cart else None
 
     # Calcular IVA e outros detalhes necessários
     IVA = 0.23
@@ -364,7 +365,7 @@ def view_cart():
     reserve_iva = total_price - total_price_no_iva
 
     return render_template('user/confirm_reserve.html',
-                           cart=cart,
+                           cart=items,
                            total_price=total_price,
                            total_price_no_iva=total_price_no_iva,
                            reserve_iva=reserve_iva,
@@ -380,7 +381,7 @@ def view_cart():
 @bp.route('/user/payment_method', methods=['GET'])
 @client_required
 def payment_method():
-    cart = session.get('reservation_cart', [])
+    cart = get_cart()
 
     # Verificação para carrinho vazio
     if not cart:
@@ -397,7 +398,7 @@ def payment_method():
     reserve_iva = total_price - total_price_no_iva
 
     return render_template('user/payment_method.html',
-                           cart=cart,
+                           cart=cart_display_items(cart)[0],
                            total_price=total_price,
                            total_price_no_iva=total_price_no_iva,
                            reserve_iva=reserve_iva,
@@ -408,50 +409,35 @@ def payment_method():
 @client_required
 def create_reservation():
     payment_method = request.form.get('payment_method')
-    cart = session.get('reservation_cart', [])
+    cart = get_cart()
+
+    if not cart:
+        flash('Não existe veículos no carrinho.', 'error')
+        return redirect(url_for('list_vehicle'))
 
     try:
-        if not cart:
-            flash('Não existe veículos no carrinho.', 'error')
-            return redirect(url_for('list_vehicle'))
-
-        if cart:
-            # processamento de múltiplas reservas
-            for item in cart:
-                start_datetime = datetime.strptime(f"{item['start_date']} {item['start_time']}", "%Y-%m-%d %H:%M")
-                end_datetime = datetime.strptime(f"{item['end_date']} {item['end_time']}", "%Y-%m-%d %H:%M")
-
-                # Calcular a duração em horas
-                duration = (end_datetime - start_datetime).total_seconds() / 3600
-
-                vehicle = Veiculos.query.get(item['vehicle_id'])
-
-                vehicle.is_reserved = True  # Define o status do veículo como reservado no banco de dados e, marca-o
-                # como reservado para garantir que apareça como "Reservado" na interface
-
-                new_reservation = Reservation(
-                    customer_id=current_user.id,
-                    veiculo_id=vehicle.id,
-                    start_date=start_datetime.date(),
-                    start_time=start_datetime.time(),
-                    end_date=end_datetime.date(),
-                    end_time=end_datetime.time(),
-                    duration=duration,
-                    price=item['total_price'],
-                    payment_method=payment_method,
-                    status='Pendente'  # Fica 'Pendente' até confirmação de pagamento da parte do cliente
-                )
-
-                db.session.add(new_reservation)
-                vehicle.update_availability_after_reservation(end_datetime)
-
-        db.session.commit()
-        session.pop('reservation_cart', None)  # limpeza do carrinho
+        # Converte as datas e horas de cada item do carrinho
+        items = [{
+            'vehicle_id': item['vehicle_id'],
+            'start_datetime': datetime.strptime(f"{item['start_date']} {item['start_time']}", "%Y-%m-%d %H:%M"),
+            'end_datetime': datetime.strptime(f"{item['end_date']} {item['end_time']}", "%Y-%m-%d %H:%M"),
+            'price': item['total_price'],
+        } for item in cart]
+
+        # Todas as reservas do carrinho são criadas numa só transação, depois de verificar que nenhum veículo tem
+        # reservas ou manutenções no mesmo período
+        Reservation.create_batch(current_user.id, items, payment_method)
+        invalidate_dashboard_counts()  # Os veículos reservados mudaram de estado
+
+        clear_cart()  # limpeza do carrinho
         flash(f'Reserva(s) realizada(s) com sucesso!', 'success')
         return redirect(url_for('user.confirmation_page'))
 
+    except ReservationConflictError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('user.view_cart'))
+
     except Exception as e:
-        db.session.rollback()
         flash(f'Erro ao criar reserva: {str(e)}', 'error')
         return redirect(url_for('user.payment_method'))
 
@@ -459,31 +445,19 @@ def create_reservation():
 @bp.route('/user/confirmation_page')
 @client_required
 def confirmation_page():
-    # Obter todas as reservas do cliente ordenadas por ID em ordem decrescente
-    reservations = Reservation.query.filter_by(customer_id=current_user.id).order_by(Reservation.id.desc()).all()
+    # Reservas do último checkout do cliente (todas partilham o mesmo checkout_id)
+    latest_reservations = Reservation.latest_checkout(current_user.id)
 
-    if not reservations:
+    if not latest_reservations:
         flash('Não foi encontrada nenhuma reserva!', 'error')
         return redirect(url_for('list_vehicle'))
 
-    # Apanha as reservas mais recentes (do último conjunto)
-    latest_reservations = []
-    if reservations and reservations[0].created_at:  # Verifica se existe created_at
-        latest_timestamp = reservations[0].created_at  # Assumindo que há um campo created_at
-        for res in reservations:
-            if res.created_at and abs((res.created_at - latest_timestamp).total_seconds()) < 1:  # Reservas feitas no mesmo segundo
-                latest_reservations.append(res)
-    else:
-        # Se não houver timestamp, será utilizado apenas a primeira reserva
-        latest_reservations = [reservations[0]]
-
-    # Obter detalhes do cliente
-    cliente = Clientes.query.get(current_user.id)
+    # Detalhes do cliente (já carregado pelo load_user)
+    cliente = current_user._get_current_object()
 
-    # Obter detalhes dos veículos
-    vehicles = {}
-    for reservation in latest_reservations:
-        vehicles[reservation.veiculo_id] = Veiculos.query.get(reservation.veiculo_id)
+    # Obter detalhes dos veículos numa única query IN
+    vehicles = {vehicle.id: vehicle for vehicle in Veiculos.query.filter(
+        Veiculos.id.in_([reservation.veiculo_id for reservation in latest_reservations])).all()}
 
     # Calcular o preço total
     total_price = sum(item.price for item in latest_reservations)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Admin, Clientes
+
+# ------------------------------- Cache dos utilizadores autenticados ---------------------------------------------
+
+# O Flask-Login chama o load_user em todos os pedidos autenticados. Em vez de ir sempre à base de dados, guarda-se
+# durante USER_CACHE_TTL segundos um registo leve (só os valores das colunas) de cada utilizador, indexado pelo ID
+# com prefixo ('client_5', 'admin_1'). A cache é de cada processo, por isso as rotas que alteram ou apagam um
+# utilizador têm de chamar invalidate_user para que as alterações se vejam logo neste processo (nos outros ficam
+# visíveis ao fim do TTL)
+USER_MODELS = {'admin': Admin, 'client': Clientes}
+MAX_CACHED_USERS = 1000
+
+_records = {}  # ID com prefixo -> (expira_em, {coluna: valor})
+_lock = threading.Lock()
+
+
+def _get_record(user_id):
+    with _lock:
+        entry = _records.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _records[user_id]
+            return None
+        return entry[1]
+
+
+def _to_record(user):
+    return {column.key: getattr(user, column.key) for column in user.__mapper__.column_attrs}
+
+
+def _from_record(model, record):
+    # Reconstrói o objeto sem passar pelo __init__ (que voltaria a encriptar a password) e associa-o à sessão atual
+    # sem nenhuma query, como se tivesse sido carregado da base de dados. Pode ser alterado e guardado normalmente
+    user = model.__mapper__.class_manager.new_instance()
+    for key, value in record.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_cached_user(user_id, ttl):
+    """
+    Carrega o utilizador (Admin ou Clientes) a partir do ID com prefixo guardado na sessão, usando a cache.
+
+    Args:
+        user_id (str): ID com prefixo ('admin_1' ou 'client_5')
+        ttl (int): Tempo em segundos que o registo fica em cache, 0 desativa a cache
+
+    Returns:
+        Admin, Clientes ou None se o ID não for válido ou o utilizador não existir
+    """
+    prefix, _, raw_id = user_id.partition('_')
+    model = USER_MODELS.get(prefix)
+    if model is None or not raw_id.isdigit():
+        return None
+
+    record = _get_record(user_id) if ttl else None
+    if record is not None:
+        return _from_record(model, record)
+
+    user = db.session.get(model, int(raw_id))
+    if user is not None and ttl:
+        now = time.monotonic()
+        with _lock:
+            if len(_records) >= MAX_CACHED_USERS:  # Limpa os registos expirados antes de a cache crescer mais
+                for key in [key for key, (expires_at, _) in _records.items() if expires_at <= now]:
+                    del _records[key]
+            _records[user_id] = (now + ttl, _to_record(user))
+    return user
+
+
+def invalidate_user(user):
+    """Remove o utilizador da cache (depois de o alterar ou apagar)."""
+    with _lock:
+        _records.pop(user.get_id(), None)
+
+
+def clear_user_cache():
+    with _lock:
+        _records.clear()
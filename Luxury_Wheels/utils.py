@@ -1,3 +1,9 @@
+import base64
+import json
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import tuple_, and_, or_
 
 
 # Está função verifica se o nome do arquivo contém um ponto (.), o que indica a presença de uma extensão como PNG,
@@ -6,4 +12,152 @@
 # e verifica se a extensão está na lista de extensões permitidas.
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
\ No newline at end of file
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+# Lê um período (data/hora de início e fim) dos parâmetros de um pedido, nos mesmos campos usados no formulário de
+# reserva (start_date, start_time, end_date, end_time). Se as horas não forem indicadas, o período começa às 00:00 do
+# primeiro dia e termina às 23:59 do último
+def parse_datetime_window(args):
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    if not start_date or not end_date:
+        return None
+
+    start_datetime = datetime.strptime(f"{start_date} {args.get('start_time') or '00:00'}", "%Y-%m-%d %H:%M")
+    end_datetime = datetime.strptime(f"{end_date} {args.get('end_time') or '23:59'}", "%Y-%m-%d %H:%M")
+    if start_datetime >= end_datetime:
+        raise ValueError('A data de início deve ser anterior à data do fim.')
+    return start_datetime, end_datetime
+
+
+# ------------------------------- Pesquisa por prefixo --------------------------------------
+
+# Normaliza um texto para pesquisa: remove acentos, converte para minúsculas e junta espaços repetidos
+# (ex.: " José  Conceição" -> "jose conceicao")
+def normalize_text(value):
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+# Filtro "começa por" escrito como intervalo (coluna >= prefixo AND coluna < prefixo seguinte), que ao contrário do
+# LIKE pode usar o índice normal da coluna em qualquer base de dados
+def prefix_filter(column, prefix):
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper_bound)
+
+
+# Filtro "começa por" para colunas inteiras (ex.: NIF). Os números que começam por 12 com 9 dígitos estão entre
+# 120000000 e 129999999, por isso cada comprimento possível é um intervalo sobre o índice da coluna
+def integer_prefix_filter(column, digits, max_digits=9):
+    if len(digits) >= max_digits:
+        return column == int(digits)
+    prefix = int(digits)
+    ranges = []
+    for length in range(len(digits), max_digits + 1):
+        scale = 10 ** (length - len(digits))
+        ranges.append(column.between(prefix * scale, (prefix + 1) * scale - 1))
+    return or_(*ranges)
+
+
+# ------------------------------- Paginação por cursor (keyset) --------------------------------------
+
+# O cursor guarda os valores das colunas de ordenação da última (ou primeira) linha da página, codificados em base64
+# para poderem ir no URL. Assim a página seguinte é obtida com um "WHERE (colunas) > (valores)" sobre um índice, em vez
+# de um OFFSET, e as páginas mais avançadas custam o mesmo que a primeira.
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+# Tipos que um cursor pode ter (os das colunas de ordenação). Um cursor alterado à mão com outro tipo de valor (ex:
+# um objeto JSON) não chega à query
+CURSOR_VALUE_TYPES = (str, int, float, type(None))
+
+
+def decode_cursor(cursor, length=None):
+    """
+    Lê um cursor criado por encode_cursor.
+
+    Args:
+        cursor (str): Cursor recebido no URL
+        length (int): Número de valores esperado (o número de colunas de ordenação)
+
+    Returns:
+        list: Valores do cursor, ou None se o cursor for inválido
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        return None
+    if not all(isinstance(value, CURSOR_VALUE_TYPES) and not isinstance(value, bool) for value in values):
+        return None
+    return values
+
+
+class KeysetPage:
+    """Resultado de uma página obtida com keyset_paginate."""
+
+    def __init__(self, items, has_next, has_prev, next_cursor, prev_cursor, per_page, total=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor  # Cursor a usar em ?after= para a página seguinte
+        self.prev_cursor = prev_cursor  # Cursor a usar em ?before= para a página anterior
+        self.per_page = per_page
+        self.total = total  # Só é calculado quando pedido (with_total=True)
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None, with_total=False):
+    """
+    Pagina uma query por cursor (keyset / seek) sobre as colunas indicadas.
+
+    Args:
+        query: Query do SQLAlchemy já com os filtros aplicados
+        columns (list): Colunas de ordenação, a última deve ser única (ex.: a chave primária)
+        per_page (int): Número de linhas por página
+        after (str): Cursor da última linha da página anterior (avança)
+        before (str): Cursor da primeira linha da página seguinte (recua)
+        with_total (bool): Se True, calcula também o número total de linhas (query COUNT extra)
+
+    Returns:
+        KeysetPage: Linhas da página e cursores para navegar
+    """
+    total = query.order_by(None).count() if with_total else None
+
+    # Um cursor inválido (alterado à mão) é ignorado e devolve a primeira página
+    after_values = decode_cursor(after, len(columns)) if after else None
+    before_values = decode_cursor(before, len(columns)) if before else None
+
+    # A recuar, percorre o índice no sentido inverso e depois repõe a ordem das linhas
+    backwards = before_values is not None and after_values is None
+    if backwards:
+        query = query.filter(tuple_(*columns) < tuple_(*before_values))
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        if after_values is not None:
+            query = query.filter(tuple_(*columns) > tuple_(*after_values))
+        query = query.order_by(*columns)
+
+    # Pede uma linha a mais para saber se existe mais alguma página nesse sentido
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after_values is not None
+
+    def row_cursor(row):
+        return encode_cursor(getattr(row, column.key) for column in columns)
+
+    next_cursor = row_cursor(rows[-1]) if rows and has_next else None
+    prev_cursor = row_cursor(rows[0]) if rows and has_prev else None
+
+    return KeysetPage(rows, has_next, has_prev, next_cursor, prev_cursor, per_page, total)